@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+""" Times _fix_14_exclusions and _extra_dihedrals on topologies of
+increasing numbers of long polymer chains, against the previous
+implementations, which searched per-atom lists, and checks that both give
+the same results.
+
+Usage: python benchmarks/bench_14.py [--chain_length L] [NUM_CHAINS ...]
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import gromos2amber.Topology as topology_module
+from gromos2amber.Topology import Topology, Interactions
+from synthetic import write_topology
+
+def legacy_fix_14_exclusions(atoms, dihedral_tables):
+    prev_l = [ [] for i in range(len(atoms)) ]
+    for dihedrals in dihedral_tables:
+        for dihedral in dihedrals:
+            i, l = dihedral.atoms[0], dihedral.atoms[3]
+            i, l = (i,l) if i<l else (l,i)
+            if l in atoms.exclusions_wo14[i] or l in prev_l[i]:
+                dihedral.exclude_14()
+            prev_l[i].append(l)
+
+def legacy_extra_dihedrals(atoms, dihedrals_wH, dihedrals_woH, dummy_typecode):
+    extra = Interactions(4)
+    found = [ { n14:False for n14 in neighbours } for neighbours in atoms.neigh14 ]
+    for dihedrals in (dihedrals_wH, dihedrals_woH):
+        for dihedral in dihedrals:
+            i, l = dihedral.atoms[0], dihedral.atoms[3]
+            i, l = (i,l) if i<l else (l,i)
+            found[i][l] = True
+    for i,neighbours in enumerate(atoms.neigh14):
+        for l in neighbours:
+            if not found[i][l]:
+                extra.atoms.extend((i,i,l,l))
+                extra.typecodes.append(dummy_typecode)
+                extra.exclude14.append(0)
+    return extra
+
+def unflagged(dihedrals, num_dihedrals):
+    """ The first num_dihedrals of a table, without exclude-14 flags """
+    return Interactions(4, dihedrals.atoms[:4*num_dihedrals],
+                        dihedrals.typecodes[:num_dihedrals])
+
+def run(fix_14_exclusions, extra_dihedrals, topology):
+    wH = unflagged(topology.dihedrals_wH, len(topology.dihedrals_wH))
+    woH = unflagged(topology.dihedrals_woH, len(topology.dihedrals_woH)
+                                            - topology.num_extra_dihedrals)
+    start = time.perf_counter()
+    fix_14_exclusions(topology.atoms, [wH, woH])
+    fixed = time.perf_counter()
+    extra = extra_dihedrals(topology.atoms, wH, woH,
+                            len(topology.dihedral_types)-1)
+    end = time.perf_counter()
+    return (fixed-start, end-fixed), (wH.exclude14, woH.exclude14,
+                                      extra.atoms, extra.typecodes)
+
+def main(chain_length, sizes):
+    with tempfile.TemporaryDirectory() as directory:
+        for num_chains in sizes:
+            path = os.path.join(directory, "polymer.top")
+            with open(path, "w") as f:
+                write_topology(f, num_chains, chain_length)
+            topology = Topology(path)
+            new_times, new = run(topology_module._fix_14_exclusions,
+                                 topology_module._extra_dihedrals, topology)
+            old_times, old = run(legacy_fix_14_exclusions,
+                                 legacy_extra_dihedrals, topology)
+            if not new == old:
+                raise Exception("results differ from the previous version")
+            print("{} atoms, {} dihedrals: "\
+                  "_fix_14_exclusions {:.3f} s (previously {:.3f} s), "\
+                  "_extra_dihedrals {:.3f} s (previously {:.3f} s)".format(
+                      len(topology.atoms),
+                      len(topology.dihedrals_wH) + len(topology.dihedrals_woH),
+                      new_times[0], old_times[0],
+                      new_times[1], old_times[1]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__.split("\n")[0])
+    # synthetic topologies have room for 4 digit atom names and 5 digit
+    # atom numbers
+    parser.add_argument("--chain_length", type = int, default = 5000)
+    parser.add_argument("num_chains", type = int, nargs = "*",
+                        default = [ 1, 3, 9 ])
+    args = parser.parse_args()
+    main(args.chain_length, args.num_chains)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+""" Times conversions of a large solvated synthetic system with compressed
+inputs and outputs, against the uncompressed conversion, writing the
+results as JSON.
+
+For each compression, the inputs are compressed beforehand and the outputs
+are written compressed, on one thread and on each number of threads given,
+and checked against the uncompressed outputs. Throughput is in megabytes
+of uncompressed output per second.
+
+Usage: python benchmarks/bench_compression.py [--molecules N] [--solvent N]
+           [--compression gzip|xz|bz2 ...] [--threads N ...] [--output FILE]
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from gromos2amber import convert
+from gromos2amber.gromos_format import read_buffer
+from gromos2amber.compressed_format import open_output, CompressedWriter, \
+        EXTENSIONS
+from gromos2amber.TopologyCache import PACKAGE_VERSION
+from synthetic import write_topology, write_configuration
+
+SUFFIXES = { compression : extension
+             for extension, compression in EXTENSIONS.items() }
+
+def compress_file(path, compression):
+    """ The path of a compressed copy of path, as a single-threaded
+    compressor would write it """
+    compressed = path + SUFFIXES[compression]
+    with open(path, "rb") as source, \
+            CompressedWriter(open(compressed, "wb"), compression,
+                             threads = 1) as output:
+        output.write(source.read())
+    return compressed
+
+def run(topology_in, config_in, topology_out, config_out, threads):
+    start = time.perf_counter()
+    with open_output(topology_out, "w", threads = threads) as tout, \
+            open_output(config_out, "w", threads = threads) as cout:
+        convert(topology_in, tout, config_in = config_in, config_out = cout)
+    return time.perf_counter() - start
+
+def main(args):
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        topology_path = os.path.join(directory, "in.top")
+        config_path = os.path.join(directory, "in.g96")
+        with open(topology_path, "w") as f:
+            num_atoms = write_topology(f, args.molecules)
+        with open(config_path, "w") as f:
+            write_configuration(f, num_atoms, args.solvent)
+        prmtop = os.path.join(directory, "out.prmtop")
+        inpcrd = os.path.join(directory, "out.inpcrd")
+        elapsed = run(topology_path, config_path, prmtop, inpcrd, 1)
+        expected = [ bytes(read_buffer(path)) for path in (prmtop, inpcrd) ]
+        output_bytes = sum(len(data) for data in expected)
+        results["none"] = {
+            "seconds" : elapsed,
+            "megabytes_per_second" : output_bytes/elapsed/1e6,
+        }
+        sys.stderr.write("uncompressed: {:.2f} s\n".format(elapsed))
+        for compression in args.compression:
+            topology_in = compress_file(topology_path, compression)
+            config_in = compress_file(config_path, compression)
+            suffix = SUFFIXES[compression]
+            result = {
+                "input_bytes" : os.path.getsize(topology_in)
+                                + os.path.getsize(config_in),
+                "threads" : {},
+            }
+            for threads in sorted(set([ 1 ] + args.threads)):
+                elapsed = run(topology_in, config_in, prmtop + suffix,
+                              inpcrd + suffix, threads)
+                outputs = [ bytes(read_buffer(path + suffix))
+                            for path in (prmtop, inpcrd) ]
+                if not outputs == expected:
+                    raise Exception("{} outputs differ from the "\
+                                    "uncompressed outputs".format(compression))
+                result["threads"][str(threads)] = {
+                    "seconds" : elapsed,
+                    "megabytes_per_second" : output_bytes/elapsed/1e6,
+                    "output_bytes" : os.path.getsize(prmtop + suffix)
+                                     + os.path.getsize(inpcrd + suffix),
+                }
+                sys.stderr.write("{}, {} threads: {:.2f} s\n".format(
+                    compression, threads, elapsed))
+            results[compression] = result
+    report = {
+        "version" : PACKAGE_VERSION,
+        "python" : platform.python_version(),
+        "platform" : platform.platform(),
+        "cpus" : os.cpu_count(),
+        "molecules" : args.molecules,
+        "solvent" : args.solvent,
+        "atoms" : num_atoms + 3*args.solvent,
+        "output_bytes" : output_bytes,
+        "results" : results,
+    }
+    output = sys.stdout if args.output == None else open(args.output, "w")
+    json.dump(report, output, indent = 1)
+    output.write("\n")
+    if not output == sys.stdout:
+        output.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__.split("\n")[0])
+    parser.add_argument("--molecules", type = int, default = 1000)
+    parser.add_argument("--solvent", type = int, default = 100000)
+    parser.add_argument("--compression", action = "append",
+                        choices = sorted(SUFFIXES),
+                        help = "May be repeated. (Default: gzip xz bz2)")
+    parser.add_argument("--threads", type = int, action = "append",
+                        help = "Compressing threads; may be repeated. "
+                               "(Default: one per CPU)")
+    parser.add_argument("--output", help = "JSON output file (Default: stdout)")
+    args = parser.parse_args()
+    if args.compression == None:
+        args.compression = [ "gzip", "xz", "bz2" ]
+    if args.threads == None:
+        args.threads = [ os.cpu_count() or 1 ]
+    main(args)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+""" Times reading every section of a large synthetic prmtop with
+AmberTopologyReader, and comparing it section by section with a copy of
+itself and with its Topology, as gromos2amber_diff does, writing the
+results as JSON.
+
+Usage: python benchmarks/bench_diff.py [--molecules N] [--solvent N]
+           [--output FILE]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from gromos2amber.Topology import Topology
+from gromos2amber.AmberTopologyWriter import AmberTopologyWriter
+from gromos2amber.AmberTopologyReader import AmberTopologyReader
+from gromos2amber.AmberTopologyDiff import TopologySections, diff_sections
+from gromos2amber.TopologyCache import PACKAGE_VERSION
+from synthetic import write_topology
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def read_all(path):
+    reader = AmberTopologyReader(path)
+    return reader, sum( len(reader[title]) for title in reader )
+
+def main(args):
+    with tempfile.TemporaryDirectory() as directory:
+        topology_path = os.path.join(directory, "in.top")
+        prmtop = os.path.join(directory, "out.prmtop")
+        copy = os.path.join(directory, "copy.prmtop")
+        with open(topology_path, "w") as f:
+            write_topology(f, args.molecules)
+        topology = Topology(topology_path)
+        topology.add_solvent(args.solvent, "SOL")
+        with open(prmtop, "w") as f:
+            _, write_seconds = timed(AmberTopologyWriter(topology).write, f)
+        shutil.copyfile(prmtop, copy)
+        (reader, num_values), read_seconds = timed(read_all, prmtop)
+        differences, prmtop_seconds = timed(
+            diff_sections, reader, AmberTopologyReader(copy))
+        from_topology, topology_seconds = timed(
+            diff_sections, reader, TopologySections(topology))
+        differences += from_topology
+        if len(differences) > 0:
+            raise Exception("the prmtop differs from its topology: "
+                            + str(differences[0]))
+        report = {
+            "version" : PACKAGE_VERSION,
+            "python" : platform.python_version(),
+            "platform" : platform.platform(),
+            "atoms" : topology.num_atoms(),
+            "prmtop_bytes" : os.path.getsize(prmtop),
+            "values" : num_values,
+            "write_seconds" : write_seconds,
+            "read_seconds" : read_seconds,
+            "diff_prmtop_seconds" : prmtop_seconds,
+            "diff_topology_seconds" : topology_seconds,
+        }
+    sys.stderr.write("{} atoms: read {:.2f} s, diff against a prmtop {:.2f} s, "
+                     "against the topology {:.2f} s (written in {:.2f} s)\n"
+                     .format(report["atoms"], read_seconds, prmtop_seconds,
+                             topology_seconds, write_seconds))
+    output = sys.stdout if args.output == None else open(args.output, "w")
+    json.dump(report, output, indent = 1)
+    output.write("\n")
+    if not output == sys.stdout:
+        output.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__.split("\n")[0])
+    parser.add_argument("--molecules", type = int, default = 1000)
+    parser.add_argument("--solvent", type = int, default = 330000)
+    parser.add_argument("--output", help = "JSON output file (Default: stdout)")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+""" Throughput of fortran_format for every format code, in values per second,
+compared against the original one-format-field-per-value implementation.
+
+Usage: python benchmarks/bench_fortran_format.py [NUM_VALUES]
+"""
+
+import os
+import sys
+import random
+import timeit
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from gromos2amber.fortran_format import FORMAT_CODES, fortran_format
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def legacy_fortran_format(fortran_format_code, values):
+    format_line = FORMAT_CODES[fortran_format_code]
+    num_per_line = len(format_line)
+    format_codes = [] if len(values)>0 else ['\n']
+    newlines = 0
+    while True:
+        remaining = len(values) - (len(format_codes) - newlines)
+        if remaining <= 0: break
+        format_codes.extend( format_line[:min(remaining, num_per_line)] )
+        format_codes.append('\n')
+        newlines += 1
+    return ''.join(format_codes).format(*values)
+
+def sample_values(fortran_format_code, n):
+    rnd = random.Random(0)
+    if fortran_format_code == 'i2,a78':
+        return [1, "CHARMM force field"] * (n//2)
+    if fortran_format_code == 'i5,5e15.7':
+        return [ rnd.randint(0, 9999) if i%6 == 0 else rnd.uniform(-1e3, 1e3)
+                 for i in range(n) ]
+    code = FORMAT_CODES[fortran_format_code][0]
+    if code.endswith('s}'):
+        return [ 'AB'[:rnd.randint(0, 2)] + 'C' for i in range(n) ]
+    if code.endswith('d}'):
+        return [ rnd.randint(-99999, 999999) for i in range(n) ]
+    return [ rnd.uniform(-999.0, 999.0) for i in range(n) ]
+
+def best_time(func, repeat = 3):
+    return min(timeit.repeat(func, number = 1, repeat = repeat))
+
+def main(n):
+    print("{:<10s} {:>14s} {:>14s} {:>14s} {:>8s}".format(
+        "format", "legacy v/s", "list v/s", "array v/s", "speedup"))
+    for fortran_format_code in FORMAT_CODES:
+        values = sample_values(fortran_format_code, n)
+        expected = legacy_fortran_format(fortran_format_code, values)
+        if fortran_format(fortran_format_code, values) != expected:
+            raise Exception("Output differs for " + fortran_format_code)
+
+        if all(isinstance(v, int) for v in values):
+            typed = array('q', values)
+        elif all(isinstance(v, float) for v in values):
+            typed = array('d', values)
+        else:
+            typed = values
+        if numpy is not None and typed is not values:
+            typed = numpy.asarray(typed)
+        if fortran_format(fortran_format_code, typed) != expected:
+            raise Exception("Array output differs for " + fortran_format_code)
+
+        legacy = best_time(
+            lambda: legacy_fortran_format(fortran_format_code, values))
+        bulk = best_time(lambda: fortran_format(fortran_format_code, values))
+        bulk_typed = best_time(
+            lambda: fortran_format(fortran_format_code, typed))
+        print("{:<10s} {:>14.0f} {:>14.0f} {:>14.0f} {:>7.1f}x".format(
+            fortran_format_code, n/legacy, n/bulk, n/bulk_typed, legacy/bulk))
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+""" Times Configuration.gather_molecules on a bilayer-sized system of long
+chain molecules wrapped into a periodic box, against the previous
+bond-sweeping implementation, for rectangular and triclinic boxes.
+
+Usage: python benchmarks/bench_gather.py [NUM_LIPIDS] [ATOMS_PER_LIPID]
+"""
+
+import os
+import sys
+import time
+import random
+from array import array
+from math import floor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from gromos2amber.Configuration import Configuration, _box_vectors
+from gromos2amber.Topology import Interactions
+
+class ChainTopology:
+    def __init__(self, num_chains, chain_length):
+        self.atoms = [ None ]*(num_chains*chain_length)
+        self.bonds_wH = Interactions(2)
+        first_atoms = [ c*chain_length+k for c in range(num_chains)
+                                         for k in range(chain_length-1) ]
+        self.bonds_woH = Interactions.from_columns(
+            [ first_atoms, [ i+1 for i in first_atoms ] ],
+            [ 0 ]*len(first_atoms),
+        )
+
+def wrapped_chains(num_chains, chain_length, lengths, angles):
+    """ Random walks of 1.5 Angstrom steps, wrapped into the box """
+    rnd = random.Random(0)
+    vectors = _box_vectors(lengths, angles)
+    positions = array('d')
+    for c in range(num_chains):
+        x = [ rnd.uniform(0, length) for length in lengths ]
+        for k in range(chain_length):
+            x = [ xi + rnd.uniform(-0.9, 0.9) for xi in x ]
+            # wrap into the box, c then b then a
+            wrapped = list(x)
+            for d in (2, 1, 0):
+                n = floor(wrapped[d]/vectors[d][d])
+                for m in range(3):
+                    wrapped[m] -= n*vectors[d][m]
+            positions.extend(wrapped)
+    return positions
+
+def configuration(positions, boxtype, lengths, angles):
+    config = Configuration.__new__(Configuration)
+    config.positions = array('d', positions)
+    config.num_atoms = len(positions)//3
+    config.boxtype = boxtype
+    config.box_size, config.box_angle = list(lengths), list(angles)
+    return config
+
+def legacy_gather_molecules(config, topology):
+    x = config.positions
+    box = config.box_size
+    num_passes = 0
+    num_broken_bond_dims = 1
+    while num_broken_bond_dims > 0:
+        num_passes += 1
+        num_broken_bond_dims = 0
+        for bonds in (topology.bonds_wH, topology.bonds_woH):
+            for bond in bonds:
+                i,j = bond.atoms
+                for d in range(3):
+                    xi, xj = 3*i+d, 3*j+d
+                    if abs(x[xi]-x[xj]) > 0.5*box[d]:
+                        num_broken_bond_dims += 1
+                        if x[xi] > x[xj]:
+                            x[xj] += box[d]
+                        else:
+                            x[xi] += box[d]
+    return num_passes
+
+def max_bond_length(config, topology):
+    x = config.positions
+    return max(
+        sum( (x[3*i+d]-x[3*j+d])**2 for d in range(3) )**0.5
+        for i, j in ( bond.atoms for bond in topology.bonds_woH )
+    )
+
+def main(num_chains, chain_length):
+    topology = ChainTopology(num_chains, chain_length)
+    print("{} chains of {} atoms ({} atoms)".format(
+        num_chains, chain_length, num_chains*chain_length))
+    for boxtype, lengths, angles in (
+            (1, [120.0, 120.0, 90.0], [90.0, 90.0, 90.0]),
+            (2, [120.0, 120.0, 90.0], [70.0, 80.0, 60.0])):
+        positions = wrapped_chains(num_chains, chain_length, lengths, angles)
+        config = configuration(positions, boxtype, lengths, angles)
+        start = time.perf_counter()
+        config.gather_molecules(topology)
+        elapsed = time.perf_counter() - start
+        print("boxtype {}: gather_molecules {:.3f} s, "\
+              "longest bond {:.2f} A".format(
+                  boxtype, elapsed, max_bond_length(config, topology)))
+        if boxtype == 1:
+            config = configuration(positions, boxtype, lengths, angles)
+            start = time.perf_counter()
+            passes = legacy_gather_molecules(config, topology)
+            elapsed = time.perf_counter() - start
+            print("boxtype 1: legacy sweep {:.3f} s in {} passes, "\
+                  "longest bond {:.2f} A".format(
+                      elapsed, passes, max_bond_length(config, topology)))
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1024,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 130)
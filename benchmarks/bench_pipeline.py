@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+""" Times every phase of a conversion, and measures its memory, on
+synthetic systems of increasing size, writing the results as JSON so that
+scaling curves can be compared between versions.
+
+Each phase is run once untraced for its time, then again under tracemalloc
+for its peak memory (the increase in traced memory while it runs). The
+phases are block parsing, Topology construction (and within it
+_fix_14_exclusions and _extra_dihedrals), add_solvent, reading the
+configuration, gather_molecules, every section of the prmtop and the
+inpcrd.
+
+Usage: python benchmarks/bench_pipeline.py [--size MOLECULES,SOLVENT ...]
+           [--types K] [--chain_length L] [--output FILE]
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import tracemalloc
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import gromos2amber.Topology as topology_module
+from gromos2amber.Topology import Topology
+from gromos2amber.Configuration import Configuration
+from gromos2amber.GromosTopologyParser import GromosTopologyParser
+from gromos2amber.AmberTopologyWriter import AmberTopologyWriter
+from gromos2amber.AmberConfigurationWriter import AmberConfigurationWriter
+from gromos2amber.TopologyCache import PACKAGE_VERSION
+from synthetic import write_topology, write_configuration
+
+class NullWriter:
+    def write(self, text): pass
+
+class Measurements:
+    """ Records the time, or with traced True the peak memory, of phases """
+    def __init__(self, traced):
+        self.traced = traced
+        self.results = {}
+
+    @contextmanager
+    def phase(self, name):
+        if self.traced:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            yield
+            peak = tracemalloc.get_traced_memory()[1]
+            self.results.setdefault(name, {})["peak_bytes"] = peak - before
+        else:
+            start, cpu = time.perf_counter(), time.process_time()
+            yield
+            self.results.setdefault(name, {}).update({
+                "wall_seconds" : time.perf_counter() - start,
+                "cpu_seconds" : time.process_time() - cpu,
+            })
+
+    def wrap(self, module, name):
+        """ Measures every call of module.name until restored """
+        original = getattr(module, name)
+        def measured(*args, **kwargs):
+            with self.phase(name):
+                return original(*args, **kwargs)
+        setattr(module, name, measured)
+        return lambda: setattr(module, name, original)
+
+def run_pipeline(topology_path, config_path, measure):
+    with measure.phase("parse_blocks"):
+        GromosTopologyParser(topology_path).blocks
+    restore = [ measure.wrap(topology_module, name)
+                for name in ("_fix_14_exclusions", "_extra_dihedrals") ]
+    try:
+        with measure.phase("topology"):
+            topology = Topology(topology_path)
+    finally:
+        for undo in restore:
+            undo()
+    with measure.phase("configuration"):
+        config = Configuration(config_path)
+    with measure.phase("gather_molecules"):
+        config.gather_molecules(topology)
+    num_solvent = (config.num_atoms - len(topology.atoms)) \
+            // len(topology.solvent_atoms)
+    with measure.phase("add_solvent"):
+        topology.add_solvent(num_solvent, "SOL")
+    writer = AmberTopologyWriter(topology)
+    sections = writer._sections()
+    with measure.phase("prmtop"):
+        for title, _, _, _ in sections:
+            with measure.phase("section/" + title):
+                writer._render_section(title)
+    with measure.phase("inpcrd"):
+        AmberConfigurationWriter(config).write(NullWriter())
+    return {
+        "solute_atoms" : len(topology.atoms),
+        "solvent_molecules" : num_solvent,
+        "atoms" : topology.num_atoms(),
+    }
+
+def benchmark(num_molecules, num_solvent, num_types, chain_length, directory):
+    prefix = os.path.join(directory, "{}_{}".format(num_molecules, num_solvent))
+    topology_path, config_path = prefix + ".top", prefix + ".g96"
+    with open(topology_path, "w") as f:
+        num_atoms = write_topology(f, num_molecules, chain_length, num_types)
+    with open(config_path, "w") as f:
+        write_configuration(f, num_atoms, num_solvent,
+                            molecule_size = 2*chain_length)
+    timing, memory = Measurements(False), Measurements(True)
+    counts = run_pipeline(topology_path, config_path, timing)
+    tracemalloc.start()
+    try:
+        run_pipeline(topology_path, config_path, memory)
+    finally:
+        tracemalloc.stop()
+    phases = timing.results
+    for name, result in memory.results.items():
+        phases[name].update(result)
+    return {
+        "molecules" : num_molecules,
+        "solvent" : num_solvent,
+        "types" : num_types,
+        "chain_length" : chain_length,
+        "counts" : counts,
+        "topology_bytes" : os.path.getsize(topology_path),
+        "configuration_bytes" : os.path.getsize(config_path),
+        "phases" : phases,
+    }
+
+def main(args):
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.size:
+            num_molecules, num_solvent = ( int(n) for n in size.split(",") )
+            result = benchmark(num_molecules, num_solvent, args.types,
+                               args.chain_length, directory)
+            sys.stderr.write("{} atoms: prmtop {:.2f} s, total {:.2f} s\n"\
+                .format(result["counts"]["atoms"],
+                        result["phases"]["prmtop"]["wall_seconds"],
+                        sum( phase["wall_seconds"]
+                             for name, phase in result["phases"].items()
+                             if not "/" in name and not name.startswith("_") )))
+            results.append(result)
+    report = {
+        "version" : PACKAGE_VERSION,
+        "python" : platform.python_version(),
+        "platform" : platform.platform(),
+        "results" : results,
+    }
+    output = sys.stdout if args.output == None else open(args.output, "w")
+    json.dump(report, output, indent = 1)
+    output.write("\n")
+    if not output == sys.stdout:
+        output.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__.split("\n")[0])
+    parser.add_argument("--size", action = "append",
+                        help = "MOLECULES,SOLVENT; may be repeated. "
+                               "(Default: 100,1000 1000,10000 10000,100000)")
+    parser.add_argument("--types", type = int, default = 20)
+    parser.add_argument("--chain_length", type = int, default = 6)
+    parser.add_argument("--output", help = "JSON output file (Default: stdout)")
+    args = parser.parse_args()
+    if args.size == None:
+        args.size = [ "100,1000", "1000,10000", "10000,100000" ]
+    main(args)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+""" Measures the latency and the throughput of a conversion server under
+concurrent load, against running bin/gromos2amber once per conversion,
+writing the results as JSON.
+
+Each client sends the same synthetic topology and configuration over and
+over, so after the first request of each worker, the topology comes from
+its cache.
+
+Usage: python benchmarks/bench_server.py [--molecules N] [--solvent N]
+           [--workers N] [--concurrency C ...] [--requests N]
+           [--output FILE]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import platform
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from gromos2amber.Server import ConversionServer, ConversionClient
+from gromos2amber.TopologyCache import PACKAGE_VERSION
+from synthetic import write_topology, write_configuration
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values)-1, int(fraction*len(values)))]
+
+def summary(latencies, elapsed):
+    return {
+        "requests" : len(latencies),
+        "requests_per_second" : len(latencies)/elapsed,
+        "latency_seconds" : {
+            "mean" : sum(latencies)/len(latencies),
+            "p50" : percentile(latencies, 0.50),
+            "p90" : percentile(latencies, 0.90),
+            "p99" : percentile(latencies, 0.99),
+            "max" : max(latencies),
+        },
+    }
+
+async def load(client, topology, config, concurrency, num_requests):
+    """ num_requests conversions, concurrency at a time """
+    latencies = []
+    remaining = [ num_requests ]
+    async def worker():
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            start = time.perf_counter()
+            await client.convert(topology, io.StringIO(),
+                                 config_in = config,
+                                 config_out = io.StringIO())
+            latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    await asyncio.gather(*[ worker() for c in range(concurrency) ])
+    return summary(latencies, time.perf_counter() - start)
+
+async def bench_server(topology, config, workers, concurrencies, num_requests,
+                       directory):
+    path = os.path.join(directory, "server.sock")
+    server = ConversionServer(workers = workers)
+    await server.start(path = path)
+    try:
+        client = ConversionClient(path = path)
+        # warm every worker's caches
+        await load(client, topology, config, workers or os.cpu_count(),
+                   workers or os.cpu_count())
+        return { str(concurrency) : await load(client, topology, config,
+                                               concurrency, num_requests)
+                 for concurrency in concurrencies }
+    finally:
+        server.close()
+
+def bench_subprocess(topology_path, config_path, num_requests, directory):
+    script = os.path.join(os.path.dirname(__file__), '..', 'bin',
+                          'gromos2amber')
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = os.path.join(os.path.dirname(__file__), '..')
+    latencies = []
+    start = time.perf_counter()
+    for r in range(num_requests):
+        began = time.perf_counter()
+        subprocess.run([ sys.executable, script,
+                         "--topology_in", topology_path,
+                         "--topology_out", os.path.join(directory, "out.top"),
+                         "--config_in", config_path,
+                         "--config_out", os.path.join(directory, "out.crd") ],
+                       check = True, env = environment)
+        latencies.append(time.perf_counter() - began)
+    return summary(latencies, time.perf_counter() - start)
+
+def main(args):
+    with tempfile.TemporaryDirectory() as directory:
+        topology_path = os.path.join(directory, "in.top")
+        config_path = os.path.join(directory, "in.g96")
+        with open(topology_path, "w") as f:
+            num_atoms = write_topology(f, args.molecules)
+        with open(config_path, "w") as f:
+            write_configuration(f, num_atoms, args.solvent)
+        # the client reads its inputs anew for each request
+        server = asyncio.run(bench_server(
+            topology_path, config_path, args.workers,
+            args.concurrency, args.requests, directory))
+        subprocesses = bench_subprocess(topology_path, config_path,
+                                        min(args.requests, 10), directory)
+    for concurrency, result in server.items():
+        sys.stderr.write("concurrency {}: {:.1f} requests/s, "\
+                         "p50 latency {:.3f} s\n".format(
+                             concurrency, result["requests_per_second"],
+                             result["latency_seconds"]["p50"]))
+    sys.stderr.write("subprocess: {:.1f} requests/s, "\
+                     "p50 latency {:.3f} s\n".format(
+                         subprocesses["requests_per_second"],
+                         subprocesses["latency_seconds"]["p50"]))
+    report = {
+        "version" : PACKAGE_VERSION,
+        "python" : platform.python_version(),
+        "platform" : platform.platform(),
+        "cpus" : os.cpu_count(),
+        "molecules" : args.molecules,
+        "solvent" : args.solvent,
+        "workers" : args.workers,
+        "server" : server,
+        "subprocess" : subprocesses,
+    }
+    output = sys.stdout if args.output == None else open(args.output, "w")
+    json.dump(report, output, indent = 1)
+    output.write("\n")
+    if not output == sys.stdout:
+        output.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__.split("\n")[0])
+    parser.add_argument("--molecules", type = int, default = 20)
+    parser.add_argument("--solvent", type = int, default = 500)
+    parser.add_argument("--workers", type = int, default = None,
+                        help = "Server worker processes (Default: one per CPU)")
+    parser.add_argument("--concurrency", type = int, action = "append",
+                        help = "Concurrent clients; may be repeated. "
+                               "(Default: 1 4 16)")
+    parser.add_argument("--requests", type = int, default = 100)
+    parser.add_argument("--output", help = "JSON output file (Default: stdout)")
+    args = parser.parse_args()
+    if args.concurrency == None:
+        args.concurrency = [ 1, 4, 16 ]
+    main(args)
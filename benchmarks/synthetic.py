@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+""" Writes valid GROMOS topologies and configurations of any size, for
+benchmarking.
+
+The solute is num_molecules identical chains of chain_length carbons, each
+with one hydrogen, with bonds, angles, dihedrals, impropers, exclusions and
+1-4 pairs between them, and atoms of num_types types. The solvent is SPC
+water. Configurations place the chains as random walks wrapped into a
+cubic box of roughly the density of water, so that molecules must be
+gathered.
+
+Usage: python benchmarks/synthetic.py NUM_MOLECULES NUM_SOLVENT NUM_TYPES PREFIX
+
+writes PREFIX.top, PREFIX.g96 and PREFIX_red.g96 (reduced format).
+"""
+
+import sys
+import random
+
+def write_topology(io, num_molecules, chain_length = 6, num_types = 5,
+                   title = "synthetic"):
+    """ Returns the number of solute atoms """
+    rnd = random.Random(1)
+    atoms = [] # (name, residue, type, mass, charge)
+    bonds_wH, bonds = [], []
+    angles_wH, angles = [], []
+    dihedrals_wH, dihedrals = [], []
+    impropers = []
+    molecule_ends = []
+    residue = 0
+    for m in range(num_molecules):
+        first = len(atoms)
+        C = lambda k: first + 2*k
+        H = lambda k: first + 2*k + 1
+        for k in range(chain_length):
+            if k % 5 == 0:
+                residue += 1
+            atoms.append(("C%d" % k, residue, 1 + k % num_types, 12.011,
+                          rnd.uniform(-0.5, 0.5)))
+            atoms.append(("H%d" % k, residue, 1 + (k+2) % num_types, 1.008,
+                          rnd.uniform(-0.5, 0.5)))
+        for k in range(chain_length):
+            bonds_wH.append((C(k), H(k), 1 + k % 3))
+            if k+1 < chain_length:
+                bonds.append((C(k), C(k+1), 1 + k % 3))
+                angles_wH.append((H(k), C(k), C(k+1), 1))
+                dihedrals_wH.append((H(k), C(k), C(k+1), H(k+1), 1))
+            if k+2 < chain_length:
+                angles.append((C(k), C(k+1), C(k+2), 2))
+                if k % 4 == 0:
+                    impropers.append((C(k), C(k+1), C(k+2), H(k+1), 1))
+            if k+3 < chain_length:
+                # two dihedrals over the same atoms, as in multi-term
+                # torsions, so that some 1-4 pairs are counted twice
+                dihedrals.append((C(k), C(k+1), C(k+2), C(k+3), 2))
+                dihedrals.append((C(k), C(k+1), C(k+2), C(k+3), 3))
+        molecule_ends.append(len(atoms))
+    exclusions, pairs14 = _exclusions(len(atoms), bonds_wH + bonds)
+
+    w = io.write
+    w("TITLE\n%s\nEND\n" % title)
+    w("PHYSICALCONSTANTS\n# FPEPSI\n  0.1389354E+03\n# HBAR\n  0.6350780E-01\n"
+      "# SPDL\n  2.9979245800E05\n# BOLTZ\n  0.00831441\nEND\n")
+    w("TOPVERSION\n2.0\nEND\n")
+    w("ATOMTYPENAME\n%d\n" % num_types)
+    for t in range(num_types):
+        w("T%d\n" % t)
+    w("END\n")
+    w("RESNAME\n%d\n" % residue)
+    for r in range(residue):
+        w("R%d\n" % (r % 7))
+    w("END\n")
+    w("SOLUTEATOM\n%d\n" % len(atoms))
+    for i, (name, res, typ, mass, charge) in enumerate(atoms):
+        excluded = exclusions[i]
+        w("%6d%5d%5s%4d%9.4f%9.5f%3d%6d" % (
+            i+1, res, name, typ, mass, charge, 1, len(excluded))
+          + "".join("%6d" % (j+1) for j in excluded) + "\n")
+        w("%41d" % len(pairs14[i])
+          + "".join("%6d" % (j+1) for j in pairs14[i]) + "\n")
+    w("END\n")
+    w("BONDSTRETCHTYPE\n3\n")
+    for b in range(3):
+        w("%16.7e%16.7e%16.7e\n" % (1e7, 3e5 + b, 0.1 + 0.01*b))
+    w("END\n")
+    _interactions(io, "BONDH", bonds_wH)
+    _interactions(io, "BOND", bonds)
+    w("BONDANGLEBENDTYPE\n2\n")
+    for b in range(2):
+        w("%16.7e%16.7e%16.7e\n" % (300.0, 400.0 + b, 109.5 + b))
+    w("END\n")
+    _interactions(io, "BONDANGLEH", angles_wH)
+    _interactions(io, "BONDANGLE", angles)
+    w("IMPDIHEDRALTYPE\n1\n%15.7e%15.7e\nEND\n" % (0.051, 0.0))
+    _interactions(io, "IMPDIHEDRALH", [])
+    _interactions(io, "IMPDIHEDRAL", impropers)
+    w("TORSDIHEDRALTYPE\n3\n")
+    for b in range(3):
+        w("%10.3f%11.3f%4d\n" % (5.92 + b, 180.0 * (b % 2), 1 + b))
+    w("END\n")
+    _interactions(io, "DIHEDRALH", dihedrals_wH)
+    _interactions(io, "DIHEDRAL", dihedrals)
+    w("LJPARAMETERS\n%d\n" % (num_types*(num_types+1)//2))
+    for j in range(1, num_types+1):
+        for i in range(1, j+1):
+            w("%5d%5d%14.6e%14.6e%14.6e%14.6e\n" % (
+                i, j, 1e-6*i*j, 1e-3*(i+j), 1e-6*i, 1e-3*j))
+    w("END\n")
+    w("SOLUTEMOLECULES\n%d\n" % len(molecule_ends))
+    line = "".join("%6d" % end for end in molecule_ends)
+    for start in range(0, len(line), 60):
+        w(line[start:start+60] + "\n")
+    w("END\n")
+    w("SOLVENTATOM\n3\n")
+    w("%4d%6s%4d%11.5f%11.5f\n" % (1, "OW", 1, 15.9994, -0.82))
+    w("%4d%6s%4d%11.5f%11.5f\n" % (2, "HW1", 2, 1.008, 0.41))
+    w("%4d%6s%4d%11.5f%11.5f\n" % (3, "HW2", 2, 1.008, 0.41))
+    w("END\n")
+    w("SOLVENTCONSTR\n3\n%5d%5d%15.7f\n%5d%5d%15.7f\n%5d%5d%15.7f\nEND\n"
+      % (1, 2, 0.1, 1, 3, 0.1, 2, 3, 0.1633))
+    return len(atoms)
+
+def write_configuration(io, num_solute_atoms, num_solvent, box = None,
+                        reduced = False, velocities = True,
+                        molecule_size = 12):
+    """ Writes num_solute_atoms atoms as random walks of molecule_size atoms,
+    then num_solvent waters, wrapped into a cubic box, with edge box in nm
+    (by default about the density of water). """
+    rnd = random.Random(2)
+    num_atoms = num_solute_atoms + 3*num_solvent
+    if box == None:
+        box = max(1.0, (num_atoms*0.01)**(1.0/3.0))
+    w = io.write
+    w("TITLE\nsynthetic coordinates\nEND\n")
+    w("POSITIONRED\n" if reduced else "POSITION\n")
+    for i in range(num_atoms):
+        if (i < num_solute_atoms and i % molecule_size == 0) or \
+                (i >= num_solute_atoms and (i-num_solute_atoms) % 3 == 0):
+            x = [ rnd.uniform(0, box) for d in range(3) ]
+        else:
+            x = [ c + rnd.uniform(-0.1, 0.1) for c in x ]
+        _write_vector(w, i, [ c % box for c in x ], reduced)
+    w("END\n")
+    if velocities:
+        w("VELOCITYRED\n" if reduced else "VELOCITY\n")
+        for i in range(num_atoms):
+            _write_vector(w, i, [ rnd.uniform(-1, 1) for d in range(3) ],
+                          reduced)
+        w("END\n")
+    w("GENBOX\n    1\n" + ("%15.9f"*3 + "\n")*4 % (
+        box, box, box, 90.0, 90.0, 90.0, 0, 0, 0, 0, 0, 0) + "END\n")
+
+def _write_vector(w, i, x, reduced):
+    if reduced:
+        w("%15.9f%15.9f%15.9f\n" % tuple(x))
+    else:
+        w("%5d %-5s %-5s%7d%15.9f%15.9f%15.9f\n" % (
+            1 + i//12, "RES", "AT", i+1, *x))
+
+def _interactions(io, name, interactions):
+    io.write("%s\n%d\n" % (name, len(interactions)))
+    for row in interactions:
+        io.write("".join("%7d" % (i+1) for i in row[:-1]) + "%5d\n" % row[-1])
+    io.write("END\n")
+
+def _exclusions(num_atoms, bonds):
+    # atoms 1 or 2 bonds away are excluded, atoms 3 bonds away are 1-4 pairs
+    neighbours = [ set() for i in range(num_atoms) ]
+    for i, j, _ in bonds:
+        neighbours[i].add(j)
+        neighbours[j].add(i)
+    exclusions, pairs14 = [], []
+    for i in range(num_atoms):
+        distance = {i: 0}
+        frontier = [i]
+        for d in (1, 2, 3):
+            frontier = [ b for a in frontier for b in neighbours[a]
+                            if not b in distance ]
+            for b in frontier:
+                distance.setdefault(b, d)
+        exclusions.append(sorted( j for j, d in distance.items()
+                                    if j > i and d in (1, 2) ))
+        pairs14.append(sorted( j for j, d in distance.items()
+                                 if j > i and d == 3 ))
+    return exclusions, pairs14
+
+if __name__ == "__main__":
+    num_molecules, num_solvent = int(sys.argv[1]), int(sys.argv[2])
+    num_types, prefix = int(sys.argv[3]), sys.argv[4]
+    with open(prefix + ".top", "w") as f:
+        num_atoms = write_topology(f, num_molecules, num_types = num_types)
+    with open(prefix + ".g96", "w") as f:
+        write_configuration(f, num_atoms, num_solvent)
+    with open(prefix + "_red.g96", "w") as f:
+        write_configuration(f, num_atoms, num_solvent, reduced = True)
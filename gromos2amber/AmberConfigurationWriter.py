@@ -1,4 +1,14 @@
-from .fortran_format import fortran_format
+from .fortran_format import fortran_format, iter_fortran_format
+from .netcdf_format import NetCDFWriter
+from .TopologyCache import PACKAGE_VERSION
+from .Configuration import PICOSECONDS
+
+# Output files with these extensions are written as NetCDF restarts
+NETCDF_EXTENSIONS = (".nc", ".ncrst")
+
+# Range of values which fit the '6f12.7' fields of an ASCII restart
+INPCRD_MIN = -999.99999995
+INPCRD_MAX = 9999.99999995
 
 class AmberConfigurationWriter:
     def __init__(self, configuration):
@@ -7,16 +17,13 @@ class AmberConfigurationWriter:
     def write(self, io):
         title = self.configuration.title.replace('\n','; ')
         io.write(title+'\n')
-        positions = self.configuration.positions
-        io.write(fortran_format("i5,5e15.7",[len(positions),0]))
-        xvalues = []
-        [ xvalues.extend(pos) for pos in positions ]
-        io.write(fortran_format("6f12.7", xvalues))
+        io.write(fortran_format("i5,5e15.7",[self.configuration.num_atoms,0]))
+        for chunk in iter_fortran_format("6f12.7", self.configuration.positions):
+            io.write(chunk)
         velocities = self.configuration.velocities
-        if not velocities == None:
-            vvalues = []
-            [ vvalues.extend(vel) for vel in velocities ]
-            io.write(fortran_format("6f12.7", vvalues))
+        if not velocities is None:
+            for chunk in iter_fortran_format("6f12.7", velocities):
+                io.write(chunk)
         if 0 != sum(self.configuration.box_angle):
             box = self.configuration.box_size + self.configuration.box_angle
         else:
@@ -24,4 +31,61 @@ class AmberConfigurationWriter:
 
         io.write(fortran_format("6f12.7", box))
 
+class AmberNetCDFRestartWriter:
+    """ Writes a Configuration as an Amber NetCDF restart, which holds the
+    positions and velocities in full double precision, whatever their
+    magnitude. """
+    def __init__(self, configuration):
+        self.configuration = configuration
+
+    def write(self, io):
+        """ io is a binary file, or a text file with an underlying binary
+        buffer """
+        config = self.configuration
+        periodic = not config.boxtype == 0
+        io.flush()
+        netcdf = NetCDFWriter(getattr(io, 'buffer', io))
+        netcdf.attribute("title", config.title.replace('\n','; '))
+        netcdf.attribute("application", "AMBER")
+        netcdf.attribute("program", "gromos2amber")
+        netcdf.attribute("programVersion", PACKAGE_VERSION)
+        netcdf.attribute("Conventions", "AMBERRESTART")
+        netcdf.attribute("ConventionVersion", "1.0")
+        netcdf.dimension("spatial", 3)
+        netcdf.dimension("atom", config.num_atoms)
+        if periodic:
+            netcdf.dimension("cell_spatial", 3)
+            netcdf.dimension("label", 5)
+            netcdf.dimension("cell_angular", 3)
+        netcdf.variable("spatial", 'c', ["spatial"], "xyz")
+        netcdf.variable("time", 'd', [], [ config.time or 0.0 ],
+                        units = "picosecond")
+        netcdf.variable("coordinates", 'd', ["atom", "spatial"],
+                        config.positions, units = "angstrom")
+        if not config.velocities is None:
+            netcdf.variable("velocities", 'd', ["atom", "spatial"],
+                            config.velocities, units = "angstrom/picosecond",
+                            # velocities are in amber units, 1/20.455 ps
+                            scale_factor = PICOSECONDS)
+        if periodic:
+            angles = config.box_angle if 0 != sum(config.box_angle) \
+                    else [90.0]*3
+            netcdf.variable("cell_spatial", 'c', ["cell_spatial"], "abc")
+            netcdf.variable("cell_angular", 'c', ["cell_angular", "label"],
+                            "alphabeta gamma")
+            netcdf.variable("cell_lengths", 'd', ["cell_spatial"],
+                            config.box_size, units = "angstrom")
+            netcdf.variable("cell_angles", 'd', ["cell_angular"],
+                            angles, units = "degree")
+        netcdf.close()
+        io.flush()
 
+def inpcrd_overflows(configuration):
+    """ Whether any position, velocity or box length is too large for the
+    fixed-width fields of an ASCII restart """
+    for values in ( configuration.positions, configuration.velocities,
+                    configuration.box_size ):
+        if not values is None and len(values) > 0 and \
+                (max(values) > INPCRD_MAX or min(values) < INPCRD_MIN):
+            return True
+    return False
@@ -0,0 +1,134 @@
+""" Section by section comparison of parm7 files, or of a parm7 file against
+the Topology it should have been converted from.
+
+Both sides are Mappings of section titles to values, typed as
+AmberTopologyReader returns them: an AmberTopologyReader, or
+TopologySections for a Topology. Integer and text values must be equal,
+and real values equal within the tolerances of math.isclose, so that a
+Topology can be compared with the rounded values of a file.
+
+Sections of the same format whose bodies are the same bytes are equal
+without being parsed, so that files which match are compared about as fast
+as they are read from disk.
+"""
+
+from math import isclose
+from itertools import count
+from collections.abc import Mapping
+from .AmberTopologyWriter import AmberTopologyWriter, SECTIONS, \
+        SECTIONS_BY_TITLE
+from .fortran_format import typed_values, iter_fortran_format
+
+RTOL = 1e-6
+ATOL = 0.0
+
+class SectionDifference:
+    """ index is that of the first value of the section which differs, or
+    None if the section is missing from one side (whose values are None) """
+    def __init__(self, title, index, first, second):
+        self.title, self.index = title, index
+        self.first, self.second = first, second
+
+    def __str__(self):
+        if self.first == None or self.second == None:
+            return "{}: only in the {} topology".format(
+                self.title, "second" if self.first == None else "first")
+        if self.index >= min(len(self.first), len(self.second)):
+            return "{}: {} values against {}, the first {} equal".format(
+                self.title, len(self.first), len(self.second), self.index)
+        return "{}: first difference at index {}: {!r} against {!r}".format(
+            self.title, self.index, self.first[self.index],
+            self.second[self.index])
+
+class TopologySections(Mapping):
+    """ The values of each section AmberTopologyWriter writes for topology,
+    typed as AmberTopologyReader reads them back """
+    def __init__(self, topology):
+        self.writer = AmberTopologyWriter(topology)
+
+    def __getitem__(self, title):
+        return typed_values(SECTIONS_BY_TITLE[title].format_string,
+                            getattr(self.writer, title)())
+
+    def __contains__(self, title): return title in SECTIONS_BY_TITLE
+
+    def __iter__(self): return ( entry.title for entry in SECTIONS )
+
+    def __len__(self): return len(SECTIONS)
+
+    def format(self, title): return SECTIONS_BY_TITLE[title].format_string
+
+    def body(self, title):
+        """ The section as AmberTopologyWriter formats it """
+        return "".join(iter_fortran_format(
+            self.format(title), getattr(self.writer, title)())).encode()
+
+def diff_sections(first, second, rtol = RTOL, atol = ATOL, titles = None):
+    """ The SectionDifference of each section of titles (by default, every
+    section of either side) which differs between first and second """
+    if titles == None:
+        titles = list(first) + [ title for title in second
+                                 if not title in first ]
+    differences = []
+    for title in titles:
+        if not title in first or not title in second:
+            differences.append(SectionDifference(
+                title, None,
+                first[title] if title in first else None,
+                second[title] if title in second else None))
+            continue
+        if _same_bytes(first, second, title):
+            continue
+        values, others = first[title], second[title]
+        index = first_difference(values, others, rtol, atol)
+        if not index == None:
+            differences.append(SectionDifference(title, index, values, others))
+    return differences
+
+def first_difference(values, others, rtol = RTOL, atol = ATOL):
+    """ The index of the first value which differs, or None if none does """
+    if values == others:
+        return None
+    if _is_real(values) or _is_real(others):
+        differs = ( i for i, value, other in zip(count(), values, others)
+                    if not _equal(value, other, rtol, atol) )
+    else:
+        differs = ( i for i, value, other in zip(count(), values, others)
+                    if not value == other )
+    index = next(differs, None)
+    if index == None and not len(values) == len(others):
+        return min(len(values), len(others))
+    return index
+
+def solvent_of(first, topology):
+    """ The number of solvent molecules and the solvent residue name with
+    which topology was converted to the parm7 file read by first, as far
+    as its number of atoms and its last residue tell """
+    num_solute_atoms = len(topology.atoms)
+    num_solvent_atoms = len(topology.solvent_atoms)
+    num_atoms = first["POINTERS"][0] if "POINTERS" in first else 0
+    num_solvent, remainder = divmod(num_atoms - num_solute_atoms,
+                                    max(num_solvent_atoms, 1))
+    if num_solvent <= 0 or not remainder == 0:
+        return 0, "SOL"
+    residues = first["RESIDUE_LABEL"] if "RESIDUE_LABEL" in first else []
+    return num_solvent, residues[-1] if len(residues) > 0 else "SOL"
+
+def _same_bytes(first, second, title):
+    try:
+        return first.format(title).lower() == second.format(title).lower() \
+                and first.body(title) == second.body(title)
+    except AttributeError:
+        return False
+
+def _is_real(values):
+    return getattr(values, 'typecode', None) == 'd' \
+            or any( isinstance(value, float) for value in values[:1] )
+
+def _equal(value, other, rtol, atol):
+    if isinstance(value, float) or isinstance(other, float):
+        try:
+            return isclose(value, other, rel_tol = rtol, abs_tol = atol)
+        except TypeError:
+            return False
+    return value == other
@@ -0,0 +1,84 @@
+""" Reads parm7 files, such as those written by AmberTopologyWriter.
+
+The file is indexed in a single pass, which records the title, comment,
+format and byte offsets of each section. A section is parsed according to
+its %FORMAT line when it is accessed (see
+fortran_format.parse_fortran_format), into an array.array of its numbers,
+or a list of its text, so that sections which are never used cost nothing
+beyond locating them.
+"""
+
+from collections.abc import Mapping
+from .fortran_format import parse_fortran_format
+from .gromos_format import read_buffer
+from .Errors import AmberFormatError
+
+class AmberTopologyReader(Mapping):
+    def __init__(self, io):
+        """ io may be a path, a file object or a buffer, and may be
+        compressed (see gromos_format.read_buffer) """
+        self.buffer = read_buffer(io)
+        self.version = None
+        self.sections = {} # title : (comment, format, body start, body end)
+        buffer = self.buffer
+        if buffer[:8] == b'%VERSION':
+            end = _end_of_line(buffer, 0)
+            self.version = bytes(buffer[:end]).decode().strip()
+        start = buffer.find(b'%FLAG')
+        if start < 0:
+            raise AmberFormatError("No sections found in parm7 file.")
+        while start >= 0:
+            following = buffer.find(b'\n%FLAG', start)
+            stop = len(buffer) if following < 0 else following+1
+            self._index_section(start, stop)
+            start = following if following < 0 else following+1
+
+    def _index_section(self, start, stop):
+        buffer = self.buffer
+        title, comments, format_code = None, [], None
+        position = start
+        while position < stop and buffer[position:position+1] == b'%':
+            end = _end_of_line(buffer, position)
+            line = bytes(buffer[position:end]).decode().rstrip()
+            position = end+1
+            if line.startswith('%FLAG'):
+                title = line[5:].strip()
+            elif line.startswith('%COMMENT'):
+                comments.append(line[8:].strip())
+            elif line.startswith('%FORMAT'):
+                format_code = line[7:].strip().strip('()')
+        if format_code == None:
+            raise AmberFormatError(
+                "Section {} has no %FORMAT line.".format(title))
+        self.sections[title] = ("\n".join(comments), format_code,
+                                min(position, stop), stop)
+
+    def __getitem__(self, title):
+        format_code = self.format(title)
+        try:
+            return parse_fortran_format(format_code, self.body(title))
+        except ValueError as error:
+            raise AmberFormatError(
+                "Section {} could not be parsed as {}: {}".format(
+                    title, format_code, error)
+            )
+
+    def __contains__(self, title): return title in self.sections
+
+    def __iter__(self): return iter(self.sections)
+
+    def __len__(self): return len(self.sections)
+
+    def format(self, title): return self.sections[title][1]
+
+    def comment(self, title): return self.sections[title][0]
+
+    def body(self, title):
+        """ The raw bytes of a section, without its %FLAG, %COMMENT and
+        %FORMAT lines """
+        comment, format_code, start, stop = self.sections[title]
+        return bytes(self.buffer[start:stop])
+
+def _end_of_line(buffer, position):
+    end = buffer.find(b'\n', position)
+    return len(buffer) if end < 0 else end
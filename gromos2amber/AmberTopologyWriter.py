@@ -1,74 +1,488 @@
 """ Functions which return information required to generate a parm7 file.
 
-Each function is named after the corresponding section, taking ATB data as
-the only argument, and returning 4 values:
+Each section of the file is a method of AmberTopologyWriter named after
+the section, registered in SECTIONS by the section decorator along with
 
-  1. A list of values for the body of the section
+  1. An integer used to sort the sections relative to each other
   2. The Fortran format string
   3. A section comment to appear after the "%FLAG ..." line
-  4. An integer used to sort the sections relative to each other
+  4. For sections whose values are not a sequence, a function of the
+     writer giving the number of values
+
+The method returns an iterable of values for the body of the section.
+Sections which grow with the size of the system return generators, so that
+the file can be streamed without holding any section in memory in its
+entirety.
 
 if no comment is required for the section (because it is self-explantitory,
-eg "TITLE"), the amber_sections.NOCOMMENT is returned as the comment.
+eg "TITLE"), NOCOMMENT is registered as the comment.
 
+As every value of a format has a fixed width, the size of every section
+follows from its number of values, so that write can lay out the whole
+file before formatting any of it.
   """
 
-# Because amber.py uses the inspect module to assign functions in
-# amber_sections.py to sections in the self.topology file, it is important
-# that the functions in amber_sections all correspond to sections. Helper
-# functions have been put in amber_helpers.py. Unfortunately, we cannot simply
-# import all the amber_helpers functions, as inspect will then treat them as
-# though they are part of amber_sections.py.
-
-from .fortran_format import fortran_format
-from inspect import getmembers, ismethod
+from .fortran_format import fortran_format, iter_fortran_format, \
+        formatted_size
+from .TopologyCache import PACKAGE_VERSION
+from .Topology import BoundedCache, MAX_TYPE_TABLES
+from .SectionStore import write_manifest
+from itertools import chain, repeat, cycle
+from operator import add, mul, sub
+from array import array
+from contextlib import nullcontext
+import os
+import stat
+import json
+from hashlib import sha256
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+try:
+    import fcntl
+except ImportError: # not POSIX, so no os.pwrite either
+    fcntl = None
 
 
 # Constants
 NOCOMMENT = "" # comment when no comment required
 NOTERMS = "This section intentionally left empty."
 LINEWIDTH = 80
+VERSION_STAMP = "%VERSION  VERSION_STAMP = V0001.000\n"
+
+class Section:
+    def __init__(self, title, order, format_string, comment, count):
+        self.title, self.order = title, order
+        self.format_string, self.comment = format_string, comment
+        self.count = count
+
+# The registry of sections, in the order in which they are written
+SECTIONS = []
+SECTIONS_BY_TITLE = {}
+
+def section(order, format_string, count, comment = NOCOMMENT):
+    """ Registers a method of AmberTopologyWriter as the section of its
+    name. count is a function of the writer giving the number of values of
+    the section, from the sizes of the topology's tables alone, so that the
+    file can be laid out without rendering any section. """
+    def register(method):
+        entry = Section(method.__name__, order, format_string, comment, count)
+        SECTIONS.append(entry)
+        SECTIONS_BY_TITLE[entry.title] = entry
+        SECTIONS.sort(key = lambda entry: (entry.order, entry.title))
+        return method
+    return register
+
+# Sections whose values depend only on the force field parameter blocks
+# (see Topology.type_table_key), and the solvent bond types for BOND_*.
+# Their formatted bodies are kept for the life of the process and shared by
+# every topology of the same force field.
+TYPE_TABLE_SECTIONS = [
+    "NONBONDED_PARM_INDEX",
+    "BOND_FORCE_CONSTANT",
+    "BOND_EQUIL_VALUE",
+    "ANGLE_FORCE_CONSTANT",
+    "ANGLE_EQUIL_VALUE",
+    "DIHEDRAL_FORCE_CONSTANT",
+    "DIHEDRAL_PERIODICITY",
+    "DIHEDRAL_PHASE",
+    "SCEE_SCALE_FACTOR",
+    "SCNB_SCALE_FACTOR",
+    "LENNARD_JONES_ACOEF",
+    "LENNARD_JONES_BCOEF",
+    "CHARMM_IMPROPER_FORCE_CONSTANT",
+    "CHARMM_IMPROPER_PHASE",
+    "LENNARD_JONES_14_ACOEF",
+    "LENNARD_JONES_14_BCOEF",
+]
+# Formatted sections of the MAX_TYPE_TABLES most recently used force fields
+_type_table_sections = BoundedCache(MAX_TYPE_TABLES*len(TYPE_TABLE_SECTIONS))
+
+# Sections which depend on the number of solvent molecules as well as on the
+# input topology, and those which also depend on the solvent residue name.
+# All other sections depend only on the input topology.
+SOLVENT_SECTIONS = [
+    "POINTERS",
+    "ATOM_NAME",
+    "CHARGE",
+    "ATOMIC_NUMBER",
+    "MASS",
+    "ATOM_TYPE_INDEX",
+    "NUMBER_EXCLUDED_ATOMS",
+    "RESIDUE_POINTER",
+    "BONDS_INC_HYDROGEN",
+    "EXCLUDED_ATOMS_LIST",
+    "AMBER_ATOM_TYPE",
+    "TREE_CHAIN_CLASSIFICATION",
+    "JOIN_ARRAY",
+    "IROTAT",
+    "SOLVENT_POINTERS",
+    "ATOMS_PER_MOLECULE",
+]
+SOLVENT_RESIDUE_NAME_SECTIONS = [
+    "RESIDUE_LABEL",
+]
+
+# write_incremental records the sections of PATH in PATH+SECTION_INDEX_SUFFIX
+SECTION_INDEX_SUFFIX = ".sections"
+PARTIAL_SUFFIX = ".partial"
+COPY_SIZE = 1<<20
+
+# Counts of the values of each section
+def _constant(count):
+    return lambda writer: count
+
+def _num_atoms(writer): return writer.topology.num_atoms()
+
+def _num_atom_type_pairs(writer): return len(writer.topology.atom_types)**2
+
+def _num_residues(writer):
+    return len(writer.topology.residues) + writer.topology.solvent.num_molecules
+
+def _num_molecules(writer):
+    return len(writer.topology.atoms_per_molecule) \
+            + writer.topology.solvent.num_molecules
+
+def _num_lj_pair_types(writer): return len(writer.topology.lj_pair_types)
+
+def _num_bond_types(writer): return len(writer.topology.bond_types)
+
+def _num_angle_types(writer): return len(writer.topology.angle_types)
+
+def _num_dihedral_types(writer): return len(writer.topology.dihedral_types)
+
+def _num_improper_types(writer): return len(writer.topology.improper_types)
+
+# The count of _get_amber_indices of the Topology.Interactions table name
+def _num_index_values(name):
+    def count(writer):
+        interactions = getattr(writer.topology, name)
+        return (interactions.width+1)*len(interactions)
+    return count
+
+def _num_improper_values(writer):
+    impropers_wH = writer.topology.impropers_wH
+    impropers_woH = writer.topology.impropers_woH
+    return (impropers_wH.width+1)*(len(impropers_wH) + len(impropers_woH))
+
+def _num_bond_values_wH(writer):
+    return 3*( len(writer.topology.bonds_wH)
+               + writer.topology.solvent.num_bonds() )
+
+def _num_excluded_atom_values(writer):
+    return _total_excluded_atoms(writer.topology)
 
 class AmberTopologyWriter:
 
     def __init__(self, topology):
         self.topology = topology
 
-    def write(self, io):
-        not_sections = ["write", "__init__"]
-        section_functions = [ member
-                            for member in getmembers(self,
-                                                     predicate=ismethod)
-                            if not member[0] in not_sections]
-        sections = []
-        ordering = []
+    def write(self, io, workers = 1, pool = "process", stats = None):
+        """ Writes the parm7 file to io.
+
+        If io is a regular file, the place of every section is worked out
+        from its number of values (see _layout), the file is preallocated,
+        and each section is formatted straight into its place with
+        os.pwrite. Otherwise, eg for a pipe, the sections are written in
+        turn.
+
+        With more than one worker, the sections are rendered at the same
+        time in a pool of worker processes, or of threads with pool
+        "thread" (which only pays off where formatting can run without the
+        global interpreter lock). Worker processes write to the file
+        themselves. The output is identical either way.
+
+        stats is an optional ConversionStats in which to record each
+        section (with workers, the time spent waiting for it).
+        """
+        descriptor = _regular_file(io)
+        if not descriptor == None:
+            if self._write_positional(io, descriptor, workers, pool, stats):
+                return
+            # a value was wider than its format, so that the layout was
+            # wrong, and the file is written again in turn
+            io.seek(0)
+            io.truncate()
+        self._write_stream(io, workers, pool, stats)
+
+    def _write_stream(self, io, workers, pool, stats):
+        if workers == None or workers > 1:
+            sections = self._iter_sections_parallel(workers, pool)
+        else:
+            sections = self._iter_sections()
+        io.write(VERSION_STAMP)
+        for title, chunks in sections:
+            with nullcontext() if stats == None else stats.section(title):
+                for chunk in chunks:
+                    io.write(chunk)
+
+    def _write_positional(self, io, descriptor, workers, pool, stats):
+        # Returns False if any section was not the size of its layout
+        encoding = getattr(io, "encoding", None) or "utf-8"
+        layout, size = self._layout()
+        io.flush()
+        _preallocate(descriptor, size)
+        _pwrite(descriptor, VERSION_STAMP.encode(), 0)
+        for _, header_offset, header, _, _ in layout:
+            _pwrite(descriptor, header, header_offset)
+        if workers == None or workers > 1:
+            sizes = self._pwrite_sections_parallel(io, descriptor, layout,
+                                                   workers, pool, encoding,
+                                                   stats)
+        else:
+            sizes = []
+            for title, _, _, offset, _ in layout:
+                with nullcontext() if stats == None \
+                        else stats.section(title):
+                    sizes.append(self._pwrite_section(descriptor, title,
+                                                      offset, encoding))
+        io.seek(0, os.SEEK_END)
+        return all( written == section[4]
+                    for written, section in zip(sizes, layout) )
+
+    def _pwrite_sections_parallel(self, io, descriptor, layout, workers, pool,
+                                  encoding, stats):
+        # worker processes open the file by name, so without one use threads
+        path = _path_of(io, descriptor)
+        if pool == "thread" or path == None:
+            executor = ThreadPoolExecutor(max_workers = workers)
+            submit = lambda title, offset: executor.submit(
+                self._pwrite_section, descriptor, title, offset, encoding)
+        else:
+            executor = ProcessPoolExecutor(max_workers = workers,
+                                           initializer = _init_worker,
+                                           initargs = (self.topology,))
+            submit = lambda title, offset: executor.submit(
+                _pwrite_section, path, title, offset, encoding)
+        sizes = []
+        with executor:
+            # sections shared between topologies are written here, where
+            # they are probably already cached
+            futures = [ submit(title, offset)
+                            if self._type_table_section_key(title) == None
+                            else None
+                        for title, _, _, offset, _ in layout ]
+            for section, future in zip(layout, futures):
+                title, _, _, offset, _ = section
+                with nullcontext() if stats == None \
+                        else stats.section(title):
+                    if future == None:
+                        sizes.append(self._pwrite_section(
+                            descriptor, title, offset, encoding))
+                    else:
+                        sizes.append(future.result())
+        return sizes
+
+    def write_incremental(self, path, stats = None):
+        """ Writes the parm7 file to path, copying each section whose
+        inputs (see section_inputs) are the same as when path was last
+        written by write_incremental, and rendering the others. Returns the
+        titles of the sections which were rendered.
+
+        The byte offset, length and inputs of each section are recorded in
+        path+SECTION_INDEX_SUFFIX. The previous file is only reused if it
+        has not been modified since. """
+        previous = _read_section_index(path)
+        rendered = []
+        temporary = path + PARTIAL_SUFFIX
+        try:
+            with open(temporary, "wb") as output, \
+                    _open_previous(path, previous) as old:
+                output.write(VERSION_STAMP.encode())
+                sections = []
+                for title, chunks in self._iter_sections():
+                    inputs = self.section_inputs(title)
+                    offset = output.tell()
+                    with nullcontext() if stats == None \
+                            else stats.section(title):
+                        reused = previous.get(title)
+                        if not reused == None and reused["inputs"] == inputs:
+                            _copy_range(old, output, reused["offset"],
+                                        reused["length"])
+                        else:
+                            rendered.append(title)
+                            for chunk in chunks:
+                                output.write(chunk.encode())
+                    sections.append({
+                        "title" : title,
+                        "inputs" : inputs,
+                        "offset" : offset,
+                        "length" : output.tell() - offset,
+                    })
+            os.replace(temporary, path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        _write_section_index(path, sections)
+        return rendered
+
+    def write_to_store(self, io, store, stats = None):
+        """ Writes each section into store, a SectionStore, and a manifest
+        of the parm7 file to io. A section which the store already holds
+        from the same inputs is not rendered again: those of the force
+        field (see TYPE_TABLE_SECTIONS) are shared between all topologies
+        of the force field, the others between conversions of the same
+        topology file with the same solvent. Returns the titles of the
+        sections which were rendered. """
+        sections = [{
+            "title" : "VERSION_STAMP",
+            "sha256" : store.put([ VERSION_STAMP.encode() ]),
+            "length" : len(VERSION_STAMP),
+        }]
+        rendered = []
+        for title, chunks in self._iter_sections():
+            with nullcontext() if stats == None else stats.section(title):
+                key = self._store_key(title)
+                digest = store.lookup(key)
+                if digest == None:
+                    rendered.append(title)
+                    digest = store.put( chunk.encode() for chunk in chunks )
+                    store.record(key, digest)
+            sections.append({
+                "title" : title,
+                "sha256" : digest,
+                "length" : os.path.getsize(store.object_path(digest)),
+            })
+        write_manifest(io, sections)
+        return rendered
+
+    def _store_key(self, title):
+        key = self._type_table_section_key(title)
+        inputs = self.section_inputs(title) if key == None else key
+        encoded = json.dumps([ VERSION_STAMP, PACKAGE_VERSION, title, inputs ])
+        return sha256(encoded.encode()).hexdigest()
+
+    def section_inputs(self, title):
+        """ The inputs on which the section depends """
+        inputs = { "topology" : self.topology.source_key }
+        solvent = self.topology.solvent
+        if title in SOLVENT_SECTIONS or title in SOLVENT_RESIDUE_NAME_SECTIONS:
+            inputs["num_solvent"] = solvent.num_molecules
+        if title in SOLVENT_RESIDUE_NAME_SECTIONS:
+            inputs["solvent_resname"] = solvent.residue_name
+        return inputs
+
+    def iter_chunks(self):
+        """ Yields the parm7 file as a sequence of strings.
 
-        for title,func in section_functions:
-            values, format_string, comment, order = func()
-            sections.append( _section(title, comment, format_string, values) )
-            ordering.append( order )
+        Each section is formatted incrementally as it is consumed, so the
+        memory required beyond the topology itself is bounded by the chunk
+        size of iter_fortran_format.
+        """
+        yield VERSION_STAMP
+        for title, chunks in self._iter_sections():
+            yield from chunks
 
-        io.write("%VERSION  VERSION_STAMP = V0001.000\n")
+    def iter_chunks_parallel(self, workers = None, pool = "process"):
+        """ As iter_chunks, but with the sections rendered in a pool of
+        workers (None for one per CPU), and yielded in order as each is
+        finished. Every section is held in memory in its entirety. """
+        yield VERSION_STAMP
+        for title, chunks in self._iter_sections_parallel(workers, pool):
+            yield from chunks
 
-        for order, sec in sorted(zip(ordering, sections)):
-            io.write(sec)
+    def _iter_sections(self):
+        # the title and the chunks of each section
+        for title, values, format_string, comment in self._sections():
+            yield title, chain(
+                [ _section_header(title, comment, format_string) ],
+                self._iter_section_body(title, values, format_string),
+            )
 
+    def _iter_sections_parallel(self, workers, pool):
+        sections = self._sections()
+        if pool == "thread":
+            executor = ThreadPoolExecutor(max_workers = workers)
+            render = self._render_section
+        else:
+            executor = ProcessPoolExecutor(max_workers = workers,
+                                           initializer = _init_worker,
+                                           initargs = (self.topology,))
+            render = _render_section
+        with executor:
+            # sections shared between topologies are rendered here, where
+            # they are probably already cached
+            futures = [ None if self._type_table_section_key(title) \
+                            else executor.submit(render, title)
+                        for title, _, _, _ in sections ]
+            for section, future in zip(sections, futures):
+                title, values, format_string, comment = section
+                header = _section_header(title, comment, format_string)
+                if future == None:
+                    yield title, chain([header], self._iter_section_body(
+                        title, values, format_string))
+                else:
+                    yield title, _iter_future(header, future)
+
+    def _render_section(self, title):
+        values = getattr(self, title)()
+        format_string = SECTIONS_BY_TITLE[title].format_string
+        return ''.join(self._iter_section_body(title, values, format_string))
+
+    def _pwrite_section(self, descriptor, title, offset, encoding = "utf-8"):
+        # Writes the body of a section at offset, returning its size
+        values = getattr(self, title)()
+        format_string = SECTIONS_BY_TITLE[title].format_string
+        written = 0
+        for chunk in self._iter_section_body(title, values, format_string):
+            written += _pwrite(descriptor, chunk.encode(encoding),
+                               offset + written)
+        return written
+
+    def _iter_section_body(self, title, values, format_string):
+        key = self._type_table_section_key(title)
+        if key == None:
+            yield from iter_fortran_format(format_string, values)
+        else:
+            yield _type_table_sections.get(
+                key, lambda: fortran_format(format_string, values))
+
+    def _type_table_section_key(self, title):
+        if not title in TYPE_TABLE_SECTIONS:
+            return None
+        key = (self.topology.type_table_key, title)
+        if title.startswith("BOND_"):
+            solvent_types = self.topology.solvent_bond_types
+            key += ( len(self.topology.bond_types),
+                     tuple( bond.r0 for bond in solvent_types ) )
+        return key
+
+    def _sections(self):
+        # the title, values, format and comment of every section, in order
+        return [ ( entry.title,
+                   getattr(self, entry.title)(),
+                   entry.format_string,
+                   entry.comment )
+                 for entry in SECTIONS ]
+
+    def _layout(self):
+        """ The title, header and offsets of each section, from the number
+        of values of each alone, and the size of the file. Each section is
+        (title, header offset, header, body offset, body size). """
+        offset = len(VERSION_STAMP)
+        layout = []
+        for entry in SECTIONS:
+            count = entry.count(self)
+            header = _section_header(entry.title, entry.comment,
+                                     entry.format_string).encode()
+            size = formatted_size(entry.format_string, count)
+            layout.append( (entry.title, offset, header,
+                            offset+len(header), size) )
+            offset += len(header) + size
+        return layout, offset
+
+    @section(0, '20a4', count = _constant(LINEWIDTH//4))
     def CTITLE(self):
-        format_string = '20a4'
-        comment = NOCOMMENT
-        order = 0
         title = self.topology.get_title()
         title = title + " "*(LINEWIDTH - len(title))
         values = [title[i:i+4] for i in range(0, LINEWIDTH, 4)]
-        return values, format_string, comment, order
+        return values
     
+    @section(50, '10i8', count = _constant(32))
     def POINTERS(self):
-        format_string = '10i8'
-        comment = NOCOMMENT
-        order = 50
-        natom = len(self.topology.atoms)
+        solvent = self.topology.solvent
+        natom = self.topology.num_atoms()
         ntypes = len(self.topology.atom_types)
-        nbonh = len(self.topology.bonds_wH)
+        nbonh = len(self.topology.bonds_wH) + solvent.num_bonds()
         mbona = len(self.topology.bonds_woH)
         ntheth = len(self.topology.angles_wH)
         mtheta = len(self.topology.angles_woH)
@@ -76,9 +490,8 @@ class AmberTopologyWriter:
         mphia = len(self.topology.dihedrals_woH)
         nhparm = 0 # unused by amber
         nparm = 0 # 1 if topology file created by addles
-        nnb = sum( len(atom.exclusions) if len(atom.exclusions)>0 else 1
-                   for atom in self.topology.atoms )
-        nres = len( self.topology.residues )
+        nnb = _total_excluded_atoms(self.topology)
+        nres = len( self.topology.residues ) + solvent.num_molecules
         nbona = mbona 
         ntheta = mtheta
         nphia = mphia
@@ -95,7 +508,10 @@ class AmberTopologyWriter:
         mgper = 0 # unused by current amber
         mdper = 0 # unused by current amber
         ifbox = 1 if self.topology.is_periodic else 0
-        nmxrs = max( residue.numatoms for residue in self.topology.residues )
+        nmxrs = max( chain(
+            ( residue.numatoms for residue in self.topology.residues ),
+            [ len(solvent.atoms) ] if solvent.num_molecules > 0 else [],
+            ) )
         ifcap = 0 
         numextra = 0 # probably zero, check this
         ncopy = 0 # probably zero, check this
@@ -106,386 +522,463 @@ class AmberTopologyWriter:
         ifpert, nbper, ngper, ndper, mbper, mgper, mdper, ifbox, nmxrs, ifcap,
         numextra , ncopy
         ]
-        return values, format_string, comment, order
+        return values
 
+    @section(100, 'i2,a78', count = _constant(2))
     def FORCE_FIELD_TYPE(self):
-        format_string ='i2,a78'
-        comment = NOCOMMENT
-        order = 100
         values = [1, "CHARMM force field: No FF information parsed..."]
-        return values, format_string, comment, order
+        return values
     
+    @section(200, '20a4', count = _num_atoms)
     def ATOM_NAME(self):
-        format_string = '20a4'
-        comment = NOCOMMENT
-        order = 200
-        values = [ atom.name for atom in self.topology.atoms ]
-        return values, format_string, comment, order
+        values = _atom_column(self.topology, "names")
+        return values
     
+    @section(300, '3e24.16', count = _num_atoms)
     def CHARGE(self):
-        format_string = '3e24.16'
-        comment = NOCOMMENT
-        order = 300
         k = self.topology.charge_prefactor
-        values = [ k*atom.charge for atom in self.topology.atoms ]
-        return values, format_string, comment, order
+        values = map(mul, _atom_column(self.topology, "charges"), repeat(k))
+        return values
     
+    @section(400, '10i8', count = _num_atoms)
     def ATOMIC_NUMBER(self):
-        format_string = '10i8'
-        comment = NOCOMMENT
-        order = 400
-        values = [ 1000+i for i,a in enumerate(self.topology.atoms) ]
-        return values, format_string, comment, order
+        values = range(1000, 1000+self.topology.num_atoms())
+        return values
     
+    @section(500, '5e16.8', count = _num_atoms)
     def MASS(self):
-        format_string = '5e16.8'
-        comment = NOCOMMENT
-        order = 500
-        values = [ atom.mass for atom in self.topology.atoms ]
-        return values, format_string, comment, order
+        values = _atom_column(self.topology, "masses")
+        return values
     
+    @section(600, '10i8', count = _num_atoms)
     def ATOM_TYPE_INDEX(self):
-        format_string = '10i8'
-        comment = NOCOMMENT
-        order = 600
-        values = [ atom.typecode+1 for atom in self.topology.atoms ]
-        return values, format_string, comment, order
+        values = map(add, _atom_column(self.topology, "typecodes"), repeat(1))
+        return values
     
+    @section(700, '10i8', count = _num_atoms)
     def NUMBER_EXCLUDED_ATOMS(self):
-        format_string = '10i8'
-        comment = NOCOMMENT
-        order = 700
-        values = [ len(atom.exclusions) if len(atom.exclusions)>0 else 1
-                   for atom in self.topology.atoms ]
-        return values, format_string, comment, order
-    
+        solvent = self.topology.solvent
+        values = chain(
+            _iter_num_excluded_atoms(self.topology.atoms),
+            chain.from_iterable(repeat(
+                array('q', _iter_num_excluded_atoms(solvent.atoms)),
+                solvent.num_molecules)),
+        )
+        return values
+    
+    @section(800, '10i8', count = _num_atom_type_pairs)
     def NONBONDED_PARM_INDEX(self):
-        format_string = '10i8'
-        comment = NOCOMMENT
-        order = 800
         numtypes = len(self.topology.atom_types)
         irange = range(1, numtypes+1)
-        values = [ _nb_parm_index(i,j) for i in irange for j in irange ]
-        return values, format_string, comment, order
+        values = ( _nb_parm_index(i,j) for i in irange for j in irange )
+        return values
     
+    @section(900, '20a4', count = _num_residues)
     def RESIDUE_LABEL(self):
-        format_string = '20a4'
-        comment = NOCOMMENT
-        order = 900
-        values = [ residue.name for residue in self.topology.residues ]
-        return values, format_string, comment, order
-    
+        solvent = self.topology.solvent
+        values = chain(
+            ( residue.name for residue in self.topology.residues ),
+            repeat(solvent.residue_name, solvent.num_molecules),
+        )
+        return values
+    
+    @section(1000, '10i8', count = _num_residues)
     def RESIDUE_POINTER(self):
-        format_string = '10i8'
-        comment = NOCOMMENT
-        order = 1000
         previous = -1
-        values = [ residue.first+1 for residue in self.topology.residues ]
-        return values, format_string, comment, order
+        values = chain(
+            ( residue.first+1 for residue in self.topology.residues ),
+            ( first+1 for first in self.topology.solvent.molecule_offsets() ),
+        )
+        return values
     
+    @section(1100, '5e16.8', count = _num_bond_types)
     def BOND_FORCE_CONSTANT(self):
-        format_string = '5e16.8'
-        comment = NOCOMMENT
-        order = 1100
         values = [ 0.5*bond.k for bond in self.topology.bond_types ]
-        return values, format_string, comment, order
+        return values
     
+    @section(1200, '5e16.8', count = _num_bond_types)
     def BOND_EQUIL_VALUE(self):
-        format_string = '5e16.8'
-        comment = NOCOMMENT
-        order = 1200
         values = [ bond.r0 for bond in self.topology.bond_types ]
-        return values, format_string, comment, order
+        return values
     
+    @section(1300, '5e16.8', count = _num_angle_types)
     def ANGLE_FORCE_CONSTANT(self):
-        format_string = '5e16.8'
-        comment = NOCOMMENT
-        order = 1300
         values = [ 0.5*angle.k for angle in self.topology.angle_types ]
-        return values, format_string, comment, order
+        return values
     
+    @section(1400, '3e25.17', count = _num_angle_types)
     def ANGLE_EQUIL_VALUE(self):
-        format_string = '3e25.17'
-        comment = NOCOMMENT
-        order = 1400
         values = [ angle.theta0 for angle in self.topology.angle_types ]
-        return values, format_string, comment, order
+        return values
     
+    @section(1500, '5e16.8', count = _num_dihedral_types)
     def DIHEDRAL_FORCE_CONSTANT(self):
-        format_string = '5e16.8'
-        comment = NOCOMMENT
-        order = 1500
         values = [ dihedral.k
                     for dihedral in self.topology.dihedral_types ]
-        return values, format_string, comment, order
+        return values
     
+    @section(1600, '5e16.8', count = _num_dihedral_types)
     def DIHEDRAL_PERIODICITY(self):
-        format_string = '5e16.8'
-        comment = NOCOMMENT
-        order = 1600
         values = [ dihedral.n for dihedral in self.topology.dihedral_types ]
-        return values, format_string, comment, order
+        return values
     
+    @section(1700, '5e16.8', count = _num_dihedral_types)
     def DIHEDRAL_PHASE(self):
-        format_string = '5e16.8'
-        comment = NOCOMMENT
-        order = 1700
         values = [ dihedral.phi0
                     for dihedral in self.topology.dihedral_types ]
-        return values, format_string, comment, order
+        return values
     
+    @section(1800, '5e16.8', count = _num_dihedral_types)
     def SCEE_SCALE_FACTOR(self):
-        format_string = '5e16.8'
-        comment = NOCOMMENT
-        order = 1800
         values = [ 1.0 for dihedral in self.topology.dihedral_types ]
-        return values, format_string, comment, order
+        return values
     
+    @section(1900, '5e16.8', count = _num_dihedral_types)
     def SCNB_SCALE_FACTOR(self):
-        format_string = '5e16.8'
-        comment = NOCOMMENT
-        order = 1900
         values = [ 1.0 for dihedral in self.topology.dihedral_types ]
-        return values, format_string, comment, order
+        return values
     
+    @section(2000, '20a4', count = _constant(0))
     def SOLTY(self):
-        format_string = '20a4'
-        comment = NOCOMMENT
-        order = 2000
         values = []
-        return values, format_string, comment, order
+        return values
     
+    @section(2100, '3e24.16', count = _num_lj_pair_types)
     def LENNARD_JONES_ACOEF(self):
-        format_string = '3e24.16'
-        comment = NOCOMMENT
-        order = 2100
-        values = [ pair.c12 for pair in self.topology.lj_pair_types ]
-        return values, format_string, comment, order
+        values = ( pair.c12 for pair in self.topology.lj_pair_types )
+        return values
     
+    @section(2200, '3e24.16', count = _num_lj_pair_types)
     def LENNARD_JONES_BCOEF(self):
-        format_string = '3e24.16'
-        comment = NOCOMMENT
-        order = 2200
-        values = [ pair.c6 for pair in self.topology.lj_pair_types ]
-        return values, format_string, comment, order
+        values = ( pair.c6 for pair in self.topology.lj_pair_types )
+        return values
     
+    @section(2300, '10i8', count = _num_bond_values_wH)
     def BONDS_INC_HYDROGEN(self):
-        format_string = '10i8'
-        comment = NOCOMMENT
-        order = 2300
-        values = _get_amber_indices(self.topology.bonds_wH)
-        return values, format_string, comment, order
-    
+        solvent = self.topology.solvent
+        template = _get_amber_indices(solvent.bonds)
+        # atom indices move by 3 per atom of offset, typecodes stay
+        scale = [ 3 ]*solvent.bonds.width + [ 0 ]
+        values = chain(
+            _get_amber_indices(self.topology.bonds_wH),
+            _repeat_template(template, scale, solvent.molecule_offsets()),
+        )
+        return values
+    
+    @section(2400, '10i8', count = _num_index_values("bonds_woH"))
     def BONDS_WITHOUT_HYDROGEN(self):
-        format_string = '10i8'
-        comment = NOCOMMENT
-        order = 2400
         values = _get_amber_indices(self.topology.bonds_woH)
-        return values, format_string, comment, order
+        return values
     
+    @section(2500, '10i8', count = _num_index_values("angles_wH"))
     def ANGLES_INC_HYDROGEN(self):
-        format_string = '10i8'
-        comment = NOCOMMENT
-        order = 2500
         values = _get_amber_indices(self.topology.angles_wH)
-        return values, format_string, comment, order
+        return values
     
+    @section(2600, '10i8', count = _num_index_values("angles_woH"))
     def ANGLES_WITHOUT_HYDROGEN(self):
-        format_string = '10i8'
-        comment = NOCOMMENT
-        order = 2600
         values = _get_amber_indices(self.topology.angles_woH)
-        return values, format_string, comment, order
+        return values
     
+    @section(2700, '10i8', count = _num_index_values("dihedrals_wH"))
     def DIHEDRALS_INC_HYDROGEN(self):
-        format_string = '10i8'
-        comment = NOCOMMENT
-        order = 2700
         values = _get_amber_indices(self.topology.dihedrals_wH)
-        return values, format_string, comment, order
+        return values
     
+    @section(2800, '10i8', count = _num_index_values("dihedrals_woH"))
     def DIHEDRALS_WITHOUT_HYDROGEN(self):
-        format_string = '10i8'
-        comment = NOCOMMENT
-        order = 2800
         values = _get_amber_indices(self.topology.dihedrals_woH)
-        return values, format_string, comment, order
+        return values
     
+    @section(2900, '10i8', count = _num_excluded_atom_values)
     def EXCLUDED_ATOMS_LIST(self):
-        format_string = '10i8'
-        comment = NOCOMMENT
-        order = 2900
-        values = []
-        for atom in self.topology.atoms:
-            numexcl = len(atom.exclusions)
-            exclusions = [ e+1 for e in atom.exclusions ] if numexcl>0 else [0]
-            values.extend(exclusions)
-        return values, format_string, comment, order
-    
+        solvent = self.topology.solvent
+        template = _excluded_atoms(solvent.atoms)
+        # 0 for atoms without exclusions stays 0 in every molecule
+        scale = array('q', map(bool, template))
+        values = chain(
+            _excluded_atoms(self.topology.atoms),
+            _repeat_template(template, scale, solvent.molecule_offsets()),
+        )
+        return values
+    
+    @section(3000, '20a4', count = _constant(0))
     def HBOND_ACOEF(self):
-        format_string = '20a4'
-        comment = NOCOMMENT
-        order = 3000
         values = []
-        return values, format_string, comment, order
+        return values
     
+    @section(3200, '20a4', count = _constant(0))
     def HBOND_BCOEF(self):
-        format_string = '20a4'
-        comment = NOCOMMENT
-        order = 3200
         values = []
-        return values, format_string, comment, order
+        return values
     
+    @section(3300, '20a4', count = _constant(0))
     def HBCUT(self):
-        format_string = '20a4'
-        comment = NOCOMMENT
-        order = 3300
         values = []
-        return values, format_string, comment, order
+        return values
     
+    @section(3400, '20a4', count = _num_atoms)
     def AMBER_ATOM_TYPE(self):
-        format_string = '20a4'
-        comment = NOCOMMENT
-        order = 3400
         atomtypes = self.topology.atom_types
-        values = [ atomtypes[atom.typecode] for atom in self.topology.atoms ]
-        return values, format_string, comment, order
+        values = map(atomtypes.__getitem__,
+                     _atom_column(self.topology, "typecodes"))
+        return values
     
+    @section(3500, '20a4', comment = 'All items BLA in Chamber topology',
+             count = _num_atoms)
     def TREE_CHAIN_CLASSIFICATION(self):
-        format_string = '20a4'
-        comment = 'All items BLA in Chamber topology'
-        order = 3500
-        values = [ 'BLA' for atom in self.topology.atoms ]
-        return values, format_string, comment, order
+        values = repeat('BLA', self.topology.num_atoms())
+        return values
     
+    @section(3600, '10i8', count = _num_atoms)
     def JOIN_ARRAY(self):
-        format_string = '10i8'
-        comment = NOCOMMENT
-        order = 3600
-        values = [ 0 for atom in self.topology.atoms ]
-        return values, format_string, comment, order
+        values = repeat(0, self.topology.num_atoms())
+        return values
     
+    @section(3700, '10i8', count = _num_atoms)
     def IROTAT(self):
-        format_string = '10i8'
-        comment = NOCOMMENT
-        order = 3700
-        values = [ 0 for atom in self.topology.atoms ]
-        return values, format_string, comment, order
+        values = repeat(0, self.topology.num_atoms())
+        return values
     
+    @section(3730, '3i8', count = _constant(3))
     def SOLVENT_POINTERS(self):
-        format_string = '3i8'
-        comment = NOCOMMENT
-        order = 3730
         values = [ self.topology.num_solute_residues,
-                   len(self.topology.atoms_per_molecule),
+                   len(self.topology.atoms_per_molecule)
+                       + self.topology.solvent.num_molecules,
                    self.topology.num_solute_molecules+1
                    ]
-        return values, format_string, comment, order
+        return values
 
+    @section(3730, '10i8', count = _num_molecules)
     def ATOMS_PER_MOLECULE(self):
-        format_string = '10i8'
-        comment = NOCOMMENT
-        order = 3730
-        values = [ numatoms for numatoms in self.topology.atoms_per_molecule ]
-        return values, format_string, comment, order
-    
+        solvent = self.topology.solvent
+        values = chain(
+            ( numatoms for numatoms in self.topology.atoms_per_molecule ),
+            repeat(len(solvent.atoms), solvent.num_molecules),
+        )
+        return values
+    
+    @section(3800, '2i8', count = _constant(2))
     def CHARMM_UREY_BRADLEY_COUNT(self):
-        format_string = '2i8'
-        comment = NOCOMMENT
-        order = 3800
         values = [0,0]
-        return values, format_string, comment, order
+        return values
     
+    @section(3900, '10i8', comment = NOTERMS, count = _constant(0))
     def CHARMM_UREY_BRADLEY(self):
-        format_string = '10i8'
-        comment = NOTERMS
-        order = 3900
         values = []
-        return values, format_string, comment, order
+        return values
     
+    @section(4000, '20a4', count = _constant(0))
     def CHARMM_UREY_BRADLEY_FORCE_CONSTANT(self):
-        format_string = '20a4'
-        comment = NOCOMMENT
-        order = 4000
         values = []
-        return values, format_string, comment, order
+        return values
     
+    @section(4100, '20a4', count = _constant(0))
     def CHARMM_UREY_BRADLEY_EQUIL_VALUE(self):
-        format_string = '20a4'
-        comment = NOCOMMENT
-        order = 4100
         values = []
-        return values, format_string, comment, order
+        return values
     
+    @section(4200, 'i8', count = _constant(1))
     def CHARMM_NUM_IMPROPERS(self):
-        format_string = 'i8'
-        comment = NOCOMMENT
-        order = 4200
         values = [ len(self.topology.impropers_woH)
                     + len(self.topology.impropers_wH), ]
-        return values, format_string, comment, order
+        return values
     
+    @section(4300, '10i8', count = _num_improper_values)
     def CHARMM_IMPROPERS(self):
-        format_string = "10i8"
-        comment = NOCOMMENT
-        order = 4300
-        impropers = list(self.topology.impropers_wH)
-        impropers.extend(self.topology.impropers_woH)
+        impropers = self.topology.impropers_wH + self.topology.impropers_woH
         values = _get_amber_indices(impropers, impropers = True)
-        return values, format_string, comment, order
+        return values
     
+    @section(4400, 'i8', count = _constant(1))
     def CHARMM_NUM_IMPR_TYPES(self):
-        format_string = 'i8'
-        comment = NOCOMMENT
-        order = 4400
         values = [ len( self.topology.improper_types ), ]
-        return values, format_string, comment, order
+        return values
     
+    @section(4500, '5e16.8', count = _num_improper_types)
     def CHARMM_IMPROPER_FORCE_CONSTANT(self):
-        format_string = '5e16.8'
-        comment = NOCOMMENT
-        order = 4500
         values = [ 0.5*improper.k for improper in self.topology.improper_types ]
-        return values, format_string, comment, order
+        return values
     
+    @section(4600, '5e16.8', comment = 'In degrees',
+             count = _num_improper_types)
     def CHARMM_IMPROPER_PHASE(self):
-        format_string = '5e16.8'
-        comment = 'In degrees'
-        order = 4600
         values = [ improper.xi0 for improper in self.topology.improper_types ]
-        return values, format_string, comment, order
+        return values
     
+    @section(4700, '3e24.16', count = _num_lj_pair_types)
     def LENNARD_JONES_14_ACOEF(self):
-        format_string = '3e24.16'
-        comment = NOCOMMENT
-        order = 4700
-        values = [ pair.c12_14 for pair in self.topology.lj_pair_types ]
-        return values, format_string, comment, order
+        values = ( pair.c12_14 for pair in self.topology.lj_pair_types )
+        return values
     
+    @section(4800, '3e24.16', count = _num_lj_pair_types)
     def LENNARD_JONES_14_BCOEF(self):
-        format_string = '3e24.16'
-        comment = NOCOMMENT
-        order = 4800
-        values = [ pair.c6_14 for pair in self.topology.lj_pair_types ]
-        return values, format_string, comment, order
+        values = ( pair.c6_14 for pair in self.topology.lj_pair_types )
+        return values
      
+# The writer of each worker process of iter_chunks_parallel
+_worker_writer = None
+
+def _init_worker(topology):
+    global _worker_writer
+    _worker_writer = AmberTopologyWriter(topology)
+
+def _render_section(title):
+    return _worker_writer._render_section(title)
+
+def _pwrite_section(path, title, offset, encoding):
+    descriptor = os.open(path, os.O_WRONLY)
+    try:
+        return _worker_writer._pwrite_section(descriptor, title, offset,
+                                              encoding)
+    finally:
+        os.close(descriptor)
+
+# The descriptor of io if it is an empty regular file, at its start, which
+# is not opened to append (where os.pwrite ignores its offset), otherwise None
+def _regular_file(io):
+    if fcntl == None:
+        return None
+    try:
+        if not io.seekable() or not io.tell() == 0:
+            return None
+        descriptor = io.fileno()
+        status = os.fstat(descriptor)
+        if not stat.S_ISREG(status.st_mode) or not status.st_size == 0:
+            return None
+        if fcntl.fcntl(descriptor, fcntl.F_GETFL) & os.O_APPEND:
+            return None
+    except (AttributeError, OSError, ValueError):
+        return None
+    return descriptor
+
+# The path by which io can be opened again, if it has one
+def _path_of(io, descriptor):
+    name = getattr(io, "name", None)
+    if not isinstance(name, (str, os.PathLike)):
+        return None
+    try:
+        opened, named = os.fstat(descriptor), os.stat(name)
+    except OSError:
+        return None
+    same = (opened.st_dev, opened.st_ino) == (named.st_dev, named.st_ino)
+    return name if same else None
+
+def _preallocate(descriptor, size):
+    os.ftruncate(descriptor, size)
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(descriptor, 0, size)
+        except OSError:
+            pass # not supported by the file system, the file is sparse
+
+def _pwrite(descriptor, data, offset):
+    view = memoryview(data)
+    while len(view) > 0:
+        written = os.pwrite(descriptor, view, offset)
+        view, offset = view[written:], offset + written
+    return len(data)
+
+def _iter_future(header, future):
+    yield header
+    yield future.result()
+
 # for bonds, angles, and dihedrals, but not chamber impropers
 def _amber_index(index): return 3*(index-1)
 
-def _get_amber_indices(interactions, impropers = False):
-    values = []
-    for interaction in interactions:
-        atoms = interaction.atoms
-        index_sign = [ 1 for atom in atoms ]
-        if interaction.is_excluding_14():
-            index_sign[2] = -1 
-        for sign,atom_index in zip(index_sign,atoms):
-            index = atom_index+1
-            index = index if impropers else _amber_index(index)
-            values.append(sign*index)
-        values.append(interaction.typecode+1)
+# The atom indices of each interaction of a Topology.Interactions table,
+# followed by its typecode, as one array. offset is added to every atom
+# index, eg for solvent template bonds.
+def _get_amber_indices(interactions, impropers = False, offset = 0):
+    width = interactions.width
+    values = array('q', bytes(8*(width+1)*len(interactions)))
+    # _amber_index(atom+offset+1) for all but chamber impropers
+    scale, shift = (1, offset+1) if impropers else (3, 3*offset)
+    for c in range(width):
+        column = interactions.atoms[c::width]
+        values[c::width+1] = array('q',
+            map(add, map(mul, column, repeat(scale)), repeat(shift)))
+    if width == 4:
+        # negative third index for dihedrals excluding 1-4 interactions
+        signs = map(sub, repeat(1), map(mul, interactions.exclude14, repeat(2)))
+        values[2::5] = array('q', map(mul, values[2::5], signs))
+    values[width::width+1] = array('q',
+        map(add, interactions.typecodes, repeat(1)))
     return values
 
+# The values of template for each offset, with scale times the offset
+# added to each
+def _repeat_template(template, scale, offsets):
+    offset_per_value = chain.from_iterable(
+        map(repeat, offsets, repeat(len(template))))
+    return map(add, cycle(template),
+               map(mul, cycle(scale), offset_per_value))
+
+# A field of Topology.Atoms for every atom, solute and solvent
+def _atom_column(topology, field):
+    solvent = topology.solvent
+    return chain(
+        getattr(topology.atoms, field),
+        chain.from_iterable(
+            repeat(getattr(solvent.atoms, field), solvent.num_molecules)),
+    )
+
+# Amber lists one excluded atom, 0, for atoms without exclusions
+def _excluded_atoms(atoms):
+    return array('q', map(add, atoms.exclusions.padded(-1).indices, repeat(1)))
+
+def _iter_num_excluded_atoms(atoms):
+    return map(max, atoms.exclusions.lengths(), repeat(1))
+
+def _total_excluded_atoms(topology):
+    solvent = topology.solvent
+    return _num_excluded_atoms(topology.atoms) \
+            + solvent.num_molecules*_num_excluded_atoms(solvent.atoms)
+
+def _num_excluded_atoms(atoms):
+    exclusions = atoms.exclusions
+    return len(exclusions.indices) + exclusions.lengths().count(0)
+
+# The sections recorded by write_incremental for path, keyed by title, or
+# none if path has changed since or was written by another version
+def _read_section_index(path):
+    try:
+        with open(path + SECTION_INDEX_SUFFIX) as index_file:
+            index = json.load(index_file)
+        status = os.stat(path)
+    except (OSError, ValueError):
+        return {}
+    if not ( index.get("version") == PACKAGE_VERSION
+             and index.get("size") == status.st_size
+             and index.get("mtime_ns") == status.st_mtime_ns ):
+        return {}
+    return { section["title"] : section for section in index["sections"] }
+
+def _write_section_index(path, sections):
+    status = os.stat(path)
+    index = {
+        "version" : PACKAGE_VERSION,
+        "size" : status.st_size,
+        "mtime_ns" : status.st_mtime_ns,
+        "sections" : sections,
+    }
+    with open(path + SECTION_INDEX_SUFFIX, "w") as index_file:
+        json.dump(index, index_file, indent = 1)
+        index_file.write("\n")
+
+def _open_previous(path, previous):
+    return nullcontext() if len(previous) == 0 else open(path, "rb")
+
+def _copy_range(source, destination, offset, length):
+    source.seek(offset)
+    while length > 0:
+        data = source.read(min(length, COPY_SIZE))
+        if len(data) == 0:
+            raise OSError("{} is shorter than its section index".format(
+                source.name))
+        destination.write(data)
+        length -= len(data)
+
 def _nb_parm_index(i, j):
     #NOTE :
     # while documentation suggests that these indices are up to the user,
@@ -496,11 +989,6 @@ def _nb_parm_index(i, j):
     i,j = (i,j) if i<=j else (j,i) # enforce i <= j
     return j*(j-1)//2 + i
 
-def _section(title, comment, format_string, values):
-    header = _section_header(title, comment, format_string)
-    body = _section_body(values, format_string)
-    return header+body
-
 def _section_header(title, comment, format_string):
     flag = "%FLAG {}\n".format(title)
     nocomment = comment == NOCOMMENT
@@ -508,6 +996,3 @@ def _section_header(title, comment, format_string):
     fmt = "%FORMAT({})\n".format(format_string)
     return flag + com + fmt
 
-def _section_body(values, format_string):
-    return fortran_format(format_string, values)
-
@@ -0,0 +1,98 @@
+""" Writers of Amber trajectories, in the NetCDF and ASCII (mdcrd) formats.
+
+Both are given one frame (a Configuration) at a time and write it straight
+away. The number of atoms, the title and whether there is a periodic box
+are taken from the first frame.
+"""
+
+from .fortran_format import fortran_format, iter_fortran_format
+from .netcdf_format import NetCDFWriter
+from .Errors import GromosFormatError
+from .TopologyCache import PACKAGE_VERSION
+
+class AmberNetCDFTrajectoryWriter:
+    def __init__(self, io):
+        """ io is a binary file """
+        self.io = io
+        self.netcdf = None
+
+    def write_frame(self, configuration):
+        if self.netcdf == None:
+            self.netcdf = self._create(configuration)
+        _check_num_atoms(self.num_atoms, configuration)
+        record = {
+            "time" : [ configuration.time or 0.0 ],
+            "coordinates" : configuration.positions,
+        }
+        if self.periodic:
+            record["cell_lengths"] = configuration.box_size
+            record["cell_angles"] = _box_angles(configuration)
+        self.netcdf.write_record(record)
+
+    def close(self):
+        if not self.netcdf == None:
+            self.netcdf.close()
+
+    def _create(self, configuration):
+        self.num_atoms = configuration.num_atoms
+        self.periodic = not configuration.boxtype == 0
+        netcdf = NetCDFWriter(self.io)
+        netcdf.attribute("title", configuration.title.replace('\n','; '))
+        netcdf.attribute("application", "AMBER")
+        netcdf.attribute("program", "gromos2amber")
+        netcdf.attribute("programVersion", PACKAGE_VERSION)
+        netcdf.attribute("Conventions", "AMBER")
+        netcdf.attribute("ConventionVersion", "1.0")
+        netcdf.dimension("frame", None)
+        netcdf.dimension("spatial", 3)
+        netcdf.dimension("atom", self.num_atoms)
+        if self.periodic:
+            netcdf.dimension("cell_spatial", 3)
+            netcdf.dimension("label", 5)
+            netcdf.dimension("cell_angular", 3)
+        netcdf.variable("spatial", 'c', ["spatial"], "xyz")
+        netcdf.variable("time", 'f', ["frame"], units = "picosecond")
+        netcdf.variable("coordinates", 'f', ["frame", "atom", "spatial"],
+                        units = "angstrom")
+        if self.periodic:
+            netcdf.variable("cell_spatial", 'c', ["cell_spatial"], "abc")
+            netcdf.variable("cell_angular", 'c', ["cell_angular", "label"],
+                            "alphabeta gamma")
+            netcdf.variable("cell_lengths", 'd', ["frame", "cell_spatial"],
+                            units = "angstrom")
+            netcdf.variable("cell_angles", 'd', ["frame", "cell_angular"],
+                            units = "degree")
+        return netcdf
+
+class AmberMdcrdWriter:
+    def __init__(self, io):
+        """ io is a text file """
+        self.io = io
+        self.num_atoms = None
+
+    def write_frame(self, configuration):
+        if self.num_atoms == None:
+            self.num_atoms = configuration.num_atoms
+            self.periodic = not configuration.boxtype == 0
+            self.io.write(configuration.title.replace('\n','; ')+'\n')
+        _check_num_atoms(self.num_atoms, configuration)
+        for chunk in iter_fortran_format("10f8.3", configuration.positions):
+            self.io.write(chunk)
+        if self.periodic:
+            self.io.write(fortran_format("10f8.3", configuration.box_size))
+
+    def close(self):
+        pass
+
+def _check_num_atoms(num_atoms, configuration):
+    if not configuration.num_atoms == num_atoms:
+        raise GromosFormatError(
+            "Frame at time {} has {} atoms, expected {}".format(
+                configuration.time, configuration.num_atoms, num_atoms)
+        )
+
+def _box_angles(configuration):
+    # a BOX block gives no angles, the box is rectangular
+    if 0 == sum(configuration.box_angle):
+        return [90.0]*3
+    return configuration.box_angle
@@ -0,0 +1,182 @@
+""" Conversion of many topologies in a pool of worker processes.
+
+A manifest is a file with one JSON object per line, each describing a job:
+
+  {"topology_in": "mol.top", "topology_out": "mol.prmtop",
+   "config_in": "mol.g96", "config_out": "mol.inpcrd",
+   "solvent_resname": "SOL", "num_solvent": 0, "config_format": "auto"}
+
+Only "topology_in" and "topology_out" are required. Relative paths are
+relative to the directory containing the manifest. Blank lines and lines
+starting with '#' are ignored.
+
+Outputs are written to temporary files which are renamed once the conversion
+has succeeded, so a job whose outputs all exist is complete and is skipped
+when a batch is run again after an interruption.
+"""
+
+import os
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from .Converter import convert
+from .Errors import GromosFormatError, IllegalArgumentError
+from .AmberConfigurationWriter import NETCDF_EXTENSIONS
+from .TopologyCache import TopologyCache
+from .SectionStore import SectionStore
+from .compressed_format import open_output, compression_of_path, \
+        strip_compression_extension
+
+PARTIAL_SUFFIX = ".partial"
+
+class Job:
+    def __init__(self, topology_in, topology_out,
+                 config_in = None, config_out = None,
+                 solvent_resname = "SOL", num_solvent = 0,
+                 config_format = "auto"):
+        self.topology_in, self.topology_out = topology_in, topology_out
+        self.config_in, self.config_out = config_in, config_out
+        self.solvent_resname = solvent_resname
+        self.num_solvent = num_solvent
+        self.config_format = config_format
+
+    def outputs(self):
+        return [ path for path in (self.topology_out, self.config_out)
+                    if not path == None ]
+
+    def is_complete(self):
+        return all( os.path.exists(path) for path in self.outputs() )
+
+    def size(self):
+        """ Total size of the input files in bytes, 0 if any are missing """
+        try:
+            return sum( os.path.getsize(path)
+                        for path in (self.topology_in, self.config_in)
+                        if not path == None )
+        except OSError:
+            return 0
+
+class JobResult:
+    """ status is one of "converted", "skipped" or "failed" """
+    def __init__(self, job, status, error = None, elapsed = 0.0):
+        self.job, self.status = job, status
+        self.error, self.elapsed = error, elapsed
+
+def read_manifest(path):
+    directory = os.path.dirname(os.path.abspath(path))
+    fields = ["topology_in", "topology_out", "config_in", "config_out"]
+    jobs = []
+    with open(path) as manifest:
+        for number, line in enumerate(manifest, start = 1):
+            if not line.strip() or line.lstrip()[0] == '#':
+                continue
+            try:
+                entry = json.loads(line)
+                for field in fields:
+                    if field in entry and not entry[field] == None:
+                        entry[field] = os.path.join(directory, entry[field])
+                jobs.append(Job(**entry))
+            except (ValueError, TypeError) as error:
+                raise IllegalArgumentError(
+                    "Bad job on line {} of manifest '{}': {}".format(
+                        number, path, error)
+                )
+    return jobs
+
+def run_batch(jobs, workers = None, resume = True, topology_cache = None,
+              section_store = None):
+    """ Converts the jobs in a pool of worker processes, largest first,
+    yielding a JobResult for each job as it finishes.
+
+    A job which fails, for whatever reason, is reported as failed, and the
+    remaining jobs carry on. If a worker process dies, the jobs which had
+    not finished are run again, each in a pool of its own, so that only the
+    job which killed it fails. With resume, jobs whose
+    outputs already exist are reported as skipped without being run.
+    topology_cache is an optional TopologyCache directory. With
+    section_store, a SectionStore directory, each topology_out is a manifest
+    of sections kept in the store.
+    """
+    pending = []
+    for job in jobs:
+        if resume and job.is_complete():
+            yield JobResult(job, "skipped")
+        else:
+            pending.append(job)
+    pending.sort(key = lambda job: job.size(), reverse = True)
+    interrupted = []
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        futures = { executor.submit(run_job, job, topology_cache,
+                                    section_store) : job
+                        for job in pending }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except BrokenProcessPool:
+                interrupted.append(futures[future])
+                continue
+            yield result
+    for job in interrupted:
+        with ProcessPoolExecutor(max_workers = 1) as executor:
+            future = executor.submit(run_job, job, topology_cache,
+                                     section_store)
+            try:
+                result = future.result()
+            except BrokenProcessPool as error:
+                _remove_partial(job)
+                result = JobResult(job, "failed",
+                                   "The worker process died: " + str(error))
+        yield result
+
+def run_job(job, topology_cache = None, section_store = None):
+    start = time.perf_counter()
+    partial = [ path + PARTIAL_SUFFIX for path in job.outputs() ]
+    # the outputs are written under other names, so the format cannot be
+    # told from the name of the file convert is given
+    config_format = job.config_format
+    if config_format == "auto" and not job.config_out == None \
+            and strip_compression_extension(job.config_out).endswith(
+                NETCDF_EXTENSIONS):
+        config_format = "netcdf"
+    # nor the compression; the jobs already keep every CPU busy, so each
+    # output is compressed on one thread
+    try:
+        topology_out = open_output(partial[0], "w",
+                                   compression_of_path(job.topology_out),
+                                   threads = 1)
+        config_out = open_output(partial[1], "w",
+                                 compression_of_path(job.config_out),
+                                 threads = 1) if len(partial) > 1 else None
+        try:
+            convert(job.topology_in, topology_out,
+                    config_in = job.config_in, config_out = config_out,
+                    solvent_resname = job.solvent_resname,
+                    num_solvent = job.num_solvent,
+                    config_format = config_format,
+                    topology_cache = TopologyCache(topology_cache) \
+                            if not topology_cache == None else None,
+                    section_store = SectionStore(section_store) \
+                            if not section_store == None else None)
+        finally:
+            topology_out.close()
+            config_out.close() if not config_out == None else None
+        for temporary, path in zip(partial, job.outputs()):
+            os.replace(temporary, path)
+    except (GromosFormatError, IllegalArgumentError, OSError) as error:
+        _remove_partial(job)
+        return JobResult(job, "failed", str(error),
+                         time.perf_counter() - start)
+    except Exception as error:
+        # a bug, or an input problem not caught as such, fails only this job
+        _remove_partial(job)
+        return JobResult(job, "failed",
+                         "{}: {}".format(type(error).__name__, error),
+                         time.perf_counter() - start)
+    return JobResult(job, "converted", None, time.perf_counter() - start)
+
+def _remove_partial(job):
+    for path in job.outputs():
+        if os.path.exists(path + PARTIAL_SUFFIX):
+            os.remove(path + PARTIAL_SUFFIX)
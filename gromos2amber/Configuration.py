@@ -1,5 +1,10 @@
 from . import gromos_format as gf
 from .Errors import GromosFormatError
+from array import array
+from itertools import repeat
+from collections import deque
+from math import cos, sin, sqrt, radians
+from operator import add, mul, truediv
 import sys
 
 NANOMETRE = 10.0
@@ -31,10 +36,13 @@ class Configuration:
             self.box_rotation = [0.0, ] * 3
             self.box_origin = [0.0, ] * 3
 
+        # Positions and velocities are stored as flat arrays of length
+        # 3*num_atoms, in the row-major order of an (num_atoms, 3) array:
+        # x0, y0, z0, x1, y1, z1, ...
         posblock, cols, types  = (
             "POSITION",
             [5, 6, 6, 7, 15, 15, 15],
-            (int, str, str, int, float, float, float),
+            (None, None, None, None, float, float, float),
         ) if "POSITION" in blocks else (
             "POSITIONRED",
             [15, 15, 15],
@@ -46,70 +54,161 @@ class Configuration:
                 "No 'POSITION' or 'POSITIONRED' block found "\
                     "in coordinate file"
             )
-        columns = gf.parse_simple_columns(
-            blocks[posblock],
+        columns = gf.parse_column_arrays(
+            blocks.memoryview(posblock),
             cols,
             types,
             header = False,
         )
 
         x,y,z = columns[-3:]
+        self.num_atoms = len(x)
 
         if "LATTICESHIFTS" in blocks:
-            sx,sy,sz = gf.parse_simple_columns(blocks["LATTICESHIFTS"],
-                                               [10,10,10],
-                                               (int,int,int),
-                                               header = False)
+            sx,sy,sz = gf.parse_column_arrays(blocks.memoryview("LATTICESHIFTS"),
+                                              [10,10,10],
+                                              (int,int,int),
+                                              header = False)
         else:
-            numatoms = len(x)
-            sx = [0]*numatoms
-            sy,sz = list(sx), list(sx)
+            sx = array('q', bytes(8*self.num_atoms))
+            sy,sz = sx,sx
 
         if "VELOCITY" in blocks or "VELOCITYRED" in blocks:
             velblock, cols, types = ("VELOCITY",
                                      [5,6,6,7,15,15,15],
-                                     (int,str,str,int,float,float,float),
+                                     (None,None,None,None,float,float,float),
                                      ) if "VELOCITY" in blocks \
                                              else ("VELOCITYRED",
                                                    [15,15,15],
                                                    (float,float,float),
                                                    )
-            columns = gf.parse_simple_columns(blocks[velblock],
-                                              cols,
-                                              types,
-                                              header = False)
+            columns = gf.parse_column_arrays(blocks.memoryview(velblock),
+                                             cols,
+                                             types,
+                                             header = False)
             vx,vy,vz = columns[-3:]
 
-            self.velocities = [ [xi*nm/ps, yi*nm/ps, zi*nm/ps]
-                                    for xi,yi,zi in zip(vx,vy,vz) ]
+            self.velocities = _interleave([
+                array('d', map(truediv, map(mul, v, repeat(nm)), repeat(ps)))
+                for v in (vx,vy,vz)
+            ])
         else:
             self.velocities = None
 
-        bx,by,bz = self.box_size
+        if not len(sx) == self.num_atoms:
+            raise GromosFormatError(
+                "Number of lattice shifts ({}) does not match the number "\
+                    "of positions ({})".format(len(sx), self.num_atoms)
+            )
 
-        self.positions = [ [xi*nm+sxi*bx, yi*nm+syi*by, zi*nm+szi*bz]
-                            for xi,yi,zi,sxi,syi,szi in zip(x,y,z,sx,sy,sz) ]
+        self.positions = _interleave([
+            array('d', map(add, map(mul, coord, repeat(nm)),
+                                map(mul, shift, repeat(length))))
+            for coord, shift, length in zip((x,y,z), (sx,sy,sz), self.box_size)
+        ])
         self.title = ''.join(blocks["TITLE"][1:-1]).strip()
 
-    def gather_molecules(self, topology):
+        # step number and time in picoseconds, if given
+        self.step, self.time = None, None
+        if "TIMESTEP" in blocks:
+            timestep = blocks["TIMESTEP"]
+            try:
+                step, time = timestep[1].split()
+                self.step, self.time = int(step), float(time)
+            except (IndexError, ValueError):
+                raise GromosFormatError(
+                    "Bad TIMESTEP block: '{}'".format(
+                        ''.join(timestep[1:-1]).strip())
+                )
+
+    def gather_molecules(self, topology, neighbours = None):
+        """ Makes every bonded molecule whole, in a single traversal.
+
+        Each molecule is walked breadth-first over its bonds from its first
+        atom, which stays where it is, and every other atom is moved to the
+        periodic image nearest to the atom it was reached from. Rectangular
+        (boxtype 1) and triclinic (boxtype 2) boxes are supported. Returns
+        the number of molecules gathered, and records the number of atoms
+        which were moved to another image in num_reimaged_atoms.
+
+        neighbours is bond_graph(topology), which may be given to save
+        building it again for every frame of a trajectory.
+        """
+        self.num_reimaged_atoms = 0
+        if sum(self.box_size) == 0:
+            return 0
+        angles = self.box_angle if self.boxtype == 2 else [90.0]*3
+        vectors = _box_vectors(self.box_size, angles)
+        if neighbours == None:
+            neighbours = bond_graph(topology)
         x = self.positions
-        box = self.box_size
-        bond_lists = (topology.bonds_wH, topology.bonds_woH)
-        if sum(box) == 0:
-            return []
-        num_broken_bond_dims = 1
-        while num_broken_bond_dims > 0:
-            num_broken_bond_dims = 0
-            for bonds in bond_lists:
-                for bond in bonds:
-                    i,j = bond.atoms
-                    for d in range(3):
-                        if abs(x[i][d]-x[j][d]) > 0.5*box[d]:
-                            num_broken_bond_dims += 1
-                            if x[i][d] > x[j][d]:
-                                if x[j][d]>box[d]: raise(Exception("stuck in loop"))
-                                x[j][d] += box[d]
-                            else:
-                                if x[i][d]>box[d]: raise(Exception("stuck in loop"))
-                                x[i][d] += box[d]
+        visited = bytearray(len(neighbours))
+        num_molecules = 0
+        for root, bonded in enumerate(neighbours):
+            if visited[root] or len(bonded) == 0:
+                continue
+            num_molecules += 1
+            visited[root] = 1
+            queue = deque([root])
+            while queue:
+                i = queue.popleft()
+                for j in neighbours[i]:
+                    if not visited[j]:
+                        visited[j] = 1
+                        if _nearest_image(x, i, j, vectors):
+                            self.num_reimaged_atoms += 1
+                        queue.append(j)
+        return num_molecules
+
+def bond_graph(topology):
+    """ The atoms bonded to each atom of the solute """
+    return _bond_graph(
+        len(topology.atoms),
+        (topology.bonds_wH, topology.bonds_woH),
+    )
+
+def _bond_graph(num_atoms, bond_lists):
+    neighbours = [ [] for i in range(num_atoms) ]
+    for bonds in bond_lists:
+        for i,j in zip(bonds.atoms[0::2], bonds.atoms[1::2]):
+            neighbours[i].append(j)
+            neighbours[j].append(i)
+    return neighbours
+
+def _box_vectors(lengths, angles):
+    # Box vectors a, b, c with a along x and b in the xy plane, so that the
+    # matrix of box vectors is lower triangular.
+    a, b, c = lengths
+    if all(angle == 90.0 for angle in angles):
+        return [ [a, 0.0, 0.0], [0.0, b, 0.0], [0.0, 0.0, c] ]
+    cos_alpha, cos_beta, cos_gamma = ( cos(radians(t)) for t in angles )
+    sin_gamma = sin(radians(angles[2]))
+    cy = (cos_alpha - cos_beta*cos_gamma)/sin_gamma
+    return [
+        [a, 0.0, 0.0],
+        [b*cos_gamma, b*sin_gamma, 0.0],
+        [c*cos_beta, c*cy, c*sqrt(1.0 - cos_beta**2 - cy**2)],
+    ]
+
+def _nearest_image(x, i, j, vectors):
+    # Shifts atom j by whole box vectors to the image nearest to atom i,
+    # returning whether it was moved. Reducing along c, then b, then a gives
+    # the minimum image for a lower triangular box matrix.
+    d = [ x[3*j+k] - x[3*i+k] for k in range(3) ]
+    moved = False
+    for k in (2, 1, 0):
+        n = round(d[k]/vectors[k][k])
+        if n != 0:
+            moved = True
+            for m in range(3):
+                d[m] -= n*vectors[k][m]
+                x[3*j+m] -= n*vectors[k][m]
+    return moved
 
+def _interleave(columns):
+    # [x, y, z] -> x0, y0, z0, x1, y1, z1, ...
+    ncols = len(columns)
+    result = array('d', bytes(8*ncols*len(columns[0])))
+    for c, column in enumerate(columns):
+        result[c::ncols] = column
+    return result
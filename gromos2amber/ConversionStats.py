@@ -0,0 +1,84 @@
+""" Time and memory used by each stage of a conversion.
+
+Each stage and each section of the prmtop records its wall clock time, its
+CPU time and, if memory tracing is switched on, the peak memory traced by
+tracemalloc while it ran, above the memory in use when it started. Tracing
+memory slows Python down considerably, so the times of a traced conversion
+are only comparable with each other.
+"""
+
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+class ConversionStats:
+    def __init__(self, trace_memory = True):
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self.sections = {}
+        self.counts = {}
+        self._peaks = [] # peak memory seen by each unfinished stage so far
+        self._started_tracing = False
+
+    def __enter__(self):
+        """ Measures the whole conversion, starting tracemalloc if needed """
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._total = self._measure(self.stages, "total")
+        self._total.__enter__()
+        return self
+
+    def __exit__(self, *exception):
+        self._total.__exit__(*exception)
+        self.total = self.stages.pop("total")
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        return False
+
+    def stage(self, name):
+        return self._measure(self.stages, name)
+
+    def section(self, title):
+        return self._measure(self.sections, title)
+
+    def count(self, name, value):
+        self.counts[name] = value
+
+    @contextmanager
+    def _measure(self, results, name):
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            if len(self._peaks) > 0:
+                self._peaks[-1] = max(self._peaks[-1], peak)
+            tracemalloc.reset_peak()
+            self._peaks.append(current)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            result = {
+                "wall_seconds" : time.perf_counter() - wall,
+                "cpu_seconds" : time.process_time() - cpu,
+            }
+            if tracing:
+                peak = max(self._peaks.pop(), tracemalloc.get_traced_memory()[1])
+                result["peak_bytes"] = peak - current
+                if len(self._peaks) > 0:
+                    self._peaks[-1] = max(self._peaks[-1], peak)
+            results[name] = result
+
+    def as_dict(self):
+        return {
+            "total" : getattr(self, "total", {}),
+            "stages" : self.stages,
+            "sections" : self.sections,
+            "counts" : self.counts,
+        }
+
+    def write_json(self, io):
+        json.dump(self.as_dict(), io, indent = 1)
+        io.write("\n")
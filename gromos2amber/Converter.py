@@ -1,9 +1,20 @@
 
 from .Topology import Topology
-from .Configuration import Configuration
+from .Configuration import Configuration, bond_graph
+from .Trajectory import iter_frames
 from .AmberTopologyWriter import AmberTopologyWriter
-from .AmberConfigurationWriter import AmberConfigurationWriter
+from .AmberConfigurationWriter import AmberConfigurationWriter, \
+        AmberNetCDFRestartWriter, NETCDF_EXTENSIONS, inpcrd_overflows
+from .AmberTrajectoryWriter import AmberNetCDFTrajectoryWriter, \
+        AmberMdcrdWriter
+from .ConversionStats import ConversionStats
 from .Errors import GromosFormatError, IllegalArgumentError
+from .gromos_format import read_buffer
+from .compressed_format import compression_of_path, \
+        strip_compression_extension
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+import os
 
 def convert( topology_in,
                   topology_out,
@@ -11,48 +22,118 @@ def convert( topology_in,
                   config_out = None, 
                   solvent_resname="SOL",
                   num_solvent = -1,
+                  topology_cache = None,
+                  config_format = "auto",
+                  workers = 1,
+                  profile = False,
+                  incremental = False,
+                  section_store = None,
                   ):
+    """ workers is the number of processes in which to render the sections
+    of the output topology (None for one per CPU).
+
+    With profile, returns a ConversionStats of the time and memory used by
+    each stage and prmtop section, and counts of what was converted.
+
+    config_format is "inpcrd" for an ASCII restart, "netcdf" for a
+    NetCDF restart, or "auto" for a NetCDF restart if config_out is named
+    with a NetCDF extension or the values would overflow the fields of an
+    ASCII restart, and an ASCII restart otherwise. A NetCDF restart is
+    written to the binary buffer of a text config_out.
+
+    With incremental, topology_out is a path, and the sections of the
+    output topology which depend only on inputs that are unchanged since
+    the last incremental conversion to that path are copied from it rather
+    than rendered again (see AmberTopologyWriter.write_incremental).
+
+    With section_store (a SectionStore), the sections of the output
+    topology are kept in the store, and topology_out receives a manifest
+    from which SectionStore.assemble rebuilds the topology.
+
+    Inputs may be compressed with gzip, xz or bzip2, and are recognised by
+    their contents. A compressed configuration is decompressed on another
+    thread while the topology is parsed. For compressed outputs, see
+    compressed_format.open_output. """
     if 4 < len(solvent_resname) and not 0 == len(solvent_resname):
         raise IllegalArgumentError(
             "Bad solvent residue name '{}'. ".format(solvent_resname) +\
                     "Solvent residue name must be 1-4 characters long."
         )
     
+    if not config_format in ("auto", "inpcrd", "netcdf"):
+        raise IllegalArgumentError(
+            "Bad configuration format '{}'. ".format(config_format) +\
+                    "Must be one of 'auto', 'inpcrd' or 'netcdf'."
+        )
+
+    if incremental and not isinstance(topology_out, (str, os.PathLike)):
+        raise IllegalArgumentError(
+            "Incremental conversion needs the path of the output topology."
+        )
+
+    if incremental and not compression_of_path(topology_out) == None:
+        raise IllegalArgumentError(
+            "Incremental conversion cannot write a compressed topology."
+        )
+
+    if incremental and not section_store == None:
+        raise IllegalArgumentError(
+            "Incremental conversion cannot write to a section store."
+        )
+
     if config_in == None and not config_out == None:
         raise IllegalArgumentError(
             "Output AMBER coordinates were requested but "\
                 "no input gromos coordinates were provided."
         )
-    
+
+    if not profile:
+        _convert(topology_in, topology_out, config_in, config_out,
+                 solvent_resname, num_solvent, topology_cache, config_format,
+                 workers, incremental, section_store, None)
+        return None
+    stats = ConversionStats()
+    with stats:
+        _convert(topology_in, topology_out, config_in, config_out,
+                 solvent_resname, num_solvent, topology_cache, config_format,
+                 workers, incremental, section_store, stats)
+    return stats
+
+def _convert(topology_in, topology_out, config_in, config_out,
+             solvent_resname, num_solvent, topology_cache, config_format,
+             workers, incremental, section_store, stats):
+    stage = lambda name: nullcontext() if stats == None else stats.stage(name)
+
+    # read (and decompress) the configuration while the topology is parsed
+    if not config_in == None:
+        config_buffer = _read_in_background(config_in)
+
     try:
-        topology = Topology(topology_in)
+        with stage("topology"):
+            if topology_cache == None:
+                topology = Topology(topology_in)
+            else:
+                topology = topology_cache.load(topology_in)
     except GromosFormatError as error:
         raise GromosFormatError( "Bad input topology format: " + str(error))
     
     if not config_in == None:
         try:
-            config = Configuration(config_in)
-            if not config.boxtype in (0, 1, 2):
-                raise GromosFormatError(
-                    "Only vacuum, rectangular, and triclinic boxes are supported."
-                )
-            if not 0 == sum(config.box_rotation):
-                raise GromosFormatError(
-                    "Non-zero box rotation angles (phi, theta, psi) are not supported."
-                )
-            if not 0 == sum(config.box_origin):
-                raise GromosFormatError(
-                    "Non-zero box origin coordinates are not supported."
-                )
+            with stage("configuration"):
+                config = Configuration(config_buffer.result())
+            _check_box(config)
         except GromosFormatError as error:
             raise GromosFormatError(
                 "There is a problem with the coordinate file: " + str(error)
             )
-        # Gather molecules by bonds if the box is rectangular
-        if config.boxtype == 1:
-            config.gather_molecules(topology)
+        # Gather molecules by bonds if the box is rectangular or triclinic
+        num_gathered, num_reimaged = 0, 0
+        if config.boxtype in (1, 2):
+            with stage("gather_molecules"):
+                num_gathered = config.gather_molecules(topology)
+            num_reimaged = config.num_reimaged_atoms
 
-        num_atoms = len(config.positions)
+        num_atoms = config.num_atoms
         num_solvent_molecules = ( num_atoms - len(topology.atoms) ) \
             * 1.0 / len(topology.solvent_atoms) 
         if not int(num_solvent_molecules) == num_solvent_molecules:
@@ -70,10 +151,109 @@ def convert( topology_in,
     else:
         num_solvent_molecules = num_solvent
     
-    topology.add_solvent(num_solvent_molecules, solvent_resname)
+    with stage("add_solvent"):
+        topology.add_solvent(num_solvent_molecules, solvent_resname)
     
-    AmberTopologyWriter(topology).write(topology_out)
+    with stage("prmtop"):
+        writer = AmberTopologyWriter(topology)
+        if incremental:
+            rendered = writer.write_incremental(topology_out, stats = stats)
+        elif not section_store == None:
+            rendered = writer.write_to_store(topology_out, section_store,
+                                             stats = stats)
+        else:
+            writer.write(topology_out, workers = workers, stats = stats)
     
     if not config_out == None:
-        AmberConfigurationWriter(config).write(config_out)
+        if config_format == "auto":
+            name = strip_compression_extension(
+                getattr(config_out, 'name', ''))
+            netcdf = name.endswith(NETCDF_EXTENSIONS) \
+                    or inpcrd_overflows(config)
+        else:
+            netcdf = config_format == "netcdf"
+        with stage("ncrst" if netcdf else "inpcrd"):
+            if netcdf:
+                AmberNetCDFRestartWriter(config).write(config_out)
+            else:
+                AmberConfigurationWriter(config).write(config_out)
+
+    if not stats == None:
+        solvent = topology.solvent
+        stats.count("atoms", topology.num_atoms())
+        stats.count("solute_atoms", len(topology.atoms))
+        stats.count("solvent_molecules", solvent.num_molecules)
+        stats.count("bonds", len(topology.bonds_wH) + len(topology.bonds_woH)
+                             + solvent.num_bonds())
+        stats.count("angles", len(topology.angles_wH)
+                              + len(topology.angles_woH))
+        stats.count("dihedrals", len(topology.dihedrals_wH)
+                                 + len(topology.dihedrals_woH))
+        stats.count("extra_dihedrals", topology.num_extra_dihedrals)
+        stats.count("impropers", len(topology.impropers_wH)
+                                 + len(topology.impropers_woH))
+        if incremental or not section_store == None:
+            stats.count("rendered_sections", len(rendered))
+        if not config_in == None:
+            stats.count("gathered_molecules", num_gathered)
+            stats.count("reimaged_atoms", num_reimaged)
+
+
+def convert_trajectory(topology_in,
+                       trajectory_in,
+                       trajectory_out,
+                       netcdf = True,
+                       topology_cache = None,
+                       ):
+    """ Converts a GROMOS trajectory to an Amber NetCDF trajectory (a binary
+    file), or with netcdf False an ASCII mdcrd trajectory (a text file),
+    one frame at a time. Molecules are gathered in every frame, as in
+    convert. Returns the number of frames. """
+    try:
+        if topology_cache == None:
+            topology = Topology(topology_in)
+        else:
+            topology = topology_cache.load(topology_in)
+    except GromosFormatError as error:
+        raise GromosFormatError( "Bad input topology format: " + str(error))
+
+    neighbours = bond_graph(topology)
+    writer = AmberNetCDFTrajectoryWriter(trajectory_out) if netcdf \
+            else AmberMdcrdWriter(trajectory_out)
+    num_frames = 0
+    try:
+        for frame in iter_frames(trajectory_in):
+            _check_box(frame)
+            if frame.boxtype in (1, 2):
+                frame.gather_molecules(topology, neighbours)
+            writer.write_frame(frame)
+            num_frames += 1
+    except GromosFormatError as error:
+        raise GromosFormatError(
+            "There is a problem with frame {} of the trajectory: {}".format(
+                num_frames+1, error)
+        )
+    finally:
+        writer.close()
+    return num_frames
+
+def _read_in_background(io):
+    # A future of the buffer of io, see gromos_format.read_buffer
+    executor = ThreadPoolExecutor(max_workers = 1)
+    future = executor.submit(read_buffer, io)
+    executor.shutdown(wait = False)
+    return future
 
+def _check_box(config):
+    if not config.boxtype in (0, 1, 2):
+        raise GromosFormatError(
+            "Only vacuum, rectangular, and triclinic boxes are supported."
+        )
+    if not 0 == sum(config.box_rotation):
+        raise GromosFormatError(
+            "Non-zero box rotation angles (phi, theta, psi) are not supported."
+        )
+    if not 0 == sum(config.box_origin):
+        raise GromosFormatError(
+            "Non-zero box origin coordinates are not supported."
+        )
@@ -2,5 +2,8 @@
 class GromosFormatError(Exception):
     pass
 
+class AmberFormatError(Exception):
+    pass
+
 class IllegalArgumentError(ValueError):
     pass
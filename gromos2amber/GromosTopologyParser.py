@@ -1,21 +1,28 @@
-from .gromos_format import parse_simple_columns, parse_array_block
+from .gromos_format import parse_column_arrays, parse_array_block
+from .gromos_format import BlockIndex, read_buffer
 from .Errors import GromosFormatError
+from functools import wraps
+
+def _memoize(accessor):
+    """ Parses a block the first time it is requested. Later calls return
+    the same (shared) result, which callers must not modify. """
+    @wraps(accessor)
+    def memoized(self, *args, **kwargs):
+        key = (accessor.__name__, args, tuple(sorted(kwargs.items())))
+        if not key in self._parsed:
+            self._parsed[key] = accessor(self, *args, **kwargs)
+        return self._parsed[key]
+    return memoized
 
 class GromosTopologyParser:
+    """ Blocks are only located when the file is opened. Each block is
+    parsed the first time its accessor is called, so blocks which are never
+    used cost nothing beyond finding their boundaries. """
 
+    # io may be a path or a file object, see gromos_format.read_buffer
     def __init__(self, io):
-        self.blocks = {}
-        lines = [line for line in io.readlines()
-                    if line.strip() and not line[0] == '#' ]
-        start = 0
-        for l,line in enumerate(lines):
-            if l == start:
-                blockname = line.strip()
-            elif line == "END\n":
-                self.blocks[blockname] = lines[start:l+1]
-                start = l+1
-            else:
-                continue
+        self.blocks = BlockIndex(read_buffer(io))
+        self._parsed = {}
         if len(self.blocks) == 0:
             raise GromosFormatError(
                 "Invalid GROMOS topology file format. No blocks found."
@@ -48,6 +55,25 @@ class GromosTopologyParser:
 
         return block
 
+    def getdata(self, blockname):
+        """ The raw bytes of a block, see gromos_format.BlockIndex """
+        if not blockname in self.blocks:
+            self.getblock(blockname) # raises the usual missing block error
+        return self.blocks.memoryview(blockname)
+
+    def count(self, blockname):
+        """ The number of entries given on the first line of a block,
+        without parsing the rest of the block """
+        if not blockname in self.blocks:
+            self.getblock(blockname) # raises the usual missing block error
+        header = self.blocks.head(blockname, 2)
+        try:
+            return int(header[1])
+        except (IndexError, ValueError):
+            message = "Could not parse the first line of block '{}' "\
+                " in the topology files as an integer."
+            raise GromosFormatError(message.format(blockname))
+
     def checkblockheader(self, blockname, size):
 # for blocks where the first line is the number of data lines
         if blockname in self.blocks:
@@ -56,6 +82,7 @@ class GromosTopologyParser:
             )
         return self.blocks[blockname]
 
+    @_memoize
     def SOLUTEATOM(self):
         fieldwidths = [6,5,5,4,9,9,3,6]
         start_exclusions = sum(fieldwidths)
@@ -112,10 +139,12 @@ class GromosTopologyParser:
         return ( atomindex, residue, name, typecode, mass, charge,
                  charge_group_code, exclusions, neigh14 )
 
+    @_memoize
     def TITLE(self):
         block = self.getblock("TITLE")
         return ''.join(block[1:])[0:-1] if len(block) > 1 else ''
 
+    @_memoize
     def PHYSICALCONSTANTS(self):
         block = self.getblock("PHYSICALCONSTANTS", checkheader = False)
         if 4+2 < len(block):
@@ -125,69 +154,85 @@ class GromosTopologyParser:
             )
         return [ float(block[i+1]) for i in range(4) ]
 
+    @_memoize
     def TOPVERSION(self):
         return ''.join(self.getblock("TOPVERSION")[1])[0:-1]
 
+    @_memoize
     def ATOMTYPENAME(self):
         block = self.getblock("ATOMTYPENAME", checkheader = True)
         numtypes = int(block[1])
         return [ block[i+2][0:-1].strip() for i in range(numtypes) ]
 
+    @_memoize
     def RESNAMES(self):
         block = self.getblock("RESNAME", checkheader = True)
         numresidues = int(block[1])
         return [ block[i+2][0:-1] for i in range(numresidues) ]
 
+    @_memoize
     def BONDSTRETCHTYPE(self):
-        block = self.getblock("BONDSTRETCHTYPE")
-        return parse_simple_columns(block, [16,16,16], [float,float,float])
+        data = self.getdata("BONDSTRETCHTYPE")
+        return parse_column_arrays(data, [16,16,16], [float,float,float])
 
+    @_memoize
     def BOND(self, H = False):
-        block = self.getblock( "BOND" + ("H" if H else "") )
-        return parse_simple_columns(block, [7,7,5], [int,int,int])
+        data = self.getdata( "BOND" + ("H" if H else "") )
+        return parse_column_arrays(data, [7,7,5], [int,int,int])
 
+    @_memoize
     def BONDANGLEBENDTYPE(self):
-        block = self.getblock("BONDANGLEBENDTYPE")
-        return parse_simple_columns(block, [16,16,16], [float,float,float])
+        data = self.getdata("BONDANGLEBENDTYPE")
+        return parse_column_arrays(data, [16,16,16], [float,float,float])
 
+    @_memoize
     def BONDANGLE(self, H = False):
-        block = self.getblock( "BONDANGLE" + ("H" if H else "") )
-        return parse_simple_columns(block, [7,7,7,5], [int,int,int,int])
+        data = self.getdata( "BONDANGLE" + ("H" if H else "") )
+        return parse_column_arrays(data, [7,7,7,5], [int,int,int,int])
 
+    @_memoize
     def IMPDIHEDRALTYPE(self):
-        block = self.getblock("IMPDIHEDRALTYPE")
-        return parse_simple_columns(block, [15,15], [float,float])
+        data = self.getdata("IMPDIHEDRALTYPE")
+        return parse_column_arrays(data, [15,15], [float,float])
 
+    @_memoize
     def IMPDIHEDRAL(self, H = False):
-        block = self.getblock( "IMPDIHEDRAL" + ("H" if H else "") )
-        return parse_simple_columns(block, [7,7,7,7,5], [int,int,int,int,int])
+        data = self.getdata( "IMPDIHEDRAL" + ("H" if H else "") )
+        return parse_column_arrays(data, [7,7,7,7,5], [int,int,int,int,int])
 
+    @_memoize
     def TORSDIHEDRALTYPE(self):
-        block = self.getblock("TORSDIHEDRALTYPE")
-        return parse_simple_columns(block, [10,11,4], [float,float,int])
+        data = self.getdata("TORSDIHEDRALTYPE")
+        return parse_column_arrays(data, [10,11,4], [float,float,int])
 
+    @_memoize
     def DIHEDRAL(self, H = False):
-        block = self.getblock( "DIHEDRAL" + ("H" if H else "") )
-        return parse_simple_columns(block, [7,7,7,7,5], [int,int,int,int,int])
+        data = self.getdata( "DIHEDRAL" + ("H" if H else "") )
+        return parse_column_arrays(data, [7,7,7,7,5], [int,int,int,int,int])
 
+    @_memoize
     def LJPARAMETERS(self):
-        block = self.getblock("LJPARAMETERS")
-        return parse_simple_columns(block, [5,5,14,14,14,14],
+        data = self.getdata("LJPARAMETERS")
+        return parse_column_arrays(data, [5,5,14,14,14,14],
                                     [int,int,float,float,float,float])
+    @_memoize
     def SOLUTEMOLECULES(self):
         block = self.getblock("SOLUTEMOLECULES")
         return parse_array_block(block, 6, int)
 
+    @_memoize
     def SOLVENTATOM(self):
-        block = self.getblock("SOLVENTATOM")
-        return parse_simple_columns(block, [4,6,4,11,11],
+        data = self.getdata("SOLVENTATOM")
+        return parse_column_arrays(data, [4,6,4,11,11],
                                       [int,str,int,float,float])
+    @_memoize
     def SOLVENTCONSTR(self):
-        block = self.getblock("SOLVENTCONSTR")
-        return parse_simple_columns(block, [5,5,15], [int,int,float])
+        data = self.getdata("SOLVENTCONSTR")
+        return parse_column_arrays(data, [5,5,15], [int,int,float])
 
+    @_memoize
     def LJEXCEPTIONS(self):
-        block = self.getblock("LJEXCEPTIONS")
-        return parse_simple_columns(block, [5,5,14,14], [int,int,float,float] )
+        data = self.getdata("LJEXCEPTIONS")
+        return parse_column_arrays(data, [5,5,14,14], [int,int,float,float] )
 
 
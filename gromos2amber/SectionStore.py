@@ -0,0 +1,157 @@
+""" Content-addressed store of rendered parm7 sections.
+
+Every section is stored once, however many topologies contain it, under
+
+  DIRECTORY/objects/SHA[:2]/SHA[2:]
+
+where SHA is the SHA-256 of its bytes. A topology written to the store is
+described by a manifest, a small JSON file listing the digest of each of
+its sections in order, from which assemble rebuilds the parm7 file by
+concatenating the objects. Each section is also recorded under
+
+  DIRECTORY/keys/KEY
+
+where KEY identifies the inputs it was rendered from (see
+AmberTopologyWriter.write_to_store), so that a section already rendered
+for one topology is not rendered again for another.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+
+from .Errors import IllegalArgumentError
+
+MANIFEST_FORMAT = 1
+# mkstemp creates files readable by their owner alone, but a store may be
+# shared between users
+FILE_MODE = 0o644
+
+class SectionStore:
+    def __init__(self, directory):
+        self.directory = directory
+        self.objects = os.path.join(directory, "objects")
+        self.keys = os.path.join(directory, "keys")
+        os.makedirs(self.objects, exist_ok = True)
+        os.makedirs(self.keys, exist_ok = True)
+
+    def object_path(self, digest):
+        return os.path.join(self.objects, digest[:2], digest[2:])
+
+    def put(self, chunks):
+        """ Stores the concatenation of chunks (bytes), returning its
+        digest. Chunks are written as they are hashed, so the section is
+        never held in memory in its entirety. """
+        digest = hashlib.sha256()
+        descriptor, temporary = tempfile.mkstemp(dir = self.objects)
+        try:
+            with os.fdopen(descriptor, "wb") as entry:
+                os.fchmod(descriptor, FILE_MODE)
+                for chunk in chunks:
+                    digest.update(chunk)
+                    entry.write(chunk)
+            digest = digest.hexdigest()
+            path = self.object_path(digest)
+            if os.path.exists(path):
+                os.remove(temporary)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok = True)
+                os.replace(temporary, path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        return digest
+
+    def lookup(self, key):
+        """ The digest of the section recorded under key, or None if there
+        is none, or its object has been deleted """
+        try:
+            with open(os.path.join(self.keys, key)) as entry:
+                digest = entry.read().strip()
+        except OSError:
+            return None
+        return digest if os.path.exists(self.object_path(digest)) else None
+
+    def record(self, key, digest):
+        descriptor, temporary = tempfile.mkstemp(dir = self.keys)
+        with os.fdopen(descriptor, "w") as entry:
+            os.fchmod(descriptor, FILE_MODE)
+            entry.write(digest + "\n")
+        os.replace(temporary, os.path.join(self.keys, key))
+
+    def assemble(self, manifest, io):
+        """ Writes the parm7 file described by manifest (as returned by
+        read_manifest) to io, a path or a binary file object, copying the
+        objects within the kernel where the platform allows """
+        if isinstance(io, (str, os.PathLike)):
+            with open(io, "wb") as output:
+                return self.assemble(manifest, output)
+        io.flush()
+        for section in manifest["sections"]:
+            path = self.object_path(section["sha256"])
+            try:
+                source = open(path, "rb")
+            except OSError:
+                raise IllegalArgumentError(
+                    "Section {} ({}) is missing from the store {}.".format(
+                        section["title"], section["sha256"], self.directory)
+                )
+            with source:
+                _copy(source, io, section["length"])
+
+def write_manifest(io, sections):
+    """ sections are dicts of "title", "sha256" and "length" """
+    json.dump({ "format" : MANIFEST_FORMAT, "sections" : sections },
+              io, indent = 1)
+    io.write("\n")
+
+def read_manifest(io):
+    if isinstance(io, (str, os.PathLike)):
+        with open(io) as manifest_file:
+            return read_manifest(manifest_file)
+    try:
+        manifest = json.load(io)
+    except ValueError as error:
+        raise IllegalArgumentError("Bad section manifest: " + str(error))
+    if not isinstance(manifest, dict) \
+            or not manifest.get("format") == MANIFEST_FORMAT:
+        raise IllegalArgumentError(
+            "Bad section manifest: expected format {}.".format(
+                MANIFEST_FORMAT)
+        )
+    return manifest
+
+# Copies length bytes with copy_file_range or sendfile where the platform
+# and the files allow, and by reading and writing otherwise
+def _copy(source, destination, length):
+    try:
+        source_fd, destination_fd = source.fileno(), destination.fileno()
+    except (AttributeError, OSError, ValueError):
+        shutil.copyfileobj(source, destination)
+        return
+    for copy_range in (getattr(os, "copy_file_range", None),
+                       _sendfile if hasattr(os, "sendfile") else None):
+        if copy_range == None:
+            continue
+        copied = 0
+        try:
+            while copied < length:
+                count = copy_range(source_fd, destination_fd, length - copied)
+                if count == 0:
+                    break
+                copied += count
+        except OSError:
+            if copied == 0:
+                continue # not supported between these files, try another
+            raise
+        if copied == length:
+            return
+        raise OSError("{} is shorter than its manifest says".format(
+            source.name))
+    shutil.copyfileobj(source, destination)
+
+def _sendfile(source_fd, destination_fd, count):
+    return os.sendfile(destination_fd, source_fd, None, count)
@@ -0,0 +1,252 @@
+""" A long-running conversion server, and its client.
+
+The server listens on a Unix socket or a localhost TCP port and speaks
+HTTP (see http_format). POST /convert takes a JSON object of
+
+  {"topology": GROMOS_TOPOLOGY, "config": GROMOS_CONFIGURATION or null,
+   "solvent_resname": "SOL", "num_solvent": 0, "config_format": "auto"}
+
+(only "topology" is required) and returns
+
+  {"topology": AMBER_TOPOLOGY, "config": BASE64_RESTART or null,
+   "config_format": "inpcrd" or "netcdf"}
+
+or {"error": MESSAGE, "type": EXCEPTION_NAME} with status 400. GET /status
+returns counts of requests served.
+
+Requests are read concurrently by an asyncio event loop and converted in a
+pool of worker processes, which live as long as the server. Each worker
+keeps recently used topologies in a MemoryTopologyCache, and the force
+field tables and sections shared between topologies (see
+Topology.MAX_TYPE_TABLES and AmberTopologyWriter.TYPE_TABLE_SECTIONS), so
+repeated conversions skip both interpreter start-up and parsing. If a
+worker dies, the pool is replaced, and only the request which killed it
+fails, with status 500.
+"""
+
+import io
+import base64
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from .Converter import convert as _convert
+from .TopologyCache import MemoryTopologyCache
+from .Errors import GromosFormatError, IllegalArgumentError
+from .gromos_format import read_buffer
+from .http_format import read_request, read_response, \
+        format_request, format_response
+
+LOCALHOST = "127.0.0.1"
+DEFAULT_CACHE_BYTES = 256*1024**2 # per worker
+
+ERRORS = {
+    "GromosFormatError" : GromosFormatError,
+    "IllegalArgumentError" : IllegalArgumentError,
+}
+
+class ConversionServer:
+    def __init__(self, workers = None, cache_bytes = DEFAULT_CACHE_BYTES):
+        """ workers is the number of worker processes (None for one per
+        CPU), and cache_bytes the size of the topology cache of each """
+        self.workers = workers
+        self.cache_bytes = cache_bytes
+        self.executor = None
+        self.server = None
+        self.counts = { "requests" : 0, "converted" : 0, "failed" : 0 }
+
+    async def start(self, path = None, host = LOCALHOST, port = None):
+        """ Listens on the Unix socket path, or else on host and port """
+        if path == None and port == None:
+            raise IllegalArgumentError(
+                "The server needs a socket path or a port to listen on."
+            )
+        self.executor = self._new_executor(self.workers)
+        if not path == None:
+            self.server = await asyncio.start_unix_server(self._serve, path)
+        else:
+            self.server = await asyncio.start_server(self._serve, host, port)
+        return self.server
+
+    async def serve_forever(self, path = None, host = LOCALHOST, port = None):
+        await self.start(path, host, port)
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            self.close()
+
+    def close(self):
+        if not self.server == None:
+            self.server.close()
+        if not self.executor == None:
+            self.executor.shutdown(cancel_futures = True)
+            self.executor = None
+
+    async def _serve(self, reader, writer):
+        # one connection, on which requests are answered in turn
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except IllegalArgumentError as error:
+                    writer.write(format_response(400, _error(error)))
+                    break
+                if request == None:
+                    break
+                method, target, headers, body = request
+                status, response = await self._respond(method, target, body)
+                writer.write(format_response(status, response))
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, method, target, body):
+        self.counts["requests"] += 1
+        if target == "/status":
+            if not method == "GET":
+                return 405, { "error" : "Use GET for /status." }
+            return 200, self.counts
+        if not target == "/convert":
+            return 404, { "error" : "No such resource: " + target }
+        if not method == "POST":
+            return 405, { "error" : "Use POST for /convert." }
+        try:
+            response = await self._convert(body)
+        except (GromosFormatError, IllegalArgumentError) as error:
+            self.counts["failed"] += 1
+            return 400, _error(error)
+        except BrokenProcessPool as error:
+            self.counts["failed"] += 1
+            return 500, { "error" : "The worker process died: " + str(error),
+                          "type" : type(error).__name__ }
+        except Exception as error:
+            self.counts["failed"] += 1
+            return 500, _error(error)
+        self.counts["converted"] += 1
+        return 200, response
+
+    async def _convert(self, body):
+        loop = asyncio.get_running_loop()
+        executor = self.executor
+        try:
+            return await loop.run_in_executor(executor, _convert_request, body)
+        except BrokenProcessPool:
+            # A worker died, and with it the pool and every request it was
+            # converting. The pool is replaced, and each of those requests
+            # is converted again in a process of its own, as in
+            # Batch.run_batch, so that only a request which kills its worker
+            # again fails.
+            if self.executor is executor:
+                executor.shutdown(wait = False, cancel_futures = True)
+                self.executor = self._new_executor(self.workers)
+        isolated = self._new_executor(1)
+        try:
+            return await loop.run_in_executor(isolated, _convert_request, body)
+        finally:
+            isolated.shutdown(wait = False)
+
+    def _new_executor(self, workers):
+        return ProcessPoolExecutor(max_workers = workers,
+                                   initializer = _init_worker,
+                                   initargs = (self.cache_bytes,))
+
+class ConversionClient:
+    """ Converts with a ConversionServer at the Unix socket path, or else
+    at host and port """
+    def __init__(self, path = None, host = LOCALHOST, port = None):
+        self.path, self.host, self.port = path, host, port
+
+    async def convert(self,
+                      topology_in,
+                      topology_out,
+                      config_in = None,
+                      config_out = None,
+                      solvent_resname = "SOL",
+                      num_solvent = 0,
+                      config_format = "auto",
+                      ):
+        """ As gromos2amber.convert. Inputs are paths or file objects, and
+        are sent to the server whole. A NetCDF restart is written to the
+        binary buffer of a text config_out. """
+        request = {
+            "topology" : _read_text(topology_in),
+            "config" : None if config_in == None else _read_text(config_in),
+            "solvent_resname" : solvent_resname,
+            "num_solvent" : num_solvent,
+            "config_format" : config_format,
+        }
+        status, response = await self.request("POST", "/convert", request)
+        if not status == 200:
+            raise ERRORS.get(response.get("type"), IllegalArgumentError)(
+                response.get("error", "Conversion failed."))
+        topology_out.write(response["topology"])
+        if not config_out == None and not response["config"] == None:
+            config = base64.b64decode(response["config"])
+            if response["config_format"] == "netcdf":
+                getattr(config_out, 'buffer', config_out).write(config)
+            else:
+                config_out.write(config.decode())
+
+    async def status(self):
+        return (await self.request("GET", "/status"))[1]
+
+    async def request(self, method, target, body = None):
+        """ The status and JSON body of the response to one request """
+        if self.path == None:
+            reader, writer = await asyncio.open_connection(self.host,
+                                                           self.port)
+        else:
+            reader, writer = await asyncio.open_unix_connection(self.path)
+        try:
+            writer.write(format_request(method, target, body,
+                                        keep_alive = False))
+            await writer.drain()
+            status, _, response = await read_response(reader)
+        finally:
+            writer.close()
+        return status, response
+
+# The topology cache of each worker process
+_worker_cache = None
+
+def _init_worker(cache_bytes):
+    global _worker_cache
+    _worker_cache = MemoryTopologyCache(cache_bytes)
+
+def _convert_request(request):
+    if not isinstance(request, dict) or not "topology" in request:
+        raise IllegalArgumentError("A conversion needs a topology.")
+    topology_out = io.StringIO()
+    config_in = request.get("config")
+    config_out = None if config_in == None \
+            else io.TextIOWrapper(io.BytesIO(), write_through = True)
+    _convert(request["topology"].encode(),
+             topology_out,
+             config_in = None if config_in == None else config_in.encode(),
+             config_out = config_out,
+             solvent_resname = request.get("solvent_resname", "SOL"),
+             num_solvent = request.get("num_solvent", 0),
+             config_format = request.get("config_format", "auto"),
+             topology_cache = _worker_cache)
+    response = {
+        "topology" : topology_out.getvalue(),
+        "config" : None,
+        "config_format" : None,
+    }
+    if not config_out == None:
+        config = config_out.buffer.getvalue()
+        response["config"] = base64.b64encode(config).decode()
+        response["config_format"] = "netcdf" if config.startswith(b"CDF") \
+                else "inpcrd"
+    return response
+
+def _read_text(io):
+    return bytes(read_buffer(io)).decode()
+
+def _error(error):
+    return { "error" : str(error), "type" : type(error).__name__ }
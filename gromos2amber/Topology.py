@@ -1,10 +1,62 @@
 from .GromosTopologyParser import GromosTopologyParser
 from math import sqrt
+from array import array
+from itertools import chain, repeat, accumulate, compress
+from operator import add, mul, sub
+from hashlib import sha256
+from threading import Lock
+from collections import OrderedDict
 
 KILOJOULE = 1.0/4.184 # kCal
 NANOMETRE = 10.0 # angstroms
 DEGREE = 3.141592653589793/180.0 #radians
 
+# Blocks holding the force field parameters. Every topology built with the
+# same force field has identical copies of these blocks.
+TYPE_TABLE_BLOCKS = [
+    "ATOMTYPENAME",
+    "LJPARAMETERS",
+    "BONDSTRETCHTYPE",
+    "BONDANGLEBENDTYPE",
+    "TORSDIHEDRALTYPE",
+    "IMPDIHEDRALTYPE",
+]
+
+# Number of force fields whose type tables are kept in each process
+MAX_TYPE_TABLES = 8
+
+class BoundedCache:
+    """ The max_entries most recently used values of a function of a key,
+    kept in least recently used order. Safe to share between threads. """
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key, create):
+        """ The value for key, from create() if it is not kept """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        value = create()
+        with self.lock:
+            self.entries[key] = value
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last = False)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __contains__(self, key): return key in self.entries
+
+    def __len__(self): return len(self.entries)
+
+# Type tables read recently in this process, keyed by type_table_key
+_type_tables = BoundedCache(MAX_TYPE_TABLES)
+
 class Topology:
 
     # _wH := with hydrogen
@@ -16,14 +68,20 @@ class Topology:
         self.title = gromos.TITLE()
 
         self.atoms, self.residues  = _read_atoms_and_residues(gromos)
-        self.atom_types = _read_atom_types(gromos)
 
-        self.lj_pair_types = _read_lj_pair_types(gromos)
+        # Identifies the input file, so that sections of the output which
+        # depend only on it can be reused, see AmberTopologyWriter
+        self.source_key = sha256(gromos.blocks.buffer).hexdigest()
 
-        self.bond_types = _read_bond_types(gromos)
-        self.angle_types = _read_angle_types(gromos)
-        self.dihedral_types = _read_dihedral_types(gromos)
-        self.improper_types = _read_improper_types(gromos)
+        # Identifies the force field parameters, so that they (and sections
+        # of the output derived from them) can be shared between topologies
+        self.type_table_key = _type_table_key(gromos)
+        ( self.atom_types,
+          self.lj_pair_types,
+          self.bond_types,
+          self.angle_types,
+          self.dihedral_types,
+          self.improper_types ) = _read_type_tables(gromos, self.type_table_key)
 
         self.dihedral_types.append(DihedralType(0.0,0.0,1.0)) #dummy for 1-4
 
@@ -38,15 +96,16 @@ class Topology:
         self.dihedrals_wH = ri(gromos.DIHEDRAL(H=True))
         self.impropers_wH = ri(gromos.IMPDIHEDRAL(H=True))
         # Marks dihedrals for which 1-4 interactions must be excluded
-        all_dihedrals = self.dihedrals_wH + self.dihedrals_woH
-        _fix_14_exclusions(self.atoms, all_dihedrals)
+        _fix_14_exclusions(self.atoms, [self.dihedrals_wH, self.dihedrals_woH])
         # Add dummy dihedrals to force 1-4 interactions where required
-        self.dihedrals_woH.extend(_extra_dihedrals(
+        extra_dihedrals = _extra_dihedrals(
             self.atoms,
             self.dihedrals_wH,
             self.dihedrals_woH,
-            len(self.dihedral_types)-1),
+            len(self.dihedral_types)-1,
         )
+        self.num_extra_dihedrals = len(extra_dihedrals)
+        self.dihedrals_woH.extend(extra_dihedrals)
         self.is_periodic = True
         one_on_4_pi_eps0 = gromos.PHYSICALCONSTANTS()[0] *KILOJOULE*NANOMETRE
         self.charge_prefactor = sqrt(one_on_4_pi_eps0) #gromos
@@ -58,36 +117,33 @@ class Topology:
         bondinfo = _read_solvent_bonds(gromos, len(self.bond_types))
         self.solvent_bonds, self.solvent_bond_types = bondinfo
 
-    def add_solvent(self, num_solvent_molecules, residue_name):
-
-        atoms_per_solvent = len(self.solvent_atoms)
-        num_solute_atoms = len(self.atoms)
-
-        self.atoms_per_molecule.extend([
-            len(self.solvent_atoms)
-            for i in range(num_solvent_molecules)
-        ])
-
         self.num_solute_residues = len(self.residues)
+        self.solvent = _create_solvent(
+            self.solvent_atoms, self.solvent_bonds, 0, len(self.atoms), "SOL"
+        )
 
-        self.residues.extend([
-            Residue(residue_name,
-                atoms_per_solvent*i + num_solute_atoms,
-                atoms_per_solvent)
-            for i in range(num_solvent_molecules)
-        ])
+    # atoms, residues, atoms_per_molecule and bonds_wH only ever hold the
+    # solute. The solvent is stored once as a template in self.solvent.
+    # A negative number of molecules (the default of convert) means none.
+    def add_solvent(self, num_solvent_molecules, residue_name):
 
+        num_solvent_molecules = max(num_solvent_molecules, 0)
         self.bond_types.extend(self.solvent_bond_types)
 
-        all_solvent_atoms, all_solvent_bonds = _create_solvent(
+        self.solvent = _create_solvent(
             self.solvent_atoms,
             self.solvent_bonds,
             num_solvent_molecules,
-            num_solute_atoms
+            len(self.atoms),
+            residue_name,
         )
 
-        self.atoms.extend(all_solvent_atoms)
-        self.bonds_wH.extend(all_solvent_bonds)
+    def num_atoms(self): return len(self.atoms) + self.solvent.num_atoms()
+
+    def all_atoms(self):
+        """ Solute atoms followed by the template atoms of every solvent
+        molecule. Exclusions of solvent atoms are relative to the molecule. """
+        return chain(self.atoms, self.solvent.iter_atoms())
 
 
     def get_title(self): return self.title.replace('\n','_')
@@ -102,10 +158,9 @@ def _read_solvent_bonds(gromos, num_bond_types):
         bondtype.r0 : index+num_bond_types
         for index,bondtype in enumerate(solvent_bond_types)
     }
-    solvent_bonds = [
-        Interaction([i-1,j-1], typecodes[r0])
-        for i,j,r0 in zip(ii,jj,lengths)
-    ]
+    solvent_bonds = Interactions(2)
+    for i,j,r0 in zip(ii,jj,lengths):
+        solvent_bonds.append(Interaction([i-1,j-1], typecodes[r0]))
     
     return solvent_bonds, solvent_bond_types
 
@@ -115,18 +170,14 @@ def _read_atoms_and_residues(gromos):
     data = gromos.SOLUTEATOM()
     atomindex, residue_number, name, typecode = data[0:4]
     mass, charge, _, exclusions, neigh14 = data[4: ]
-    numatoms = len(atomindex)
-    atoms = [
-        Atom(
-            name[i],
-            typecode[i]-1, 
-            mass[i],
-            charge[i],
-            [ e-1 for e in exclusions[i] ],
-            [ n14-1 for n14 in neigh14[i] ],
-        )
-        for i in range(numatoms)
-    ]
+    atoms = Atoms(
+        name,
+        [ t-1 for t in typecode ],
+        mass,
+        charge,
+        [ [ e-1 for e in excluded ] for excluded in exclusions ],
+        [ [ n14-1 for n14 in neighbours ] for neighbours in neigh14 ],
+    )
     residue_names = gromos.RESNAMES()
     residues = []
     previous = -1
@@ -139,6 +190,26 @@ def _read_atoms_and_residues(gromos):
     return atoms, residues
 
 
+def _type_table_key(gromos):
+    digest = sha256()
+    for blockname in TYPE_TABLE_BLOCKS:
+        digest.update(gromos.getdata(blockname))
+    return digest.hexdigest()
+
+def _read_type_tables(gromos, key):
+    # Each table is parsed once while its force field is among the
+    # MAX_TYPE_TABLES most recently used. The type objects are shared, but
+    # every topology gets its own lists, which add_solvent extends.
+    tables = _type_tables.get(key, lambda: (
+        _read_atom_types(gromos),
+        _read_lj_pair_types(gromos),
+        _read_bond_types(gromos),
+        _read_angle_types(gromos),
+        _read_dihedral_types(gromos),
+        _read_improper_types(gromos),
+    ))
+    return [ list(table) for table in tables ]
+
 def _read_atom_types(gromos):
     names = gromos.ATOMTYPENAME()
     # Amber limits type names to 2 characters.
@@ -178,13 +249,13 @@ def _read_improper_types(gromos):
 
 # processes bond, angle, dihedral, improper columns from gromos parser
 def _read_bonded_interaction(gromos_columns):
-    cols = gromos_columns
-    numcols = len(gromos_columns) - 1
-    numrows = len(gromos_columns[0])
-    return [
-        Interaction([ cols[c][r]-1 for c in range(numcols) ], cols[-1][r]-1 )
-        for r in range(numrows)
-    ]
+    *atom_columns, typecodes = gromos_columns
+    return Interactions.from_columns(
+        [ _minus_one(column) for column in atom_columns ],
+        _minus_one(typecodes),
+    )
+
+def _minus_one(column): return array('q', map(sub, column, repeat(1)))
 
 def _read_lj_pair_types(gromos):
     typei, typej, c12, c6, c12_14, c6_14 = gromos.LJPARAMETERS()
@@ -209,41 +280,24 @@ def _read_lj_pair_types(gromos):
 def _read_solvent(gromos):
     _,name,typecode,mass,charge = gromos.SOLVENTATOM()
     n = len(name)
-    atoms = [ Atom(name[i].strip(),
-                   typecode[i]-1, 
-                   mass[i],
-                   charge[i],
-                   [], [])
-              for i in range(n) ]
-    return atoms
+    return Atoms([ atom_name.strip() for atom_name in name ],
+                 _minus_one(typecode),
+                 mass,
+                 charge,
+                 [ [] ]*n, [ [] ]*n)
 
 def _create_solvent(solvent_atoms, solvent_bonds,
-                    num_molecules, first_solvent_index):
-    name = [ atom.name for atom in solvent_atoms ]
-    m = [ atom.mass for atom in solvent_atoms ]
-    q = [ atom.charge for atom in solvent_atoms ]
-    tc = [ atom.typecode for atom in solvent_atoms ]
+                    num_molecules, first_solvent_index, residue_name):
     n = len(solvent_atoms)
-    i0 = first_solvent_index
-    atoms = [
-        Atom(name[i%n],
-            tc[i%n], 
-            m[i%n],
-            q[i%n],
-            [ j+i0 for j in range(int(i/n)*n,int(i/n+1)*n) if not j==i ],
-            [],
-        )
-        for i in range(num_molecules * n)
-    ]
-
-    bonds = []
-    for mol in range(num_molecules):
-        for bond in solvent_bonds:
-            bi = i0+mol*n+bond.atoms[0]
-            bj = i0+mol*n+bond.atoms[1]
-            bonds.append(Interaction([bi,bj],bond.typecode))
-
-    return atoms, bonds
+    # every atom excludes all other atoms of the same molecule
+    atoms = Atoms(solvent_atoms.names,
+                  solvent_atoms.typecodes,
+                  solvent_atoms.masses,
+                  solvent_atoms.charges,
+                  [ [ j for j in range(n) if not j==i ] for i in range(n) ],
+                  [ [] ]*n)
+    return Solvent(atoms, solvent_bonds, num_molecules,
+                   first_solvent_index, residue_name)
 
 def _read_atoms_per_solute_molecule(gromos):
     mol_last_index = gromos.SOLUTEMOLECULES()
@@ -254,28 +308,119 @@ def _read_atoms_per_solute_molecule(gromos):
     ]
 
 def _extra_dihedrals(atoms, dihedrals_wH, dihedrals_woH, dummy_typecode):
-    extra = []
-    all_dihedrals = list(dihedrals_wH)
-    all_dihedrals.extend(dihedrals_woH)
-    found = [ { n14:False for n14 in atom.neigh14 } for atom in atoms ]
-    for dihedral in all_dihedrals:
-        i, l = dihedral.atoms[0], dihedral.atoms[3]
-        i, l = (i,l) if i<l else (l,i)
-        found[i][l] = True
-    for i,atom in enumerate(atoms):
-        for l in atom.neigh14:
-           if not found[i][l]:
-               extra.append(Interaction([i,i,l,l],dummy_typecode))
-    return extra
-
-def _fix_14_exclusions(atoms, dihedrals):
-    prev_l = [ [] for atom in atoms ]
-    for d,dihedral in enumerate(dihedrals):
-        i, l = dihedral.atoms[0], dihedral.atoms[3]
-        i, l = (i,l) if i<l else (l,i)
-        if l in atoms[i].exclusions_wo14 or l in prev_l[i]:
-            dihedral.exclude_14()
-        prev_l[i].append(l)
+    n = len(atoms)
+    found = set(_dihedral_pair_keys(dihedrals_wH, n))
+    found.update(_dihedral_pair_keys(dihedrals_woH, n))
+    first, last = _row_indices(atoms.neigh14), atoms.neigh14.indices
+    missing = [ not key in found for key in _pair_keys(first, last, n) ]
+    first = array('q', compress(first, missing))
+    last = array('q', compress(last, missing))
+    return Interactions.from_columns([ first, first, last, last ],
+                                     [ dummy_typecode ]*len(first))
+
+# Flags the exclude-14 entries of each table of dihedrals, in the order of
+# the tables: the first and last atoms of the dihedral are already excluded,
+# or are those of an earlier dihedral
+def _fix_14_exclusions(atoms, dihedral_tables):
+    n = len(atoms)
+    excluded = atoms.exclusions_wo14
+    seen = set(_pair_keys(_row_indices(excluded), excluded.indices, n))
+    for dihedrals in dihedral_tables:
+        flags = dihedrals.exclude14
+        for d,key in enumerate(_dihedral_pair_keys(dihedrals, n)):
+            if key in seen:
+                flags[d] = 1
+            else:
+                seen.add(key)
+
+# Pairs of atoms i, l as single integers i*n+l, where n is the number of
+# atoms, so that sets of pairs hash ints rather than tuples
+def _pair_keys(first, last, n):
+    return map(add, map(mul, first, repeat(n)), last)
+
+# The lower then the higher of the first and last atoms of each dihedral
+def _dihedral_pair_keys(dihedrals, n):
+    first, last = dihedrals.atoms[0::4], dihedrals.atoms[3::4]
+    return _pair_keys(map(min, first, last), map(max, first, last), n)
+
+# The row of every index of a Rows
+def _row_indices(rows):
+    return array('q', chain.from_iterable(
+        map(repeat, range(len(rows)), rows.lengths())))
+
+class Rows:
+    """ Rows of integers of varying length, stored as one flat array of
+    indices. Row r is indices[offsets[r]:offsets[r+1]]. """
+    def __init__(self, rows = ()):
+        rows = rows if isinstance(rows, list) else list(rows)
+        self.indices = array('q', chain.from_iterable(rows))
+        self.offsets = array('q', accumulate(map(len, rows), initial = 0))
+
+    def __len__(self): return len(self.offsets) - 1
+
+    def __getitem__(self, r):
+        return self.indices[self.offsets[r]:self.offsets[r+1]].tolist()
+
+    def __iter__(self): return map(self.__getitem__, range(len(self)))
+
+    def lengths(self):
+        return array('q', map(sub, self.offsets[1:], self.offsets[:-1]))
+
+    def padded(self, fill):
+        """ These rows, with the single value fill in place of each empty
+        row """
+        lengths = self.lengths()
+        if lengths.count(0) == 0:
+            return self
+        padded = Rows()
+        padded.offsets = array('q',
+            accumulate(map(max, lengths, repeat(1)), initial = 0))
+        start = 0
+        for r in sorted(_indices_of(lengths, 0)):
+            padded.indices.extend(self.indices[start:self.offsets[r]])
+            padded.indices.append(fill)
+            start = self.offsets[r]
+        padded.indices.extend(self.indices[start:])
+        return padded
+
+class Atoms:
+    """ Parallel arrays of the fields of a list of atoms, and their
+    exclusions as Rows. atoms[i] is a view of atom i with the attributes of
+    an Atom. """
+    def __init__(self, names, typecodes, masses, charges, exclusions, neigh14):
+        self.names = list(names)
+        self.typecodes = array('q', typecodes)
+        self.masses = array('d', masses)
+        self.charges = array('d', charges)
+        self.exclusions_wo14 = Rows(exclusions)
+        self.neigh14 = Rows(neigh14)
+        self.exclusions = Rows(
+            sorted(set(chain(excluded, neighbours)))
+            for excluded, neighbours in zip(self.exclusions_wo14, self.neigh14)
+        )
+
+    def __len__(self): return len(self.names)
+
+    def __getitem__(self, i):
+        if not -len(self) <= i < len(self): raise IndexError(i)
+        return AtomView(self, i % len(self))
+
+    def __iter__(self): return map(AtomView, repeat(self), range(len(self)))
+
+class AtomView:
+    """ Atom i of an Atoms """
+    __slots__ = ("table", "index")
+
+    def __init__(self, table, index): self.table, self.index = table, index
+
+    name = property(lambda self: self.table.names[self.index])
+    typecode = property(lambda self: self.table.typecodes[self.index])
+    mass = property(lambda self: self.table.masses[self.index])
+    charge = property(lambda self: self.table.charges[self.index])
+    exclusions_wo14 = property(
+            lambda self: self.table.exclusions_wo14[self.index])
+    neigh14 = property(lambda self: self.table.neigh14[self.index])
+    exclusions = property(lambda self: self.table.exclusions[self.index])
 
 class Atom:
     def __init__(self, name, typecode, mass, charge, exclusions, neigh14):
@@ -289,6 +434,90 @@ class Atom:
         all_exclusions.extend(neigh14)
         self.exclusions = sorted(set(all_exclusions))
 
+class Interactions:
+    """ Bonds, angles, proper or improper dihedrals of one kind. The atoms
+    of interaction n are atoms[width*n:width*(n+1)], its typecode is
+    typecodes[n], and exclude14[n] is 1 if a dihedral must not add a 1-4
+    interaction. interactions[n] is a view of interaction n with the
+    attributes of an Interaction. """
+    def __init__(self, width, atoms = (), typecodes = (), exclude14 = None):
+        self.width = width
+        self.atoms = array('q', atoms)
+        self.typecodes = array('q', typecodes)
+        self.exclude14 = bytearray(len(self.typecodes)) if exclude14 == None \
+                else bytearray(exclude14)
+
+    @classmethod
+    def from_columns(cls, columns, typecodes):
+        """ From one array of atom indices for each atom of the interaction.
+        As in Interaction, dihedrals with atom 0 in third or fourth place
+        are reversed. """
+        width = len(columns)
+        atoms = array('q', bytes(8*width*len(typecodes)))
+        for c,column in enumerate(columns):
+            atoms[c::width] = array('q', column)
+        if width == 4:
+            for n in sorted(_indices_of(atoms[2::4], 0)
+                            | _indices_of(atoms[3::4], 0)):
+                row = atoms[4*n:4*n+4]
+                row.reverse()
+                atoms[4*n:4*n+4] = row
+        return cls(width, atoms, typecodes)
+
+    def __len__(self): return len(self.typecodes)
+
+    def __getitem__(self, n):
+        if not -len(self) <= n < len(self): raise IndexError(n)
+        return InteractionView(self, n % len(self))
+
+    def __iter__(self):
+        return map(InteractionView, repeat(self), range(len(self)))
+
+    def __add__(self, other):
+        return Interactions(self.width,
+                            self.atoms + other.atoms,
+                            self.typecodes + other.typecodes,
+                            self.exclude14 + other.exclude14)
+
+    def extend(self, other):
+        self.atoms.extend(other.atoms)
+        self.typecodes.extend(other.typecodes)
+        self.exclude14.extend(other.exclude14)
+
+    def append(self, interaction):
+        """ Appends an Interaction, or a view of one """
+        self.atoms.extend(interaction.atoms)
+        self.typecodes.append(interaction.typecode)
+        self.exclude14.append(1 if interaction.is_excluding_14() else 0)
+
+def _indices_of(values, value):
+    indices, start = set(), 0
+    try:
+        while True:
+            start = values.index(value, start) + 1
+            indices.add(start - 1)
+    except ValueError:
+        return indices
+
+class InteractionView:
+    """ Interaction n of an Interactions """
+    __slots__ = ("table", "index")
+
+    def __init__(self, table, index): self.table, self.index = table, index
+
+    @property
+    def atoms(self):
+        w = self.table.width
+        return self.table.atoms[w*self.index:w*(self.index+1)].tolist()
+
+    typecode = property(lambda self: self.table.typecodes[self.index])
+
+    def exclude_14(self, exclude = True):
+        if self.table.width != 4: raise Exception("not a dihedral")
+        self.table.exclude14[self.index] = 1 if exclude else 0
+
+    def is_excluding_14(self): return self.table.exclude14[self.index] == 1
+
 class Interaction:
     """ Bond, angle, proper dihedral, or improper dihedral """
     def __init__(self, atoms, typecode):
@@ -330,3 +559,25 @@ class ImproperType:
 class Residue:
     def __init__(self, name, first, numatoms):
         self.name, self.first, self.numatoms = name, first, numatoms
+
+class Solvent:
+    """ num_molecules copies of a template molecule, each of which is one
+    residue. Atom indices of the template atoms, their exclusions and the
+    template bonds are relative to the first atom of each molecule. """
+    def __init__(self, atoms, bonds, num_molecules, first_atom, residue_name):
+        self.atoms, self.bonds = atoms, bonds
+        self.num_molecules = num_molecules
+        self.first_atom = first_atom
+        self.residue_name = residue_name
+
+    def num_atoms(self): return len(self.atoms)*self.num_molecules
+
+    def num_bonds(self): return len(self.bonds)*self.num_molecules
+
+    def iter_atoms(self):
+        return chain.from_iterable(repeat(self.atoms, self.num_molecules))
+
+    def molecule_offsets(self):
+        """ Index of the first atom of each molecule """
+        n = len(self.atoms)
+        return range(self.first_atom, self.first_atom+self.num_atoms(), max(n,1))
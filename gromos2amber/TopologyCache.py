@@ -0,0 +1,143 @@
+""" On-disk cache of Topology objects, keyed by the contents of the input.
+
+Topologies are stored as pickles, before any solvent has been added, under
+
+  DIRECTORY/gromos2amber-topologies/VERSION/SHA256_OF_TOPOLOGY_FILE.pickle
+
+Entries written by another version of the package are never loaded, and
+are deleted the next time the cache is pruned. Nothing outside
+DIRECTORY/gromos2amber-topologies is ever touched, so DIRECTORY may be
+shared with other files. The cache is kept below a
+maximum size by deleting the least recently used entries.
+
+MemoryTopologyCache keeps the same pickles in memory instead, for long
+running processes such as the conversion server.
+"""
+
+import os
+import shutil
+import pickle
+import hashlib
+import tempfile
+from collections import OrderedDict
+
+from .Topology import Topology
+from .gromos_format import read_buffer
+
+DEFAULT_MAX_BYTES = 1024**3
+# Increase when the layout of Topology changes without a new release
+CACHE_FORMAT = 5
+SUFFIX = ".pickle"
+# Holds the entries of every version, within the cache directory
+SUBDIRECTORY = "gromos2amber-topologies"
+
+def _package_version():
+    path = os.path.join(os.path.dirname(__file__), os.pardir, "VERSION")
+    try:
+        with open(path) as version_file:
+            return version_file.read().strip()
+    except OSError:
+        return "unknown"
+
+PACKAGE_VERSION = _package_version()
+VERSION = "{}-{}".format(PACKAGE_VERSION, CACHE_FORMAT)
+
+class TopologyCache:
+    def __init__(self, directory, max_bytes = DEFAULT_MAX_BYTES,
+                 version = VERSION):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.version = version
+        self.versions = os.path.join(directory, SUBDIRECTORY)
+        self.entries = os.path.join(self.versions, version)
+        os.makedirs(self.entries, exist_ok = True)
+
+    def load(self, io):
+        """ The Topology for the file io (a path or file object), read from
+        the cache if it has been converted before """
+        buffer = read_buffer(io)
+        path = self.path(hashlib.sha256(buffer).hexdigest())
+        try:
+            with open(path, "rb") as entry:
+                topology = pickle.load(entry)
+            os.utime(path) # mark as recently used
+            return topology
+        except (OSError, pickle.UnpicklingError, EOFError):
+            pass
+        topology = Topology(buffer)
+        self.store(path, topology)
+        return topology
+
+    def path(self, key): return os.path.join(self.entries, key + SUFFIX)
+
+    def store(self, path, topology):
+        descriptor, temporary = tempfile.mkstemp(dir = self.entries)
+        try:
+            with os.fdopen(descriptor, "wb") as entry:
+                pickle.dump(topology, entry, protocol = pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, path)
+        except OSError:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            return
+        self.prune()
+
+    def prune(self):
+        """ Deletes entries of other versions, then the least recently used
+        entries until the cache is no larger than max_bytes """
+        for name in os.listdir(self.versions):
+            path = os.path.join(self.versions, name)
+            if not name == self.version and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors = True)
+        entries = []
+        for name in os.listdir(self.entries):
+            if name.endswith(SUFFIX):
+                try:
+                    status = os.stat(os.path.join(self.entries, name))
+                except OSError:
+                    continue
+                entries.append((status.st_mtime, status.st_size, name))
+        total = sum( size for _, size, _ in entries )
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.entries, name))
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        shutil.rmtree(self.entries, ignore_errors = True)
+        os.makedirs(self.entries, exist_ok = True)
+
+class MemoryTopologyCache:
+    """ As TopologyCache, but held in memory. Topologies are kept pickled,
+    so that every load returns a Topology of its own for add_solvent to
+    modify. """
+    def __init__(self, max_bytes = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits, self.misses = 0, 0
+
+    def load(self, io):
+        buffer = read_buffer(io)
+        key = hashlib.sha256(buffer).hexdigest()
+        if key in self.entries:
+            self.entries.move_to_end(key) # mark as recently used
+            self.hits += 1
+            return pickle.loads(self.entries[key])
+        self.misses += 1
+        topology = Topology(buffer)
+        entry = pickle.dumps(topology, protocol = pickle.HIGHEST_PROTOCOL)
+        self.entries[key] = entry
+        self.size += len(entry)
+        while self.size > self.max_bytes and len(self.entries) > 0:
+            _, dropped = self.entries.popitem(last = False)
+            self.size -= len(dropped)
+        return topology
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
@@ -0,0 +1,46 @@
+""" GROMOS trajectories (.trc), read one frame at a time.
+
+A trajectory is a TITLE block followed by a frame for every saved step,
+each frame being a TIMESTEP, a POSITIONRED and usually a GENBOX block. A
+frame ends where one of its blocks is repeated, so trajectories without
+TIMESTEP or GENBOX blocks are read too.
+"""
+
+from itertools import chain
+
+from . import gromos_format as gf
+from .Configuration import Configuration
+
+FRAME_BLOCKS = [
+    "TIMESTEP",
+    "POSITION",
+    "POSITIONRED",
+    "LATTICESHIFTS",
+    "VELOCITY",
+    "VELOCITYRED",
+    "GENBOX",
+    "BOX",
+]
+
+def iter_frames(io):
+    """ Yields a Configuration for each frame of the trajectory io, a path or
+    file object which may be gzip-compressed. The time and step of each
+    frame are those of its TIMESTEP block, if there is one.
+
+    Only one frame is held in memory at a time.
+    """
+    title = b"TITLE\nEND\n"
+    frame = {}
+    for name, data in gf.iter_blocks(io):
+        if name == "TITLE":
+            title = data
+        elif name in FRAME_BLOCKS:
+            if name in frame:
+                yield _configuration(title, frame)
+                frame = {}
+            frame[name] = data
+    if len(frame) > 0:
+        yield _configuration(title, frame)
+
+def _configuration(title, frame):
+    return Configuration(b''.join(chain([title], frame.values())))
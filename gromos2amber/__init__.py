@@ -1,4 +1,5 @@
  
-from .Converter import convert
-from .Errors import GromosFormatError, IllegalArgumentError
+from .Converter import convert, convert_trajectory
+from .Errors import GromosFormatError, AmberFormatError, \
+        IllegalArgumentError
 
@@ -0,0 +1,275 @@
+""" Compressed input and output files: gzip, xz and bzip2.
+
+Compressed inputs are recognised by their magic bytes, so that they are
+read the same way from a path, a file object or a pipe. Compressed outputs
+are chosen by the extension of their path.
+
+Outputs are compressed in independent blocks on a pool of threads, each
+block being written as a complete gzip member, xz stream or bzip2 stream.
+The concatenation is itself a valid file of that format, which gzip, xz,
+bzip2 and Python's own modules decompress as one. The compressors release
+the global interpreter lock, so the blocks are compressed in parallel.
+"""
+
+import io
+import os
+import bz2
+import gzip
+import lzma
+import zlib
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .Errors import GromosFormatError
+
+MAGIC = {
+    "gzip" : b'\x1f\x8b',
+    "xz" : b'\xfd7zXZ\x00',
+    "bz2" : b'BZh',
+}
+EXTENSIONS = {
+    ".gz" : "gzip",
+    ".xz" : "xz",
+    ".bz2" : "bz2",
+}
+# Bytes of uncompressed data in each independently compressed block
+BLOCK_SIZES = {
+    "gzip" : 1 << 20,
+    "xz" : 1 << 22,
+    "bz2" : 900*1000, # one bzip2 block at level 9
+}
+DEFAULT_LEVELS = {
+    "gzip" : 6,
+    "xz" : 6,
+    "bz2" : 9,
+}
+# Bytes of compressed data decompressed at a time, and the number of
+# decompressed chunks a reading thread may run ahead of its reader
+READ_SIZE = 1 << 18
+READ_AHEAD = 8
+
+def compression_of_data(data):
+    """ The compression of data ("gzip", "xz" or "bz2") from its first
+    bytes, or None if it is not compressed """
+    if isinstance(data, str):
+        return None
+    for compression, magic in MAGIC.items():
+        if bytes(data[:len(magic)]) == magic:
+            return compression
+    return None
+
+def compression_of_path(path):
+    """ The compression of a file from the extension of its path, or None """
+    return EXTENSIONS.get(os.path.splitext(str(path))[1].lower())
+
+def strip_compression_extension(path):
+    """ path without its compression extension, if it has one """
+    path = str(path)
+    return os.path.splitext(path)[0] if compression_of_path(path) else path
+
+def decompress(data):
+    """ The decompressed contents of a buffer holding a compressed file,
+    which may have several members or streams """
+    compression = compression_of_data(data)
+    try:
+        return b''.join(_iter_decompressed(compression,
+                                           _slices(data, READ_SIZE)))
+    except (OSError, EOFError, zlib.error, lzma.LZMAError) as error:
+        raise GromosFormatError(
+            "Could not decompress {} input: {}".format(compression, error))
+
+def open_decompressed(stream, compression = None):
+    """ A binary file object reading the decompressed contents of a binary
+    stream. Decompression runs on a thread of its own, ahead of the reader.
+    compression is found from the first bytes of the stream if not given.
+    """
+    if compression == None:
+        compression = compression_of_data(peek(stream, 6))
+    chunks = iter(lambda: stream.read(READ_SIZE), b'')
+    return io.BufferedReader(
+        _ThreadedReader(_iter_decompressed(compression, chunks)),
+        buffer_size = READ_SIZE)
+
+def open_output(path, mode = "w", compression = None, threads = None,
+                level = None):
+    """ Opens path for writing, compressed if its extension (or compression,
+    if given) says so. mode is "w" for text or "wb" for binary. threads is
+    the number of threads compressing at once (None for one per CPU). """
+    if compression == None:
+        compression = compression_of_path(path)
+    if compression == None:
+        return open(path, mode)
+    output = CompressedWriter(open(path, "wb"), compression, threads, level)
+    output.name = str(path)
+    if "b" in mode:
+        return output
+    text = io.TextIOWrapper(output)
+    text.mode = mode
+    return text
+
+class CompressedWriter(io.BufferedIOBase):
+    """ A binary file object compressing what is written to it in blocks,
+    on a pool of threads, and writing them in order to the binary file
+    object raw, which it closes when it is closed. """
+    def __init__(self, raw, compression, threads = None, level = None):
+        if not compression in MAGIC:
+            raise ValueError("Unknown compression " + str(compression))
+        self.raw = raw
+        self.compression = compression
+        self.level = DEFAULT_LEVELS[compression] if level == None else level
+        self.block_size = BLOCK_SIZES[compression]
+        self.threads = (os.cpu_count() or 1) if threads == None else threads
+        self.executor = ThreadPoolExecutor(max_workers = self.threads)
+        self.block = bytearray()
+        self.pending = deque()
+        self.num_blocks = 0
+
+    def writable(self): return True
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write to closed file")
+        data = memoryview(data).cast('B')
+        self.block += data
+        while len(self.block) >= self.block_size:
+            self._submit(bytes(self.block[:self.block_size]))
+            del self.block[:self.block_size]
+        return len(data)
+
+    def flush(self):
+        # blocks are only complete when they are full, so only those
+        # already compressed can be written
+        if not self.closed:
+            while len(self.pending) > 0 and self.pending[0].done():
+                self.raw.write(self.pending.popleft().result())
+            self.raw.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if len(self.block) > 0 or self.num_blocks == 0:
+                self._submit(bytes(self.block))
+                self.block = bytearray()
+            while len(self.pending) > 0:
+                self.raw.write(self.pending.popleft().result())
+        finally:
+            self.executor.shutdown()
+            try:
+                super().close()
+            finally:
+                self.raw.close()
+
+    def _submit(self, block):
+        # no more than two blocks per thread are held at once
+        while len(self.pending) >= 2*self.threads:
+            self.raw.write(self.pending.popleft().result())
+        self.pending.append(self.executor.submit(
+            _COMPRESSORS[self.compression], block, self.level))
+        self.num_blocks += 1
+
+_COMPRESSORS = {
+    "gzip" : lambda data, level: gzip.compress(data, level, mtime = 0),
+    "xz" : lambda data, level: lzma.compress(data, preset = level),
+    "bz2" : lambda data, level: bz2.compress(data, level),
+}
+
+_DECOMPRESSORS = {
+    "gzip" : lambda: zlib.decompressobj(wbits = 16 + zlib.MAX_WBITS),
+    "xz" : lzma.LZMADecompressor,
+    "bz2" : bz2.BZ2Decompressor,
+}
+
+def _iter_decompressed(compression, chunks):
+    # decompressed data of chunks of a compressed file, member by member
+    decompressor = None
+    for chunk in chunks:
+        while len(chunk) > 0:
+            if decompressor == None:
+                if compression == "xz":
+                    # xz streams may be followed by null padding
+                    chunk = bytes(chunk).lstrip(b'\x00')
+                    if len(chunk) == 0:
+                        break
+                decompressor = _DECOMPRESSORS[compression]()
+            data = decompressor.decompress(chunk)
+            if len(data) > 0:
+                yield data
+            if decompressor.eof:
+                chunk = decompressor.unused_data
+                decompressor = None
+            else:
+                chunk = b''
+    if not decompressor == None:
+        raise EOFError("the compressed data ends before its end marker")
+
+def _slices(data, size):
+    # a buffer in slices of size bytes, so that a decompressor never holds
+    # more than that of it as unused data
+    view = memoryview(data)
+    return ( view[start:start+size] for start in range(0, len(view), size) )
+
+class _ThreadedReader(io.RawIOBase):
+    # Reads the chunks of an iterable, which is run on a thread of its own
+    def __init__(self, chunks):
+        self.chunks = queue.Queue(maxsize = READ_AHEAD)
+        self.chunk = memoryview(b'')
+        self.finished = False
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target = self._run, args = (chunks,),
+                                       daemon = True)
+        self.thread.start()
+
+    def _run(self, chunks):
+        try:
+            for chunk in chunks:
+                if self.stop.is_set():
+                    return
+                self.chunks.put(chunk)
+            self.chunks.put(None)
+        except BaseException as error:
+            self.chunks.put(error)
+
+    def readable(self): return True
+
+    def readinto(self, buffer):
+        while len(self.chunk) == 0:
+            if self.finished:
+                return 0
+            chunk = self.chunks.get()
+            if chunk == None:
+                self.finished = True
+            elif isinstance(chunk, BaseException):
+                self.finished = True
+                raise GromosFormatError(
+                    "Could not decompress input: " + str(chunk))
+            else:
+                self.chunk = memoryview(chunk)
+        size = min(len(buffer), len(self.chunk))
+        buffer[:size] = self.chunk[:size]
+        self.chunk = self.chunk[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.stop.set()
+            # let a reading thread waiting on a full queue finish
+            while self.thread.is_alive():
+                try:
+                    self.chunks.get(timeout = 0.1)
+                except queue.Empty:
+                    pass
+        super().close()
+
+def peek(stream, size):
+    """ The first size bytes of a binary stream, without consuming them, or
+    b'' if they cannot be put back """
+    if hasattr(stream, 'peek'):
+        return stream.peek(size)[:size]
+    if stream.seekable():
+        position = stream.tell()
+        data = stream.read(size)
+        stream.seek(position)
+        return data
+    return b''
@@ -1,4 +1,8 @@
 
+import re
+from array import array
+from itertools import islice, cycle
+
 # There are only a handful of fortran format codes used by this program,
 # so these have been manually converted to python format codes
 
@@ -10,25 +14,159 @@ FORMAT_CODES = {
         '2i8'     : ['{:>8d}']*2,
         '3i8'     : ['{:>8d}']*3,
         '6f12.7'  : ['{:>12.7f}']*6,
+        '10f8.3'  : ['{:>8.3f}']*10,
         '3e24.16' : ['{:>24.16E}']*3,
         '3e25.17' : ['{:>25.17E}']*3,
         '5e16.8'  : ['{:>16.8E}']*5,
         'i5,5e15.7'  : ['{:>5d}']+['{:>15.7E}']*5
         }
 
+# Number of lines formatted at a time by iter_fortran_format
+CHUNK_LINES = 4096
+
+def _percent_code(code):
+    # '{:>8d}' -> '%8d', '{:<4.4s}' -> '%-4.4s'
+    align, spec = re.fullmatch(r'\{:([<>])(\d+(?:\.\d+)?[dsfE])\}', code).groups()
+    return '%' + ('-' if align == '<' else '') + spec
+
+# printf-style equivalents of FORMAT_CODES. These produce identical output,
+# but a whole block of lines can be formatted with a single '%' operation,
+# which is considerably faster than str.format with one field per value.
+PERCENT_CODES = {
+        fortran_code : [ _percent_code(code) for code in format_line ]
+        for fortran_code, format_line in FORMAT_CODES.items()
+        }
+
+# Width of each field of a line of PERCENT_CODES
+FIELD_WIDTHS = {
+        fortran_code : [ int(re.match(r'%-?(\d+)', code).group(1))
+                         for code in format_line ]
+        for fortran_code, format_line in PERCENT_CODES.items()
+        }
+
+def formatted_size(fortran_format_code, num_values):
+    """ The number of characters of num_values formatted values, as long as
+    none is wider than its field """
+    widths = FIELD_WIDTHS[fortran_format_code]
+    full_lines, remaining = divmod(num_values, len(widths))
+    size = full_lines*(sum(widths)+1)
+    if remaining > 0 or num_values == 0:
+        size += sum(widths[:remaining]) + 1
+    return size
+
 def fortran_format(fortran_format_code, values):
-    format_line = FORMAT_CODES[fortran_format_code]
+    return ''.join(iter_fortran_format(fortran_format_code, values))
+
+def iter_fortran_format(fortran_format_code, values, chunk_lines = CHUNK_LINES):
+    """ Yields the formatted values in chunks of at most chunk_lines lines.
+
+    values may be any iterable, including a generator, so that a section
+    never has to be held in memory in its entirety. Sequences such as lists,
+    array.array and NumPy arrays are sliced a block of rows at a time.
+    """
+    format_line = PERCENT_CODES[fortran_format_code]
     num_per_line = len(format_line)
-    format_codes = [] if len(values)>0 else ['\n']
-    newlines = 0
-    while True:
-        remaining = len(values) - (len(format_codes) - newlines)
-        if remaining <= 0: break
-        format_codes.extend( format_line[:min(remaining, num_per_line)] )
-        format_codes.append('\n')
-        newlines += 1
-        
-    return ''.join(format_codes).format(*values)
-        
+    full_line = ''.join(format_line) + '\n'
+    empty = True
+    for chunk in _iter_chunks(values, chunk_lines*num_per_line):
+        empty = False
+        full_lines, remaining = divmod(len(chunk), num_per_line)
+        format_codes = full_line*full_lines
+        if remaining > 0:
+            format_codes += ''.join(format_line[:remaining]) + '\n'
+        yield format_codes % chunk
+    if empty:
+        yield '\n'
+
+def _iter_chunks(values, chunk_size):
+    # Yields tuples of at most chunk_size values
+    if hasattr(values, 'ravel'):
+        # NumPy arrays of any shape are formatted in row-major order
+        values = values.ravel()
+    if hasattr(values, '__getitem__') and hasattr(values, '__len__'):
+        for start in range(0, len(values), chunk_size):
+            chunk = values[start:start+chunk_size]
+            # array.array and NumPy arrays convert to python numbers in bulk
+            yield tuple(chunk.tolist() if hasattr(chunk, 'tolist') else chunk)
+    else:
+        values = iter(values)
+        while True:
+            chunk = tuple(islice(values, chunk_size))
+            if len(chunk) == 0:
+                break
+            yield chunk
+
+# Python types of the Fortran edit descriptors read by parse_fortran_format
+FIELD_TYPES = { 'a' : str, 'i' : int, 'e' : float, 'f' : float }
+
+_FIELD = re.compile(r'(\d*)([aief])(\d+)(?:\.\d+)?')
+
+def fortran_fields(fortran_format_code):
+    """ The (type, width) of each field of a line of any Fortran format of
+    repeated a, i, e and f descriptors, such as '10I8' or 'i2,a78' """
+    fields = []
+    for item in fortran_format_code.lower().replace(' ', '').split(','):
+        match = _FIELD.fullmatch(item)
+        if match == None:
+            raise ValueError("Unsupported Fortran format " + fortran_format_code)
+        repeat, letter, width = match.groups()
+        fields += [ (FIELD_TYPES[letter], int(width)) ]*int(repeat or 1)
+    return fields
+
+def parse_fortran_format(fortran_format_code, data):
+    """ The values of data (bytes or str) formatted with fortran_format_code,
+    as an array.array of int ('q') or float ('d') if every field is an
+    integer or a real, and otherwise as a list. Text fields are stripped.
+
+    The last field of a line may be cut short, as some writers strip
+    trailing spaces. Raises ValueError if a field cannot be converted.
+    """
+    fields = fortran_fields(fortran_format_code)
+    types = set( typ for typ, width in fields )
+    widths = set( width for typ, width in fields )
+    data = data.encode() if isinstance(data, str) else bytes(data)
+    lines = data.split(b'\n')
+    if len(lines[-1]) == 0:
+        lines.pop()
+    if len(types) == 1 and len(widths) == 1:
+        return _parse_uniform(fields[0][0], fields[0][1], lines)
+    values = []
+    for line in lines:
+        start = 0
+        for typ, width in fields:
+            if start >= len(line):
+                break
+            values.append(_convert(typ, line[start:start+width]))
+            start += width
+    return values
+
+def typed_values(fortran_format_code, values):
+    """ values converted to what parse_fortran_format would read back once
+    they were formatted with fortran_format_code """
+    fields = fortran_fields(fortran_format_code)
+    if len(set( typ for typ, width in fields )) == 1:
+        typ, width = fields[0]
+        if typ is int:
+            return array('q', map(int, values))
+        if typ is float:
+            return array('d', map(float, values))
+    return [ typ(value) if not typ is str else str(value)[:width].strip()
+             for (typ, width), value in zip(cycle(fields), values) ]
+
+def _parse_uniform(typ, width, lines):
+    if not typ is str:
+        # numbers wider than their fields are rare, so split on spaces, and
+        # only slice the fields if that does not give one number per field
+        tokens = b' '.join(lines).split()
+        num_fields = sum( (len(line)+width-1)//width for line in lines )
+        if not len(tokens) == num_fields:
+            tokens = _slice_fields(lines, width)
+        return array('q' if typ is int else 'd', map(typ, tokens))
+    return [ field.decode().strip() for field in _slice_fields(lines, width) ]
 
+def _slice_fields(lines, width):
+    return [ line[start:start+width]
+             for line in lines for start in range(0, len(line), width) ]
 
+def _convert(typ, field):
+    return field.decode().strip() if typ is str else typ(field)
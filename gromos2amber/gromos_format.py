@@ -1,18 +1,196 @@
+import os
+import re
+import mmap
+import struct
+from io import BufferedReader
+from array import array
+from itertools import chain
+from collections.abc import Mapping
 from .Errors import GromosFormatError
+from .compressed_format import compression_of_data, decompress, \
+        open_decompressed, peek
+
+# Number of bytes read at a time by iter_blocks
+READ_SIZE = 1 << 20
+
+_COMMENT_LINES = re.compile(rb'\n#[^\n]*')
+
+def read_buffer(io):
+    """ Returns the contents of io as a bytes-like object.
+
+    io may be a path, a binary or text file object, or already a buffer.
+    Regular files are memory-mapped rather than read, anything else (eg a
+    pipe) is read. Contents compressed with gzip, xz or bzip2 (see
+    compressed_format) are decompressed.
+    """
+    if isinstance(io, (bytes, bytearray, memoryview, mmap.mmap)):
+        return _decompressed(io)
+    if isinstance(io, (str, os.PathLike)):
+        with open(io, 'rb') as f:
+            return read_buffer(f)
+    try:
+        return _decompressed(
+            mmap.mmap(io.fileno(), 0, access = mmap.ACCESS_READ))
+    except (AttributeError, OSError, ValueError):
+        pass
+    data = getattr(io, 'buffer', io).read()
+    return _decompressed(data.encode() if isinstance(data, str) else data)
+
+def _decompressed(buffer):
+    if compression_of_data(buffer[:6]) == None:
+        return buffer
+    return decompress(buffer)
+
+class BlockIndex(Mapping):
+    """ The blocks of a GROMOS file, located in a single pass over a buffer.
+
+    Only the name and the byte offsets of each block are recorded. A block is
+    decoded and split into lines when it is accessed, so blocks which are
+    never used cost nothing beyond locating them. Indexing by block name
+    returns the lines of the block, without blank and comment lines,
+    including the name and "END" lines.
+    """
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.offsets = {}
+        start = _next_line(buffer, 0)
+        while start < len(buffer):
+            stop = _end_of_block(buffer, start)
+            if stop < 0:
+                break
+            name = buffer[start:buffer.find(b'\n', start)].decode().strip()
+            self.offsets[name] = (start, stop)
+            start = _next_line(buffer, stop)
+
+    def __getitem__(self, blockname):
+        return list(self.iter_lines(blockname))
+
+    def __contains__(self, blockname): return blockname in self.offsets
+
+    def __iter__(self): return iter(self.offsets)
+
+    def __len__(self): return len(self.offsets)
+
+    def memoryview(self, blockname):
+        """ The raw bytes of the block, including the name and "END" lines """
+        start, end = self.offsets[blockname]
+        return memoryview(self.buffer)[start:end]
+
+    def head(self, blockname, numlines):
+        """ The first numlines lines of a block, without decoding the rest
+        of it """
+        start, end = self.offsets[blockname]
+        lines = []
+        while start < end and len(lines) < numlines:
+            start = _next_line(self.buffer, start)
+            if start >= end:
+                break
+            stop = self.buffer.find(b'\n', start, end)
+            stop = end if stop < 0 else stop
+            lines.append(self.buffer[start:stop].decode().rstrip('\r')+'\n')
+            start = stop+1
+        return lines
+
+    def iter_lines(self, blockname):
+        start, end = self.offsets[blockname]
+        return _iter_block_lines(self.buffer[start:end])
+
+def _iter_block_lines(data):
+    # lines of raw block bytes, without blank and comment lines
+    text = bytes(data).decode()
+    if '\r' in text:
+        text = text.replace('\r\n', '\n')
+    lines = text.split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    return ( line+'\n' for line in lines
+                if line.strip() and not line[0] == '#' )
+
+def _end_of_block(buffer, start):
+    # offset just after the first "END" line following the line at start,
+    # or -1 if there is none
+    position = start
+    while True:
+        found = buffer.find(b'\nEND', position)
+        if found < 0:
+            return -1
+        position = found+4
+        tail = buffer[position:position+2]
+        if tail[0:1] == b'\n' or tail == b'\r\n':
+            return position + len(tail) - (1 if tail[0:1] == b'\n' else 0)
+        if tail == b'' or tail == b'\r':
+            return len(buffer)
+
+def _next_line(buffer, position):
+    # offset of the first line at or after position which is neither blank
+    # nor a comment
+    while position < len(buffer):
+        end = buffer.find(b'\n', position)
+        end = len(buffer) if end < 0 else end
+        line = buffer[position:end]
+        if line.strip() and not line[0:1] == b'#':
+            return position
+        position = end+1
+    return len(buffer)
+
+def iter_blocks(io, read_size = READ_SIZE):
+    """ Yields the name and raw bytes (as BlockIndex.memoryview) of each
+    block of io in turn, reading it read_size bytes at a time.
+
+    io may be a path or a binary or text file object, and may be compressed
+    (see compressed_format), in which case it is decompressed on another
+    thread while the blocks are read. Only the block being read is held in
+    memory, so files of any length, such as trajectories, can be read in
+    constant memory.
+    """
+    if isinstance(io, (str, os.PathLike)):
+        with open(io, 'rb') as f:
+            yield from iter_blocks(f, read_size)
+        return
+    stream = getattr(io, 'buffer', io)
+    if not hasattr(stream, 'peek') and not stream.seekable():
+        # eg an unbuffered pipe, whose first bytes can only be looked at
+        # without consuming them through a buffer
+        buffered = BufferedReader(stream, read_size)
+        try:
+            yield from iter_blocks(buffered, read_size)
+        finally:
+            buffered.detach()
+        return
+    compression = compression_of_data(peek(stream, 6))
+    if not compression == None:
+        with open_decompressed(stream, compression) as decompressed:
+            yield from _iter_stream_blocks(decompressed, read_size)
+    else:
+        yield from _iter_stream_blocks(stream, read_size)
+
+def _iter_stream_blocks(stream, read_size):
+    buffer = bytearray()
+    searched = 0
+    eof = False
+    while True:
+        start = _next_line(buffer, 0)
+        stop = _end_of_block(buffer, max(start, searched)) \
+                if start < len(buffer) else -1
+        if stop < 0:
+            if eof:
+                break
+            # the buffer always holds whole lines, so the search for the end
+            # of the block can carry on from its last newline
+            searched = max(len(buffer)-1, 0)
+            chunk = stream.read(read_size)
+            if len(chunk) > 0 and not chunk[-1:] in ('\n', b'\n'):
+                chunk += stream.readline()
+            eof = len(chunk) == 0
+            buffer += chunk.encode() if isinstance(chunk, str) else chunk
+            continue
+        name = buffer[start:buffer.find(b'\n', start)].decode().strip()
+        yield name, bytes(buffer[start:stop])
+        del buffer[:stop]
+        searched = 0
 
 def parse_blocks(io):
-   blocks = {}
-   lines = [line for line in io.readlines()
-               if line.strip() and not line[0] == '#' ]
-   start = 0
-   for l,line in enumerate(lines):
-       if l == start:
-           blockname = line.strip()
-       elif line == "END\n":
-           blocks[blockname] = lines[start:l+1]
-           start = l+1
-       else:
-           continue
+   blocks = BlockIndex(read_buffer(io))
    if len(blocks) == 0:
        raise GromosFormatError("No blocks found in file.")
    return blocks
@@ -25,9 +203,7 @@ def parse_simple_columns(block, widths, types, header = True):
         if nrows != header_nrows:
             message = "Block '{}' contains {} lines of data, expected {}"
             raise GromosFormatError(
-                message.format(block[0].strip()),
-                nrows,
-                header_nrows,
+                message.format(block[0].strip(), nrows, header_nrows)
             )
     ncols = len(widths)
     #check format is consistent with expectations
@@ -38,9 +214,9 @@ def parse_simple_columns(block, widths, types, header = True):
     line_width = sum(widths)+1 #includes newline
     for r in range(nrows):
         if len(block[r+offset]) != line_width:
-            message = "line {} of block is wrong length: \"{}\""
+            message = "line {} of block '{}' is wrong length: \"{}\""
             raise GromosFormatError(
-                message.format(r+2, block[1].strip(), block[r+2])
+                message.format(r+offset, block[0].strip(), block[r+offset])
             )
     # read columns into lists
     bounds = [ (sum(widths[0:i]) , sum(widths[0:i+1]))
@@ -57,6 +233,113 @@ def parse_simple_columns(block, widths, types, header = True):
         )
     return columns
 
+def parse_column_arrays(data, widths, types, header = True):
+    """ As parse_simple_columns, but for the raw bytes of a block (see
+    BlockIndex.memoryview), returning int and float columns as array.array.
+
+    The rows are unpacked as fixed-width records straight from the buffer and
+    each column is converted in a single pass. Columns whose type is None
+    are skipped, and returned as None. Comment lines within the data, such
+    as the atom counts every ten lines of a trajectory, are dropped first.
+    Blocks which are not otherwise laid out as exact fixed-width records
+    (CRLF line endings, blank lines, lines of the wrong length, bad fields)
+    are handed to parse_simple_columns, so errors are reported exactly as
+    before.
+    """
+    columns = _unpack_fixed_width(data, widths, types, header)
+    if columns is None:
+        block = list(_iter_block_lines(data))
+        columns = parse_simple_columns(
+            block, widths, [ str if typ is None else typ for typ in types ],
+            header,
+        )
+    return [ None if typ is None else _typed_column(column, typ)
+                for column, typ in zip(columns, types) ]
+
+def _unpack_fixed_width(data, widths, types, header):
+    # Returns None if the block cannot be read as fixed-width records
+    data = bytes(data)
+    if b'\n#' in data:
+        data = _COMMENT_LINES.sub(b'', data)
+    start = _next_line(data, data.find(b'\n')+1)
+    if header:
+        count_end = data.find(b'\n', start)+1
+        try:
+            header_nrows = int(data[start:count_end])
+        except ValueError:
+            return None
+        start = _next_line(data, count_end)
+    end = data.rfind(b'\nEND')+1
+    line_width = sum(widths)+1 #includes newline
+    nrows, remainder = divmod(end-start, line_width)
+    if remainder != 0 or end < start or (header and nrows != header_nrows):
+        return None
+    if nrows == 0:
+        return [ None if typ is None else [] for typ in types ]
+    if data[start+line_width-1:end:line_width] != b'\n'*nrows:
+        return None
+    if all(typ in (None, int, float) for typ in types):
+        fields = _numeric_fields(data, start, end, widths, types)
+    else:
+        record = struct.Struct(''.join(
+            '{}{}'.format(w, 'x' if typ is None else 's')
+            for w, typ in zip(widths, types)
+        )+'x')
+        fields = list(zip(*record.iter_unpack(memoryview(data)[start:end])))
+    if fields is None:
+        return None
+    fields = iter(fields)
+    try:
+        return [ None if typ is None else _convert_column(next(fields), typ)
+                    for typ in types ]
+    except ValueError:
+        return None
+
+def _numeric_fields(data, start, end, widths, types):
+    # Splits the numeric fields of every row into columns of tokens at once,
+    # provided each field holds exactly one right-aligned number
+    line_width = sum(widths)+1
+    wanted = [ typ is not None for typ in types ]
+    bounds = [ (sum(widths[0:i]), sum(widths[0:i+1]))
+                for i in range(len(widths)) ]
+    for (first, last), keep in zip(bounds, wanted):
+        if keep and _has_space(data[start+last-1:end:line_width]):
+            return None
+    separated = all( data[start+first:end:line_width].isspace()
+                     for first, last in bounds[1:] )
+    if all(wanted) and separated:
+        # every field starts with a space, so the rows can be split directly
+        tokens = data[start:end].split()
+    else:
+        # join the fields with spaces, in case neighbouring fields run together
+        record = struct.Struct(''.join(
+            '{}{}'.format(w, 's' if keep else 'x')
+            for w, keep in zip(widths, wanted)
+        )+'x')
+        rows = record.iter_unpack(memoryview(data)[start:end])
+        tokens = b' '.join(chain.from_iterable(rows)).split()
+    ncols = sum(typ is not None for typ in types)
+    if len(tokens) != ncols*((end-start)//line_width):
+        return None
+    return [ tokens[c::ncols] for c in range(ncols) ]
+
+def _has_space(data):
+    return len(data.translate(None, b' \t\n\r\x0b\x0c')) != len(data)
+
+def _convert_column(column, typ):
+    if typ is int:
+        return array('q', map(int, column))
+    if typ is float:
+        return array('d', map(float, column))
+    return [ typ(field.decode()) for field in column ]
+
+def _typed_column(column, typ):
+    if typ is int and not isinstance(column, array):
+        return array('q', column)
+    if typ is float and not isinstance(column, array):
+        return array('d', column)
+    return column
+
 def parse_array_block(block, width, typ):
     n = int(block[1])
     line = ''.join(block[2:-1]).replace('\n','')
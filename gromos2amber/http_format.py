@@ -0,0 +1,82 @@
+""" The small part of HTTP/1.1 spoken between the conversion server and its
+clients: requests and responses with JSON bodies of known Content-Length,
+over connections which are kept open between requests. """
+
+import json
+from .Errors import IllegalArgumentError
+
+# Largest body accepted, in bytes
+MAX_BODY_BYTES = 1 << 30
+
+REASONS = {
+    200 : "OK",
+    400 : "Bad Request",
+    404 : "Not Found",
+    405 : "Method Not Allowed",
+    500 : "Internal Server Error",
+}
+
+async def read_request(reader):
+    """ The method, target, headers and JSON body of the next request on an
+    asyncio stream, or None at the end of the stream """
+    line = await reader.readline()
+    if len(line) == 0:
+        return None
+    try:
+        method, target, _ = line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise IllegalArgumentError("Bad HTTP request line.")
+    headers = await _read_headers(reader)
+    return method, target, headers, await _read_body(reader, headers)
+
+async def read_response(reader):
+    """ The status, headers and JSON body of a response """
+    line = await reader.readline()
+    try:
+        status = int(line.decode("latin-1").split(" ", 2)[1])
+    except (IndexError, ValueError):
+        raise IllegalArgumentError("Bad HTTP status line.")
+    headers = await _read_headers(reader)
+    return status, headers, await _read_body(reader, headers)
+
+def format_request(method, target, body = None, host = "localhost",
+                   keep_alive = True):
+    head = "{} {} HTTP/1.1\r\nHost: {}\r\n".format(method, target, host)
+    return _format(head + ("" if keep_alive else "Connection: close\r\n"),
+                   body)
+
+def format_response(status, body):
+    return _format("HTTP/1.1 {} {}\r\n".format(
+        status, REASONS.get(status, "")), body)
+
+def _format(head, body):
+    data = b"" if body == None else json.dumps(body).encode()
+    head += "Content-Type: application/json\r\n" if len(data) > 0 else ""
+    head += "Content-Length: {}\r\n\r\n".format(len(data))
+    return head.encode("latin-1") + data
+
+async def _read_headers(reader):
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            return headers
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+async def _read_body(reader, headers):
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise IllegalArgumentError("Bad Content-Length.")
+    if length > MAX_BODY_BYTES:
+        raise IllegalArgumentError(
+            "Body of {} bytes is larger than the limit of {}.".format(
+                length, MAX_BODY_BYTES))
+    if length == 0:
+        return None
+    data = await reader.readexactly(length)
+    try:
+        return json.loads(data)
+    except ValueError as error:
+        raise IllegalArgumentError("Bad JSON body: " + str(error))
@@ -0,0 +1,191 @@
+""" A minimal writer for NetCDF files in the classic format with 64-bit
+offsets (CDF-2), which is what Amber uses for NetCDF trajectories and
+restarts.
+
+Dimensions, attributes and variables are declared first, along with the
+data of the fixed-size variables. The header and fixed-size data are written
+by the first call to write_record() (or by close(), for a file with no
+records), then records are appended one at a time, so a file of any number
+of records is written without holding more than one record in memory, and
+without seeking back through the file.
+"""
+
+import sys
+import struct
+from array import array
+
+NC_DIMENSION = 10
+NC_VARIABLE = 11
+NC_ATTRIBUTE = 12
+
+# nc_type, size and array typecode of each variable type
+TYPES = {
+        'c' : (2, 1, None), # NC_CHAR
+        'i' : (4, 4, 'i'),  # NC_INT
+        'f' : (5, 4, 'f'),  # NC_FLOAT
+        'd' : (6, 8, 'd'),  # NC_DOUBLE
+        }
+
+# numrecs of a file whose number of records is not known while writing
+STREAMING = 0xFFFFFFFF
+
+class NetCDFWriter:
+    def __init__(self, io):
+        """ io is a binary file. If it is seekable, the number of records in
+        the header is kept up to date as records are written, otherwise the
+        number of records is left indeterminate. """
+        self.io = io
+        self.seekable = io.seekable()
+        self.dimensions = []
+        self.attributes = []
+        self.variables = []
+        self.num_records = 0
+        self.header_written = False
+
+    def dimension(self, name, length):
+        """ Declares a dimension. The record dimension has length None """
+        self.dimensions.append((name, length))
+
+    def attribute(self, name, value):
+        """ Declares a global attribute, a str, int or float """
+        self.attributes.append((name, value))
+
+    def variable(self, name, typecode, dimensions, data = None,
+                 **attributes):
+        """ Declares a variable of type typecode (see TYPES) whose shape is
+        given by the names of its dimensions. A variable whose first
+        dimension is the record dimension is a record variable, otherwise
+        data holds all of its values. """
+        lengths = dict(self.dimensions)
+        self.variables.append(_Variable(
+            name, typecode,
+            [ self._dimension_index(dimension) for dimension in dimensions ],
+            [ lengths[dimension] for dimension in dimensions ],
+            list(attributes.items()),
+            data,
+        ))
+
+    def write_record(self, values):
+        """ Appends a record, values being a dict from the name of each
+        record variable to its data """
+        self._write_header()
+        for variable in self.variables:
+            if variable.is_record:
+                self.io.write(variable.encode(values[variable.name]))
+        self.num_records += 1
+        if self.seekable:
+            self.io.seek(4)
+            self.io.write(struct.pack('>I', self.num_records))
+            self.io.seek(0, 2)
+
+    def close(self):
+        """ Writes the header if no records have been written """
+        self._write_header()
+
+    def _write_header(self):
+        if self.header_written:
+            return
+        self.header_written = True
+        # offsets are 8 bytes whatever their value, so the header length
+        # does not depend on the layout
+        begin = len(self._header())
+        for variable in self.variables:
+            if not variable.is_record:
+                variable.begin = begin
+                begin += variable.vsize
+        for variable in self.variables:
+            if variable.is_record:
+                variable.begin = begin
+                begin += variable.vsize
+        self.io.write(self._header())
+        for variable in self.variables:
+            if not variable.is_record:
+                self.io.write(variable.encode(variable.data))
+                variable.data = None
+
+    def _header(self):
+        numrecs = 0 if self.seekable else STREAMING
+        header = [ b'CDF\x02', struct.pack('>I', numrecs) ]
+        header.append(_list(NC_DIMENSION, [
+            _name(name) + struct.pack('>i', 0 if length is None else length)
+            for name, length in self.dimensions
+        ]))
+        header.append(_attributes(self.attributes))
+        header.append(_list(NC_VARIABLE, [
+            variable.header() for variable in self.variables
+        ]))
+        return b''.join(header)
+
+    def _dimension_index(self, name):
+        return [ dimension for dimension, _ in self.dimensions ].index(name)
+
+class _Variable:
+    def __init__(self, name, typecode, dimension_ids, lengths, attributes,
+                 data):
+        self.name, self.typecode, self.data = name, typecode, data
+        self.dimension_ids, self.attributes = dimension_ids, attributes
+        self.is_record = len(lengths) > 0 and lengths[0] is None
+        size = TYPES[typecode][1]
+        for length in lengths[1:] if self.is_record else lengths:
+            size *= length
+        self.size = size
+        self.vsize = min(_padded(size), 0xFFFFFFFF)
+        self.begin = 0
+
+    def header(self):
+        nc_type = TYPES[self.typecode][0]
+        return b''.join([
+            _name(self.name),
+            struct.pack('>i', len(self.dimension_ids)),
+            struct.pack('>{}i'.format(len(self.dimension_ids)),
+                        *self.dimension_ids),
+            _attributes(self.attributes),
+            struct.pack('>iIq', nc_type, self.vsize, self.begin),
+        ])
+
+    def encode(self, values):
+        """ The big-endian bytes of values, padded to vsize """
+        if self.typecode == 'c':
+            data = values.encode() if isinstance(values, str) else bytes(values)
+        else:
+            data = _big_endian(TYPES[self.typecode][2], values)
+        if not len(data) == self.size:
+            raise ValueError(
+                "Variable '{}' has {} bytes of data, expected {}".format(
+                    self.name, len(data), self.size)
+            )
+        return data + bytes(_padded(len(data)) - len(data))
+
+def _big_endian(typecode, values):
+    values = array(typecode, values)
+    if sys.byteorder == 'little':
+        values.byteswap()
+    return values.tobytes()
+
+def _padded(size): return (size+3)//4*4
+
+def _name(name):
+    name = name.encode()
+    return struct.pack('>i', len(name)) + name + bytes(_padded(len(name))-len(name))
+
+def _list(tag, elements):
+    if len(elements) == 0:
+        return struct.pack('>ii', 0, 0) # ABSENT
+    return struct.pack('>ii', tag, len(elements)) + b''.join(elements)
+
+def _attributes(attributes):
+    elements = []
+    for name, value in attributes:
+        if isinstance(value, str):
+            typecode, data = 'c', value.encode()
+            count = len(data)
+        else:
+            typecode = 'i' if isinstance(value, int) else 'd'
+            data = _big_endian(typecode, [value])
+            count = 1
+        elements.append(
+            _name(name)
+            + struct.pack('>ii', TYPES[typecode][0], count)
+            + data + bytes(_padded(len(data))-len(data))
+        )
+    return _list(NC_ATTRIBUTE, elements)
@@ -0,0 +1,120 @@
+""" A minimal reader of classic NetCDF files (CDF-1 and CDF-2), to check
+what netcdf_format.NetCDFWriter writes independently of it. """
+
+import sys
+import struct
+from array import array
+
+NC_DIMENSION = 10
+NC_VARIABLE = 11
+NC_ATTRIBUTE = 12
+
+# typecode and size of each nc_type
+TYPES = {
+    2 : ('c', 1),
+    4 : ('i', 4),
+    5 : ('f', 4),
+    6 : ('d', 8),
+}
+
+class Variable:
+    def __init__(self, name, dimension_ids, attributes, nc_type, vsize,
+                 begin):
+        self.name, self.dimension_ids = name, dimension_ids
+        self.attributes, self.nc_type = attributes, nc_type
+        self.vsize, self.begin = vsize, begin
+
+class NetCDFFile:
+    def __init__(self, data):
+        self.data = bytes(data)
+        self.position = 0
+        self.magic = self._read(4)
+        self.offset_format = '>q' if self.magic == b'CDF\x02' else '>i'
+        self.numrecs = self._unpack('>I')
+        self.dimensions = [ (name, self._unpack('>i'))
+                            for name in self._names(NC_DIMENSION) ]
+        self.attributes = self._attributes()
+        self.variables = {}
+        for name in self._names(NC_VARIABLE):
+            dimension_ids = [ self._unpack('>i')
+                              for i in range(self._unpack('>i')) ]
+            attributes = self._attributes()
+            nc_type, vsize = self._unpack('>i'), self._unpack('>I')
+            begin = self._unpack(self.offset_format)
+            self.variables[name] = Variable(name, dimension_ids, attributes,
+                                            nc_type, vsize, begin)
+        self.header_size = self.position
+
+    def is_record(self, name):
+        ids = self.variables[name].dimension_ids
+        return len(ids) > 0 and self.dimensions[ids[0]][1] == 0
+
+    def record_size(self):
+        return sum( variable.vsize for variable in self.variables.values()
+                    if self.is_record(variable.name) )
+
+    def values(self, name, record = None):
+        """ The values of a variable, or of one record of it, as an array,
+        or as bytes for text """
+        variable = self.variables[name]
+        typecode, size = TYPES[variable.nc_type]
+        lengths = [ self.dimensions[i][1] for i in variable.dimension_ids ]
+        begin = variable.begin
+        if self.is_record(name):
+            lengths = lengths[1:]
+            begin += record*self.record_size()
+        count = 1
+        for length in lengths:
+            count *= length
+        data = self.data[begin:begin+count*size]
+        if typecode == 'c':
+            return data
+        return _from_big_endian(typecode, data)
+
+    def _read(self, size):
+        data = self.data[self.position:self.position+size]
+        self.position += size
+        return data
+
+    def _unpack(self, format_string):
+        value, = struct.unpack_from(format_string, self.data, self.position)
+        self.position += struct.calcsize(format_string)
+        return value
+
+    def _name(self):
+        length = self._unpack('>i')
+        name = self._read(length).decode()
+        self.position += _padded(length) - length
+        return name
+
+    def _names(self, tag):
+        # the names of the elements of a list, the rest of each element
+        # being read by the caller before the next name
+        found, count = self._unpack('>i'), self._unpack('>i')
+        if found == 0:
+            return
+        assert found == tag, "expected list {}, found {}".format(tag, found)
+        for i in range(count):
+            yield self._name()
+
+    def _attributes(self):
+        attributes = {}
+        for name in self._names(NC_ATTRIBUTE):
+            nc_type, count = self._unpack('>i'), self._unpack('>i')
+            typecode, size = TYPES[nc_type]
+            data = self._read(count*size)
+            self.position += _padded(count*size) - count*size
+            if typecode == 'c':
+                attributes[name] = data.decode()
+            else:
+                value, = _from_big_endian(typecode, data)
+                attributes[name] = value
+        return attributes
+
+def _from_big_endian(typecode, data):
+    values = array(typecode, data)
+    if sys.byteorder == 'little':
+        values.byteswap()
+    return values
+
+def _padded(size): return (size+3)//4*4
@@ -0,0 +1,100 @@
+import io
+import os
+import unittest
+
+from gromos2amber.Topology import Topology
+from gromos2amber.AmberTopologyWriter import AmberTopologyWriter, SECTIONS
+from gromos2amber.AmberTopologyReader import AmberTopologyReader
+from gromos2amber.AmberTopologyDiff import TopologySections, diff_sections, \
+        solvent_of
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+
+def topology(num_solvent):
+    topology = Topology(os.path.join(DATA, "solvated.top"))
+    topology.add_solvent(num_solvent, "SOLV")
+    return topology
+
+def written(topology):
+    out = io.StringIO()
+    AmberTopologyWriter(topology).write(out)
+    return out.getvalue().encode()
+
+def replace_field(data, title, index, width, per_line, value):
+    # data with value of section title at index, in fields of width with
+    # per_line fields a line
+    reader = AmberTopologyReader(data)
+    start = reader.sections[title][2]
+    line, field = divmod(index, per_line)
+    offset = start + line*(width*per_line + 1) + field*width
+    return data[:offset] + value.rjust(width).encode() \
+            + data[offset+width:]
+
+class AmberTopologyDiffTest(unittest.TestCase):
+    def setUp(self):
+        self.topology = topology(3)
+        self.data = written(self.topology)
+
+    def test_reader_reads_every_section(self):
+        reader = AmberTopologyReader(self.data)
+        self.assertEqual(list(reader), [ entry.title for entry in SECTIONS ])
+        self.assertTrue(reader.version.startswith("%VERSION"))
+        self.assertEqual(reader["POINTERS"][0],
+                         self.topology.num_atoms())
+        self.assertEqual(list(reader["RESIDUE_LABEL"][-3:]), [ "SOLV" ]*3)
+        self.assertEqual(len(reader["CHARGE"]), self.topology.num_atoms())
+
+    def test_written_topology_diffs_clean(self):
+        reader = AmberTopologyReader(self.data)
+        self.assertEqual(diff_sections(reader,
+                                       TopologySections(self.topology)), [])
+        self.assertEqual(diff_sections(reader,
+                                       AmberTopologyReader(self.data)), [])
+        self.assertEqual(solvent_of(reader, topology(0)), (3, "SOLV"))
+
+    def test_perturbed_integer_is_reported(self):
+        data = replace_field(self.data, "ATOM_TYPE_INDEX", 13, 8, 10, "99")
+        differences = diff_sections(AmberTopologyReader(data),
+                                    TopologySections(self.topology))
+        self.assertEqual([ (difference.title, difference.index)
+                           for difference in differences ],
+                         [ ("ATOM_TYPE_INDEX", 13) ])
+        self.assertEqual(differences[0].first[13], 99)
+        self.assertIn("first difference at index 13: 99",
+                      str(differences[0]))
+
+    def test_perturbed_real_is_reported(self):
+        reader = AmberTopologyReader(self.data)
+        charge = reader["CHARGE"][4]
+        data = replace_field(self.data, "CHARGE", 4, 24, 3,
+                             "{:.16E}".format(charge + 1.0))
+        differences = diff_sections(AmberTopologyReader(data), reader)
+        self.assertEqual([ (difference.title, difference.index)
+                           for difference in differences ],
+                         [ ("CHARGE", 4) ])
+
+    def test_tolerance(self):
+        reader = AmberTopologyReader(self.data)
+        mass = reader["MASS"][0]
+        data = replace_field(self.data, "MASS", 0, 16, 5,
+                             "{:.8E}".format(mass*(1 + 1e-7)))
+        perturbed = AmberTopologyReader(data)
+        self.assertEqual(diff_sections(perturbed, reader), [])
+        self.assertEqual([ (difference.title, difference.index)
+                           for difference in diff_sections(
+                               perturbed, reader, rtol = 1e-8) ],
+                         [ ("MASS", 0) ])
+
+    def test_missing_section_is_reported(self):
+        reader = AmberTopologyReader(self.data)
+        start = self.data.index(b"%FLAG SOLTY")
+        stop = self.data.index(b"%FLAG", start+1)
+        data = self.data[:start] + self.data[stop:]
+        differences = diff_sections(AmberTopologyReader(data), reader)
+        self.assertEqual([ (difference.title, difference.index)
+                           for difference in differences ],
+                         [ ("SOLTY", None) ])
+        self.assertIn("only in the second", str(differences[0]))
+
+if __name__ == "__main__":
+    unittest.main()
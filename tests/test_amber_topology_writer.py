@@ -0,0 +1,158 @@
+import io
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+from gromos2amber import convert
+from gromos2amber.Topology import Topology
+from gromos2amber.AmberTopologyWriter import AmberTopologyWriter, SECTIONS, \
+        SOLVENT_SECTIONS, SOLVENT_RESIDUE_NAME_SECTIONS, SECTION_INDEX_SUFFIX
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+ROOT = os.path.join(os.path.dirname(__file__), os.pardir)
+
+def read_data(name):
+    with open(os.path.join(DATA, name), "rb") as f:
+        return f.read()
+
+class AppendTest(unittest.TestCase):
+    # Files opened to append are written in turn, not laid out and pwritten
+    HEADER = b"HEADER LINE\n"
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "app.prm")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read_output(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def test_append_after_content(self):
+        with open(self.path, "wb") as f:
+            f.write(self.HEADER)
+        with open(self.path, "a") as f:
+            convert(os.path.join(DATA, "solvated.top"), f)
+        self.assertEqual(self.read_output(),
+                         self.HEADER + read_data("solvated.prmtop"))
+
+    def test_append_to_empty_file(self):
+        open(self.path, "wb").close()
+        with open(self.path, "a") as f:
+            convert(os.path.join(DATA, "solvated.top"), f)
+        self.assertEqual(self.read_output(), read_data("solvated.prmtop"))
+
+    def test_cli_appending_redirect(self):
+        with open(self.path, "wb") as f:
+            f.write(self.HEADER)
+        environment = dict(os.environ, PYTHONPATH = os.path.abspath(ROOT))
+        # as a shell opens >>, without moving to the end of the file, so
+        # that standard output is at position 0 of a file with content
+        descriptor = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        try:
+            subprocess.run(
+                [ sys.executable, os.path.join(ROOT, "bin", "gromos2amber"),
+                  "--topology_in", os.path.join(DATA, "solvated.top") ],
+                check = True, stdout = descriptor, env = environment)
+        finally:
+            os.close(descriptor)
+        self.assertEqual(self.read_output(),
+                         self.HEADER + read_data("solvated.prmtop"))
+
+class LayoutTest(unittest.TestCase):
+    def writer(self, num_solvent):
+        topology = Topology(os.path.join(DATA, "solvated.top"))
+        topology.add_solvent(num_solvent, "SOLV")
+        return AmberTopologyWriter(topology)
+
+    def test_counts_are_those_of_the_sections(self):
+        for num_solvent in (0, 3):
+            writer = self.writer(num_solvent)
+            for entry in SECTIONS:
+                with self.subTest(title = entry.title,
+                                  num_solvent = num_solvent):
+                    values = list(getattr(writer, entry.title)())
+                    self.assertEqual(entry.count(writer), len(values))
+
+    def test_layout_renders_no_section(self):
+        writer = self.writer(3)
+        def rendered():
+            raise AssertionError("a section was rendered")
+        for entry in SECTIONS:
+            setattr(writer, entry.title, rendered)
+        layout, size = writer._layout()
+        self.assertEqual(len(layout), len(SECTIONS))
+
+    def test_layout_is_that_of_the_file(self):
+        writer = self.writer(3)
+        out = io.StringIO()
+        writer.write(out)
+        text = out.getvalue().encode()
+        layout, size = writer._layout()
+        self.assertEqual(size, len(text))
+        for title, header_offset, header, offset, length in layout:
+            self.assertEqual(text[header_offset:offset], header)
+
+class WriteIncrementalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "out.prmtop")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def writer(self, num_solvent, residue_name = "SOLV"):
+        topology = Topology(os.path.join(DATA, "solvated.top"))
+        topology.add_solvent(num_solvent, residue_name)
+        return AmberTopologyWriter(topology)
+
+    def assert_written_in_full(self, writer):
+        out = io.StringIO()
+        writer.write(out)
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), out.getvalue().encode())
+
+    def test_only_solvent_sections_are_rendered_again(self):
+        first = self.writer(2)
+        rendered = first.write_incremental(self.path)
+        self.assertEqual(rendered, [ entry.title for entry in SECTIONS ])
+        self.assert_written_in_full(first)
+        second = self.writer(5)
+        rendered = second.write_incremental(self.path)
+        # the number of residues depends on the number of solvent molecules
+        self.assertEqual(rendered, [ entry.title for entry in SECTIONS
+                                     if entry.title in SOLVENT_SECTIONS
+                                     or entry.title in
+                                         SOLVENT_RESIDUE_NAME_SECTIONS ])
+        self.assert_written_in_full(second)
+
+    def test_unchanged_inputs_render_nothing(self):
+        self.writer(2).write_incremental(self.path)
+        writer = self.writer(2)
+        self.assertEqual(writer.write_incremental(self.path), [])
+        self.assert_written_in_full(writer)
+
+    def test_residue_name_renders_residue_labels(self):
+        self.writer(2).write_incremental(self.path)
+        writer = self.writer(2, "WAT")
+        self.assertEqual(writer.write_incremental(self.path),
+                         SOLVENT_RESIDUE_NAME_SECTIONS)
+        self.assert_written_in_full(writer)
+
+    def test_modified_file_is_not_reused(self):
+        self.writer(2).write_incremental(self.path)
+        with open(self.path, "ab") as f:
+            f.write(b"\n")
+        writer = self.writer(2)
+        self.assertEqual(writer.write_incremental(self.path),
+                         [ entry.title for entry in SECTIONS ])
+        self.assert_written_in_full(writer)
+        self.assertTrue(os.path.exists(self.path + SECTION_INDEX_SUFFIX))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from gromos2amber.Batch import Job, run_batch, PARTIAL_SUFFIX
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+
+class RunBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        with open(os.path.join(DATA, "solvated.top")) as f:
+            topology = f.read()
+        self.good = self.path("good.top")
+        with open(self.good, "w") as f:
+            f.write(topology)
+        # pair types out of order make Topology raise a bare Exception
+        self.bad = self.path("bad.top")
+        with open(self.bad, "w") as f:
+            f.write(topology.replace("LJPARAMETERS\n15\n    1    1",
+                                     "LJPARAMETERS\n15\n    9    1", 1))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name): return os.path.join(self.directory, name)
+
+    def test_unexpected_error_fails_only_its_job(self):
+        jobs = [ Job(self.bad, self.path("bad.prmtop")),
+                 Job(self.good, self.path("a.prmtop")),
+                 Job(self.good, self.path("b.prmtop")) ]
+        results = { result.job.topology_out : result
+                    for result in run_batch(jobs, workers = 2) }
+        self.assertEqual(len(results), 3)
+        failed = results[self.path("bad.prmtop")]
+        self.assertEqual(failed.status, "failed")
+        self.assertIn("bad pair ordering", failed.error)
+        self.assertFalse(os.path.exists(self.path("bad.prmtop")))
+        self.assertFalse(os.path.exists(
+            self.path("bad.prmtop") + PARTIAL_SUFFIX))
+        for name in ("a.prmtop", "b.prmtop"):
+            self.assertEqual(results[self.path(name)].status, "converted")
+            self.assertTrue(os.path.exists(self.path(name)))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,181 @@
+import io
+import os
+import bz2
+import lzma
+import zlib
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+
+from gromos2amber import convert
+from gromos2amber.Topology import Topology
+from gromos2amber.gromos_format import read_buffer, iter_blocks
+from gromos2amber.compressed_format import CompressedWriter, open_output, \
+        compression_of_data, strip_compression_extension, MAGIC
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+BLOCK_SIZE = 1 << 16
+
+NEW_DECOMPRESSOR = {
+    "gzip" : lambda: zlib.decompressobj(wbits = 16 + zlib.MAX_WBITS),
+    "xz" : lzma.LZMADecompressor,
+    "bz2" : bz2.BZ2Decompressor,
+}
+
+def read_data(name):
+    with open(os.path.join(DATA, name), "rb") as f:
+        return f.read()
+
+def example_data(size):
+    rnd = random.Random(1)
+    words = [ b"ATOM", b"BOND", b"%FLAG", b"12.5000", b"-0.3650", b"\n" ]
+    data = bytearray()
+    while len(data) < size:
+        data += rnd.choice(words) + b" "
+    return bytes(data[:size])
+
+def members(compression, data):
+    # the decompressed data of each member or stream, with the library's
+    # decompressors, which stop at the end of each
+    decompressed = []
+    while len(data) > 0:
+        decompressor = NEW_DECOMPRESSOR[compression]()
+        decompressed.append(decompressor.decompress(data))
+        data = decompressor.unused_data
+    return decompressed
+
+def configuration(num_atoms):
+    lines = [ "TITLE\nsynthetic coordinates\nEND\nPOSITION\n" ]
+    for i in range(num_atoms):
+        lines.append("%5d %-5s %-5s%7d%15.9f%15.9f%15.9f\n" % (
+            1, "RES", "AT", i+1,
+            1.0 + 0.02*(i % 6), 1.0 + 0.02*(i // 6), 1.5))
+    lines.append("END\nGENBOX\n    1\n")
+    lines.append("    4.000000000    4.000000000    4.000000000\n")
+    lines.append("   90.000000000   90.000000000   90.000000000\n")
+    lines.append("    0.000000000    0.000000000    0.000000000\n"*2)
+    lines.append("END\n")
+    return "".join(lines)
+
+class _Unclosed(io.BytesIO):
+    # keeps its value once the CompressedWriter writing to it is closed
+    def close(self): pass
+
+def compress(data, compression, threads):
+    raw = _Unclosed()
+    writer = CompressedWriter(raw, compression, threads = threads)
+    writer.block_size = BLOCK_SIZE
+    # in pieces which do not line up with the blocks
+    for start in range(0, len(data), 10000):
+        writer.write(data[start:start+10000])
+    writer.close()
+    return raw.getvalue()
+
+class _Unseekable(io.RawIOBase):
+    # a pipe, as far as a reader can tell: unbuffered, without peek or seek
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+
+    def readable(self): return True
+
+    def readinto(self, buffer):
+        return self.data.readinto(buffer)
+
+class CompressedWriterTest(unittest.TestCase):
+    def test_round_trip_in_several_members(self):
+        data = example_data(5*BLOCK_SIZE + 123)
+        for compression in MAGIC:
+            with self.subTest(compression = compression):
+                compressed = compress(data, compression, 4)
+                self.assertEqual(compression_of_data(compressed),
+                                 compression)
+                parts = members(compression, compressed)
+                self.assertEqual(len(parts), 6)
+                self.assertEqual([ len(part) for part in parts[:-1] ],
+                                 [ BLOCK_SIZE ]*5)
+                self.assertEqual(b"".join(parts), data)
+                self.assertEqual(bytes(read_buffer(compressed)), data)
+
+    def test_empty_output_is_one_member(self):
+        for compression in MAGIC:
+            with self.subTest(compression = compression):
+                raw = _Unclosed()
+                CompressedWriter(raw, compression, threads = 2).close()
+                self.assertEqual(members(compression, raw.getvalue()),
+                                 [ b"" ])
+
+class CompressedFileTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_convert_to_compressed_outputs(self):
+        expected = read_data("solvated.prmtop")
+        for extension in (".gz", ".xz", ".bz2"):
+            with self.subTest(extension = extension):
+                path = os.path.join(self.directory, "out.prmtop" + extension)
+                with open_output(path, "w", threads = 3) as f:
+                    convert(os.path.join(DATA, "solvated.top"), f)
+                self.assertEqual(bytes(read_buffer(path)), expected)
+
+    def test_compressed_input_from_unseekable_stream(self):
+        topology = read_data("solvated.top")
+        for compression in MAGIC:
+            with self.subTest(compression = compression):
+                compressed = compress(topology, compression, 2)
+                names = [ name for name, _ in
+                          iter_blocks(_Unseekable(compressed)) ]
+                self.assertEqual(names[0], "TITLE")
+                self.assertEqual(names, [ name for name, _ in
+                                          iter_blocks(io.BytesIO(topology)) ])
+                self.assertEqual(
+                    len(Topology(_Unseekable(compressed)).atoms), 36)
+
+    def test_compressed_input_from_pipe(self):
+        compressed = compress(read_data("solvated.top"), "xz", 2)
+        readable, writable = os.pipe()
+        def write():
+            with os.fdopen(writable, "wb") as f:
+                f.write(compressed)
+        writer = threading.Thread(target = write)
+        writer.start()
+        try:
+            out = io.StringIO()
+            with os.fdopen(readable, "rb", buffering = 0) as f:
+                convert(f, out)
+        finally:
+            writer.join()
+        self.assertEqual(out.getvalue().encode(),
+                         read_data("solvated.prmtop"))
+
+class ExtensionTest(unittest.TestCase):
+    def test_strip_compression_extension(self):
+        self.assertEqual(strip_compression_extension("out.ncrst.gz"),
+                         "out.ncrst")
+        self.assertEqual(strip_compression_extension("out.nc.XZ"), "out.nc")
+        self.assertEqual(strip_compression_extension("out.inpcrd.bz2"),
+                         "out.inpcrd")
+        self.assertEqual(strip_compression_extension("out.ncrst"),
+                         "out.ncrst")
+
+    def test_compressed_ncrst_is_netcdf(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "out.ncrst.gz")
+            config_in = os.path.join(directory, "in.g96")
+            with open(config_in, "w") as f:
+                f.write(configuration(36))
+            with open(os.devnull, "w") as tout, \
+                    open_output(path, "wb") as cout:
+                convert(os.path.join(DATA, "solvated.top"), tout,
+                        config_in = config_in, config_out = cout)
+            self.assertEqual(bytes(read_buffer(path))[:4], b"CDF\x02")
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,30 @@
+import io
+import os
+import unittest
+
+from gromos2amber import convert
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+
+def data_path(name): return os.path.join(DATA, name)
+
+def read_text(name):
+    with open(data_path(name)) as f:
+        return f.read()
+
+class ConvertWithoutConfigurationTest(unittest.TestCase):
+    # solvated.prmtop was written by the original version of the package,
+    # which added no solvent for the default num_solvent of -1
+
+    def test_default_num_solvent_adds_no_solvent(self):
+        out = io.StringIO()
+        convert(data_path("solvated.top"), out)
+        self.assertEqual(out.getvalue(), read_text("solvated.prmtop"))
+
+    def test_zero_num_solvent_matches_default(self):
+        out = io.StringIO()
+        convert(data_path("solvated.top"), out, num_solvent = 0)
+        self.assertEqual(out.getvalue(), read_text("solvated.prmtop"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import math
+import unittest
+from array import array
+from itertools import cycle, islice
+
+from gromos2amber.fortran_format import FORMAT_CODES, PERCENT_CODES, \
+        fortran_format, iter_fortran_format, formatted_size
+
+# Values of each kind of field, including those at the limit of its width
+# and beyond it, which both ways of formatting write in full
+FIELD_VALUES = {
+    'd' : [ 0, 1, -1, 7, 42, -42, 99, -9, 9999999, -999999, 99999999,
+            -9999999, 123456789, -123456789 ],
+    's' : [ "", "C", "CA", "HB2", "OW  ", "NAME", "TOOLONG", " X ",
+            "CHARMM force field: No FF information parsed..."*2 ],
+    'f' : [ 0.0, -0.0, 1.0, -1.5, 0.12345675, 9999.9999999, -999.9999999,
+            99999.123, 1e-8, -1e-8, 123.4565, math.inf, -math.inf,
+            math.nan ],
+    'E' : [ 0.0, -0.0, 1.0, -1.0, 1.0/3.0, 12.011, 1e-300, -1e300,
+            5e-324, 1.7976931348623157e308, 0.5e-8, 99999.99995,
+            math.inf, math.nan ],
+}
+
+def legacy_fortran_format(fortran_format_code, values):
+    # one str.format field per value, as fortran_format did originally
+    format_line = FORMAT_CODES[fortran_format_code]
+    num_per_line = len(format_line)
+    format_codes = [] if len(values)>0 else ['\n']
+    newlines = 0
+    while True:
+        remaining = len(values) - (len(format_codes) - newlines)
+        if remaining <= 0: break
+        format_codes.extend( format_line[:min(remaining, num_per_line)] )
+        format_codes.append('\n')
+        newlines += 1
+    return ''.join(format_codes).format(*values)
+
+def sample_values(fortran_format_code, count):
+    # count values, cycling through those of the kind of each field
+    kinds = [ code[-2] for code in FORMAT_CODES[fortran_format_code] ]
+    values = { kind : cycle(FIELD_VALUES[kind]) for kind in set(kinds) }
+    return [ next(values[kind]) for kind in islice(cycle(kinds), count) ]
+
+class FortranFormatTest(unittest.TestCase):
+    def counts(self, fortran_format_code):
+        # empty, partial first line, one line, a partial last line, and
+        # enough lines to go through every sample value of every field
+        n = len(FORMAT_CODES[fortran_format_code])
+        return [ 0, 1, n-1, n, n+1, 2*n+1, 3*n-1,
+                 n*max(map(len, FIELD_VALUES.values())) + 1 ]
+
+    def test_same_as_str_format(self):
+        for code in FORMAT_CODES:
+            for count in self.counts(code):
+                with self.subTest(code = code, count = count):
+                    values = sample_values(code, count)
+                    expected = legacy_fortran_format(code, values)
+                    self.assertEqual(fortran_format(code, values), expected)
+                    # from an iterator, which has no length
+                    self.assertEqual(fortran_format(code, iter(values)),
+                                     expected)
+
+    def test_same_as_str_format_from_arrays(self):
+        for code, typecode in ( ('10i8', 'q'), ('6f12.7', 'd'),
+                                ('5e16.8', 'd'), ('3e24.16', 'd') ):
+            for count in self.counts(code):
+                with self.subTest(code = code, count = count):
+                    values = array(typecode, sample_values(code, count))
+                    self.assertEqual(fortran_format(code, values),
+                                     legacy_fortran_format(code, values))
+
+    def test_chunks_join_to_the_whole(self):
+        for code in ( '20a4', '10i8', '3e25.17', 'i2,a78' ):
+            values = sample_values(code, 10*len(FORMAT_CODES[code]) + 3)
+            expected = legacy_fortran_format(code, values)
+            for chunk_lines in (1, 2, 3, 11):
+                with self.subTest(code = code, chunk_lines = chunk_lines):
+                    chunks = list(iter_fortran_format(code, values,
+                                                      chunk_lines))
+                    self.assertEqual(''.join(chunks), expected)
+                    self.assertTrue(all( chunk.count('\n') <= chunk_lines
+                                         for chunk in chunks ))
+
+    def test_formatted_size(self):
+        for code in PERCENT_CODES:
+            for count in self.counts(code):
+                with self.subTest(code = code, count = count):
+                    # values which fit their fields
+                    values = [ value if isinstance(value, str) else 0
+                               for value in sample_values(code, count) ]
+                    self.assertEqual(formatted_size(code, count),
+                                     len(fortran_format(code, values)))
+
+if __name__ == "__main__":
+    unittest.main()
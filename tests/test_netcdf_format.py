@@ -0,0 +1,134 @@
+import io
+import unittest
+
+from gromos2amber.netcdf_format import NetCDFWriter, STREAMING
+from gromos2amber.Configuration import Configuration, PICOSECONDS
+from gromos2amber.AmberConfigurationWriter import AmberNetCDFRestartWriter
+from .netcdf_reader import NetCDFFile
+
+CONFIGURATION = b"""TITLE
+two atoms
+END
+TIMESTEP
+        1000    2.500000000
+END
+POSITION
+    1 RES   A          1    0.100000000    0.200000000    0.300000000
+    1 RES   B          2    1.250000000   -0.500000000    2.000000000
+END
+VELOCITY
+    1 RES   A          1    0.010000000   -0.020000000    0.030000000
+    1 RES   B          2   -0.400000000    0.500000000   -0.600000000
+END
+GENBOX
+    1
+    3.000000000    3.500000000    4.000000000
+   90.000000000   90.000000000   90.000000000
+    0.000000000    0.000000000    0.000000000
+    0.000000000    0.000000000    0.000000000
+END
+"""
+
+class _Unseekable(io.BytesIO):
+    # a pipe, as far as NetCDFWriter can tell
+    def seekable(self): return False
+
+def write_example(output, num_records):
+    netcdf = NetCDFWriter(output)
+    netcdf.attribute("title", "example")
+    netcdf.attribute("count", 7)
+    netcdf.attribute("scale", 0.5)
+    netcdf.dimension("frame", None)
+    netcdf.dimension("spatial", 3)
+    netcdf.dimension("atom", 2)
+    netcdf.variable("spatial", 'c', ["spatial"], "xyz")
+    netcdf.variable("charge", 'd', ["atom"], [ 0.25, -0.25 ], units = "e")
+    netcdf.variable("time", 'f', ["frame"], units = "picosecond")
+    netcdf.variable("coordinates", 'f', ["frame", "atom", "spatial"])
+    for record in range(num_records):
+        netcdf.write_record({
+            "time" : [ float(record) ],
+            "coordinates" : [ record + 0.5*i for i in range(6) ],
+        })
+    netcdf.close()
+    return output.getvalue()
+
+class NetCDFWriterTest(unittest.TestCase):
+    def test_header(self):
+        netcdf = NetCDFFile(write_example(io.BytesIO(), 2))
+        self.assertEqual(netcdf.magic, b'CDF\x02')
+        self.assertEqual(netcdf.dimensions,
+                         [ ("frame", 0), ("spatial", 3), ("atom", 2) ])
+        self.assertEqual(netcdf.attributes,
+                         { "title" : "example", "count" : 7, "scale" : 0.5 })
+        self.assertEqual(list(netcdf.variables),
+                         [ "spatial", "charge", "time", "coordinates" ])
+        self.assertEqual(netcdf.variables["charge"].attributes,
+                         { "units" : "e" })
+        self.assertEqual(netcdf.variables["time"].dimension_ids, [ 0 ])
+        self.assertEqual(netcdf.variables["coordinates"].dimension_ids,
+                         [ 0, 2, 1 ])
+
+    def test_vsize_and_begin(self):
+        netcdf = NetCDFFile(write_example(io.BytesIO(), 2))
+        variables = netcdf.variables
+        # padded to 4 bytes, record variables per record
+        self.assertEqual([ variable.vsize for variable in variables.values() ],
+                         [ 4, 16, 4, 24 ])
+        # fixed-size variables follow the header, then the records
+        self.assertEqual(variables["spatial"].begin, netcdf.header_size)
+        self.assertEqual(variables["charge"].begin, netcdf.header_size + 4)
+        self.assertEqual(variables["time"].begin, netcdf.header_size + 20)
+        self.assertEqual(variables["coordinates"].begin,
+                         netcdf.header_size + 24)
+        self.assertEqual(len(netcdf.data),
+                         netcdf.header_size + 20 + 2*netcdf.record_size())
+
+    def test_values(self):
+        netcdf = NetCDFFile(write_example(io.BytesIO(), 2))
+        self.assertEqual(netcdf.values("spatial"), b"xyz")
+        self.assertEqual(list(netcdf.values("charge")), [ 0.25, -0.25 ])
+        for record in range(2):
+            self.assertEqual(list(netcdf.values("time", record)),
+                             [ float(record) ])
+            self.assertEqual(list(netcdf.values("coordinates", record)),
+                             [ record + 0.5*i for i in range(6) ])
+
+    def test_numrecs_of_seekable_output(self):
+        for num_records in (0, 1, 3):
+            netcdf = NetCDFFile(write_example(io.BytesIO(), num_records))
+            self.assertEqual(netcdf.numrecs, num_records)
+
+    def test_numrecs_of_unseekable_output(self):
+        data = write_example(_Unseekable(), 3)
+        self.assertEqual(NetCDFFile(data).numrecs, STREAMING)
+        # the rest of the file is the same as if it could seek
+        self.assertEqual(data[8:], write_example(io.BytesIO(), 3)[8:])
+
+class AmberNetCDFRestartWriterTest(unittest.TestCase):
+    def test_round_trip(self):
+        config = Configuration(CONFIGURATION)
+        output = io.BytesIO()
+        AmberNetCDFRestartWriter(config).write(output)
+        netcdf = NetCDFFile(output.getvalue())
+        self.assertEqual(netcdf.attributes["Conventions"], "AMBERRESTART")
+        self.assertEqual(netcdf.numrecs, 0)
+        self.assertEqual(list(netcdf.values("time")), [ 2.5 ])
+        self.assertEqual(list(netcdf.values("coordinates")),
+                         [ 1.0, 2.0, 3.0, 12.5, -5.0, 20.0 ])
+        velocities = netcdf.variables["velocities"]
+        self.assertEqual(velocities.attributes["scale_factor"], PICOSECONDS)
+        # angstrom per picosecond, once scaled
+        for value, expected in zip(netcdf.values("velocities"),
+                                   [ 0.1, -0.2, 0.3, -4.0, 5.0, -6.0 ]):
+            self.assertAlmostEqual(value*PICOSECONDS, expected)
+        self.assertEqual(list(netcdf.values("velocities")),
+                         list(config.velocities))
+        self.assertEqual(list(netcdf.values("cell_lengths")),
+                         [ 30.0, 35.0, 40.0 ])
+        self.assertEqual(list(netcdf.values("cell_angles")),
+                         [ 90.0, 90.0, 90.0 ])
+        self.assertEqual(netcdf.values("cell_angular"), b"alphabeta gamma")
+
+if __name__ == "__main__":
+    unittest.main()
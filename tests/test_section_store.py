@@ -0,0 +1,65 @@
+import io
+import os
+import sys
+import stat
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+from gromos2amber import convert
+from gromos2amber.SectionStore import SectionStore, read_manifest
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+ROOT = os.path.join(os.path.dirname(__file__), os.pardir)
+
+class SectionStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = SectionStore(os.path.join(self.directory, "store"))
+        self.manifest = os.path.join(self.directory, "out.manifest")
+        self.topology = os.path.join(DATA, "solvated.top")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def convert_to_store(self, num_solvent):
+        with open(self.manifest, "w") as f:
+            convert(self.topology, f, num_solvent = num_solvent,
+                    section_store = self.store)
+
+    def direct(self, num_solvent):
+        out = io.StringIO()
+        convert(self.topology, out, num_solvent = num_solvent)
+        return out.getvalue().encode()
+
+    def assemble(self):
+        environment = dict(os.environ, PYTHONPATH = os.path.abspath(ROOT))
+        return subprocess.run(
+            [ sys.executable, os.path.join(ROOT, "bin",
+                                           "gromos2amber_assemble"),
+              self.manifest, "--section_store", self.store.directory ],
+            check = True, capture_output = True, env = environment).stdout
+
+    def test_assembled_file_is_that_written_directly(self):
+        for num_solvent in (0, 4):
+            with self.subTest(num_solvent = num_solvent):
+                self.convert_to_store(num_solvent)
+                self.assertEqual(self.assemble(), self.direct(num_solvent))
+
+    def test_assemble_from_manifest(self):
+        self.convert_to_store(4)
+        out = io.BytesIO()
+        self.store.assemble(read_manifest(self.manifest), out)
+        self.assertEqual(out.getvalue(), self.direct(4))
+
+    def test_entries_are_readable_by_all(self):
+        self.convert_to_store(4)
+        for directory in (self.store.objects, self.store.keys):
+            for parent, _, names in os.walk(directory):
+                for name in names:
+                    mode = os.stat(os.path.join(parent, name)).st_mode
+                    self.assertEqual(stat.S_IMODE(mode), 0o644)
+
+if __name__ == "__main__":
+    unittest.main()
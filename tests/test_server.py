@@ -0,0 +1,92 @@
+import io
+import os
+import sys
+import shutil
+import asyncio
+import tempfile
+import unittest
+import subprocess
+
+from gromos2amber import Server
+from gromos2amber.Server import ConversionServer, ConversionClient
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+ROOT = os.path.join(os.path.dirname(__file__), os.pardir)
+
+class ConversionServerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def cli_topology(self, topology_in):
+        environment = dict(os.environ, PYTHONPATH = os.path.abspath(ROOT))
+        return subprocess.run(
+            [ sys.executable, os.path.join(ROOT, "bin", "gromos2amber"),
+              "--topology_in", topology_in ],
+            check = True, capture_output = True, env = environment).stdout
+
+    async def server_topology(self, topology_in):
+        path = os.path.join(self.directory, "server.sock")
+        server = ConversionServer(workers = 1)
+        await server.start(path = path)
+        try:
+            out = io.StringIO()
+            await ConversionClient(path = path).convert(topology_in, out)
+            return out.getvalue().encode()
+        finally:
+            server.close()
+
+    def test_without_configuration_matches_cli(self):
+        topology_in = os.path.join(DATA, "solvated.top")
+        served = asyncio.run(self.server_topology(topology_in))
+        self.assertEqual(served, self.cli_topology(topology_in))
+
+    def test_dead_worker_fails_only_its_request(self):
+        topology_in = os.path.join(DATA, "solvated.top")
+        with open(topology_in) as f:
+            topology = f.read()
+        expected = self.cli_topology(topology_in)
+        path = os.path.join(self.directory, "server.sock")
+        # workers are forked from this process when the first request is
+        # submitted, so they convert with the patched function
+        Server._convert_request = _crash_on_marker
+        async def run():
+            server = ConversionServer(workers = 2)
+            await server.start(path = path)
+            client = ConversionClient(path = path)
+            request = lambda text: client.request(
+                "POST", "/convert", { "topology" : text })
+            try:
+                responses = await asyncio.gather(
+                    request(topology), request(CRASH + topology),
+                    request(topology), request(topology))
+                after = await request(topology)
+                return responses, after, await client.status()
+            finally:
+                server.close()
+        try:
+            responses, after, status = asyncio.run(run())
+        finally:
+            Server._convert_request = _convert_request
+        self.assertEqual([ code for code, _ in responses ],
+                         [ 200, 500, 200, 200 ])
+        self.assertIn("worker process died", responses[1][1]["error"])
+        for code, response in responses[:1] + responses[2:] + [ after ]:
+            self.assertEqual(response["topology"].encode(), expected)
+        self.assertEqual(after[0], 200)
+        self.assertEqual(status["converted"], 4)
+        self.assertEqual(status["failed"], 1)
+
+CRASH = "CRASH\n"
+_convert_request = Server._convert_request
+
+def _crash_on_marker(request):
+    # a worker converting a request which starts with CRASH dies
+    if request["topology"].startswith(CRASH):
+        os._exit(1)
+    return _convert_request(request)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from gromos2amber.TopologyCache import TopologyCache, SUBDIRECTORY
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+
+class TopologyCachePruneTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_prune_keeps_foreign_files(self):
+        foreign = os.path.join(self.directory, "my_results")
+        os.makedirs(foreign)
+        with open(os.path.join(foreign, "result.txt"), "w") as f:
+            f.write("keep me\n")
+        with open(os.path.join(self.directory, "notes.txt"), "w") as f:
+            f.write("keep me too\n")
+        cache = TopologyCache(self.directory)
+        cache.load(os.path.join(DATA, "solvated.top"))
+        cache.prune()
+        self.assertTrue(os.path.exists(os.path.join(foreign, "result.txt")))
+        self.assertTrue(os.path.exists(os.path.join(self.directory,
+                                                    "notes.txt")))
+
+    def test_prune_removes_other_versions(self):
+        old = os.path.join(self.directory, SUBDIRECTORY, "0.0.0-1")
+        os.makedirs(old)
+        cache = TopologyCache(self.directory)
+        cache.prune()
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.isdir(cache.entries))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+import io
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+
+from gromos2amber import convert_trajectory
+from gromos2amber.Trajectory import iter_frames
+from gromos2amber.AmberTrajectoryWriter import AmberNetCDFTrajectoryWriter
+from .netcdf_reader import NetCDFFile
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+NUM_ATOMS = 36 # of solvated.top
+NUM_FRAMES = 3
+TIMESTEP = 0.002
+BOX = [ 4.0, 4.5, 5.0 ]
+
+# nm, close enough together that gathering molecules moves none of them
+def position(frame, atom):
+    return [ 1.0 + 0.02*(atom % 6) + 0.001*frame,
+             1.0 + 0.02*(atom // 6),
+             1.5 - 0.001*frame ]
+
+def write_trajectory(path):
+    with gzip.open(path, "wt") as f:
+        f.write("TITLE\nsynthetic trajectory\nEND\n")
+        for frame in range(NUM_FRAMES):
+            f.write("TIMESTEP\n{:15d}{:15.9f}\nEND\n".format(
+                frame*10, frame*TIMESTEP))
+            f.write("POSITIONRED\n")
+            for atom in range(NUM_ATOMS):
+                f.write("{:15.9f}{:15.9f}{:15.9f}\n".format(
+                    *position(frame, atom)))
+            f.write("END\nGENBOX\n    1\n")
+            f.write("{:15.9f}{:15.9f}{:15.9f}\n".format(*BOX))
+            f.write("{:15.9f}{:15.9f}{:15.9f}\n".format(90.0, 90.0, 90.0))
+            f.write("{:15.9f}{:15.9f}{:15.9f}\n".format(0.0, 0.0, 0.0)*2)
+            f.write("END\n")
+
+class ConvertTrajectoryTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.trajectory = os.path.join(self.directory, "traj.trc.gz")
+        write_trajectory(self.trajectory)
+        self.topology = os.path.join(DATA, "solvated.top")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_netcdf(self):
+        path = os.path.join(self.directory, "traj.nc")
+        with open(path, "wb") as f:
+            num_frames = convert_trajectory(self.topology, self.trajectory, f)
+        self.assertEqual(num_frames, NUM_FRAMES)
+        with open(path, "rb") as f:
+            netcdf = NetCDFFile(f.read())
+        self.assertEqual(netcdf.numrecs, NUM_FRAMES)
+        self.assertEqual(netcdf.attributes["title"], "synthetic trajectory")
+        # the record variables of each frame are interleaved, in order
+        records = [ "time", "coordinates", "cell_lengths", "cell_angles" ]
+        self.assertEqual([ name for name in netcdf.variables
+                           if netcdf.is_record(name) ], records)
+        begin = netcdf.variables["time"].begin
+        for name in records:
+            self.assertEqual(netcdf.variables[name].begin, begin)
+            begin += netcdf.variables[name].vsize
+        self.assertEqual(begin - netcdf.variables["time"].begin,
+                         netcdf.record_size())
+        self.assertEqual(len(netcdf.data), netcdf.variables["time"].begin
+                                           + NUM_FRAMES*netcdf.record_size())
+        for frame in range(NUM_FRAMES):
+            time, = netcdf.values("time", frame)
+            self.assertAlmostEqual(time, frame*TIMESTEP, places = 6)
+            coordinates = netcdf.values("coordinates", frame)
+            self.assertEqual(len(coordinates), 3*NUM_ATOMS)
+            for atom in range(NUM_ATOMS):
+                for value, expected in zip(coordinates[3*atom:3*atom+3],
+                                           position(frame, atom)):
+                    self.assertAlmostEqual(value, 10.0*expected, places = 4)
+            self.assertEqual(list(netcdf.values("cell_lengths", frame)),
+                             [ 10.0*length for length in BOX ])
+            self.assertEqual(list(netcdf.values("cell_angles", frame)),
+                             [ 90.0 ]*3)
+
+    def test_numrecs_is_updated_with_each_frame(self):
+        output = io.BytesIO()
+        writer = AmberNetCDFTrajectoryWriter(output)
+        for number, frame in enumerate(iter_frames(self.trajectory), 1):
+            writer.write_frame(frame)
+            self.assertEqual(NetCDFFile(output.getvalue()).numrecs, number)
+        writer.close()
+        self.assertEqual(number, NUM_FRAMES)
+
+    def test_mdcrd(self):
+        out = io.StringIO()
+        num_frames = convert_trajectory(self.topology, self.trajectory, out,
+                                        netcdf = False)
+        self.assertEqual(num_frames, NUM_FRAMES)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], "synthetic trajectory")
+        # ten values a line, then the box on a line of its own
+        lines_per_frame = (3*NUM_ATOMS + 9)//10 + 1
+        self.assertEqual(len(lines), 1 + NUM_FRAMES*lines_per_frame)
+        for frame in range(NUM_FRAMES):
+            start = 1 + frame*lines_per_frame
+            values = [ float(line[i:i+8])
+                       for line in lines[start:start+lines_per_frame-1]
+                       for i in range(0, len(line), 8) ]
+            expected = [ 10.0*x for atom in range(NUM_ATOMS)
+                         for x in position(frame, atom) ]
+            self.assertEqual(len(values), len(expected))
+            for value, x in zip(values, expected):
+                self.assertAlmostEqual(value, x, places = 3)
+            self.assertEqual(lines[start+lines_per_frame-1],
+                             "  40.000  45.000  50.000")
+
+if __name__ == "__main__":
+    unittest.main()
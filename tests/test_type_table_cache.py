@@ -0,0 +1,40 @@
+import os
+import unittest
+
+from gromos2amber.Topology import Topology, BoundedCache
+from gromos2amber import AmberTopologyWriter as writer
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+
+class BoundedCacheTest(unittest.TestCase):
+    def test_keeps_the_most_recently_used(self):
+        cache = BoundedCache(3)
+        created = []
+        def value_of(key):
+            return cache.get(key, lambda: created.append(key) or key*2)
+        for key in range(5):
+            self.assertEqual(value_of(key), key*2)
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(value_of(2), 4)
+        value_of(5)
+        self.assertTrue(2 in cache)
+        self.assertFalse(3 in cache)
+        self.assertEqual(created, [ 0, 1, 2, 3, 4, 5 ])
+
+class TypeTableSectionsTest(unittest.TestCase):
+    def test_sections_of_many_force_fields_are_bounded(self):
+        sections = writer._type_table_sections
+        topology = Topology(os.path.join(DATA, "solvated.top"))
+        amber = writer.AmberTopologyWriter(topology)
+        title = "LENNARD_JONES_ACOEF"
+        values = list(amber.LENNARD_JONES_ACOEF())
+        format_string = writer.SECTIONS_BY_TITLE[title].format_string
+        expected = list(writer.iter_fortran_format(format_string, values))
+        for i in range(2*sections.max_entries):
+            topology.type_table_key = str(i)
+            body = amber._iter_section_body(title, values, format_string)
+            self.assertEqual("".join(body), "".join(expected))
+        self.assertEqual(len(sections), sections.max_entries)
+
+if __name__ == "__main__":
+    unittest.main()